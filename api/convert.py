@@ -1,108 +1,1897 @@
 from http.server import BaseHTTPRequestHandler
-import pandas as pd
+import numpy as np
+import importlib
 import io
 import json
 import re
-import cgi
+import os
+import hashlib
+import tempfile
+import time
+import uuid
+import threading
+import queue
+import shutil
+import socket
+import sqlite3
+import sys
+import tracemalloc
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager, nullcontext
+from email.parser import HeaderParser
+import zipfile
+import zlib
+import itertools
+import multiprocessing
+import posixpath
+import xml.etree.ElementTree as ET
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+from openpyxl.utils.datetime import from_excel, from_ISO8601, CALENDAR_WINDOWS_1900, CALENDAR_MAC_1904
+from openpyxl.styles.numbers import builtin_format_code, is_date_format, is_timedelta_format
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access, after
+    which the module-level name is rebound to the real module. pandas is a
+    large part of a cold start and upload, get_preview and (in a fresh
+    process) get_headers never need it.
+    """
+
+    def __init__(self, name, binding):
+        self._name = name
+        self._binding = binding
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # One import at a time: a thread importing the module (or one of its
+        # submodules) while another is half way through it can be handed the
+        # partially initialized module
+        with self._lock:
+            module = importlib.import_module(self._name)
+        globals()[self._binding] = module
+        return module
+
+    def _loading(self):
+        return self._lock.locked()
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+pd = LazyModule('pandas', 'pd')
+
+
+def pandas_loaded():
+    """pandas is imported, and not still being imported by another thread"""
+    return 'pandas' in sys.modules and not (isinstance(pd, LazyModule) and pd._loading())
+
+
+def warm_up_pandas():
+    """Import pandas on a background thread, ahead of the request that needs it"""
+    if isinstance(pd, LazyModule) and not pd._loading():
+        threading.Thread(target=pd._load, daemon=True).start()
+
+# Requests with a body larger than this are rejected before it is read
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(64 * 1024 * 1024)))
+# Uploaded files bigger than this are spilled from memory to a temporary file
+UPLOAD_SPOOL_BYTES = int(os.environ.get('UPLOAD_SPOOL_BYTES', str(8 * 1024 * 1024)))
+MULTIPART_CHUNK_BYTES = 64 * 1024
+# Number of raw rows shown by get_preview
+PREVIEW_ROWS = 10
+# Rows scanned for the header when header_row is omitted
+HEADER_SCAN_ROWS = 30
+# Rows per get_rows page when no limit is given, and the largest page allowed
+ROW_WINDOW_ROWS = 30
+ROW_WINDOW_MAX_ROWS = 1000
+# Raw download formats for the 'format' form field and their content types
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+# Rows serialized per chunk when streaming a download
+EXPORT_CHUNK_ROWS = 5000
+# Rows cleaned between progress reports when a job cleans a frame
+CLEAN_PROGRESS_ROWS = 10000
+# Responses are gzip-compressed for clients that accept it once the body
+# reaches this many bytes
+GZIP_MIN_BYTES = int(os.environ.get('GZIP_MIN_BYTES', '1024'))
+GZIP_LEVEL = 6
+MULTIPART_MAX_HEADER_BYTES = 16 * 1024
+# Set TRACE_MEMORY=1 to record the tracemalloc peak of every request stage.
+# Tracing slows Python allocations down a lot, so it is off by default. Stages
+# that overlap another thread's stages are left out (see StageMemoryTracer)
+TRACE_MEMORY = os.environ.get('TRACE_MEMORY', '') == '1'
+# Set TYPED_FRAMES=1 to store cleaned frames with numeric columns as float64
+# and repeated text as categories (see handler.type_frame)
+TYPED_FRAMES = os.environ.get('TYPED_FRAMES', '') == '1'
+# Cell text read_excel turns into NaN (pandas' default na_values)
+PANDAS_NA_STRINGS = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+])
+# Text that stands for a missing number in an otherwise numeric column
+NULL_MARKERS = ('--', '-', 'na', 'n/a', 'n.a.', 'nil')
+# Text columns become categories when at most this share of values is distinct
+CATEGORY_MAX_DISTINCT = 0.5
+
+
+class MultipartError(ValueError):
+    """Raised when a multipart/form-data body cannot be parsed"""
+
+
+class UploadTooLarge(MultipartError):
+    """Raised when the request body is over the upload size limit"""
+
+
+class InvalidRequest(ValueError):
+    """A form field with a value that cannot be used (sent back as a 400)"""
+
+
+class UploadedFile:
+    """
+    An uploaded workbook: a seekable file object plus its size and SHA-256
+    (computed while the upload was streamed in).
+    """
+
+    def __init__(self, file, size, sha256, filename=''):
+        self.file = file
+        self.size = size
+        self.sha256 = sha256
+        self.filename = filename
+
+    @classmethod
+    def from_bytes(cls, data, sha256=None, filename=''):
+        # BytesIO shares the bytes object until it is written to, so this
+        # does not copy the workbook
+        return cls(io.BytesIO(data), len(data), sha256 or hashlib.sha256(data).hexdigest(), filename)
+
+    def open(self):
+        """Return the file object rewound to the start"""
+        self.file.seek(0)
+        return self.file
+
+    def read(self):
+        return self.open().read()
+
+    def close(self):
+        self.file.close()
+
+
+class MultipartForm:
+    """
+    Streaming multipart/form-data parser. The body is read from `fp` in
+    chunks: text fields are kept as strings and file parts are written
+    straight to a SpooledTemporaryFile, so an upload is held at most once.
+    """
+
+    def __init__(self, fp, content_type, content_length, max_bytes=MAX_UPLOAD_BYTES):
+        self.fields = {}
+        self.files = {}
+        
+        match = re.search(r'boundary=(?:"([^"]+)"|([^;\s]+))', content_type)
+        if not match:
+            raise MultipartError('Missing multipart boundary')
+        boundary = (match.group(1) or match.group(2)).encode('latin-1')
+        
+        if content_length <= 0:
+            raise MultipartError('Missing request body')
+        if content_length > max_bytes:
+            raise UploadTooLarge(f'Upload is {content_length} bytes, the limit is {max_bytes} bytes')
+        
+        self._fp = fp
+        self._remaining = content_length
+        self._buffer = b''
+        # Time spent waiting on the request body, as opposed to parsing it
+        self.read_seconds = 0.0
+        try:
+            self._parse(boundary)
+        except Exception:
+            self.close()
+            raise
+
+    def getvalue(self, name, default=None):
+        return self.fields.get(name, default)
+
+    def __contains__(self, name):
+        return name in self.fields or name in self.files
+
+    def close(self):
+        for upload in self.files.values():
+            upload.close()
+
+    def _parse(self, boundary):
+        delimiter = b'--' + boundary
+        
+        # Skip the preamble up to the first boundary
+        self._read_until(delimiter)
+        
+        while True:
+            # After a boundary, '--' ends the body and CRLF starts a part
+            self._need(2)
+            if self._buffer.startswith(b'--'):
+                break
+            if not self._buffer.startswith(b'\r\n'):
+                raise MultipartError('Malformed multipart boundary')
+            
+            # The CRLF ending the boundary line doubles as the start of the
+            # header block, so a part without headers still parses
+            header_block = io.BytesIO()
+            self._read_until(b'\r\n\r\n', header_block, limit=MULTIPART_MAX_HEADER_BYTES)
+            headers = HeaderParser().parsestr(header_block.getvalue()[2:].decode('utf-8', 'replace'))
+            name = headers.get_param('name', header='content-disposition')
+            filename = headers.get_param('filename', header='content-disposition')
+            
+            if filename is not None:
+                spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+                digest = hashlib.sha256()
+                size = self._read_until(b'\r\n' + delimiter, spool, digest)
+                if name and size:
+                    self.files[name] = UploadedFile(spool, size, digest.hexdigest(), filename)
+                else:
+                    spool.close()
+            else:
+                value = io.BytesIO()
+                self._read_until(b'\r\n' + delimiter, value)
+                if name:
+                    self.fields[name] = value.getvalue().decode('utf-8', 'replace')
+        
+        # Discard the epilogue
+        self._buffer = b''
+        while self._fill():
+            self._buffer = b''
+
+    def _fill(self):
+        """Append the next chunk of the body to the buffer, False at the end"""
+        if self._remaining <= 0:
+            return False
+        start = time.perf_counter()
+        chunk = self._fp.read(min(MULTIPART_CHUNK_BYTES, self._remaining))
+        self.read_seconds += time.perf_counter() - start
+        if not chunk:
+            raise MultipartError('Request body ended early')
+        self._remaining -= len(chunk)
+        self._buffer += chunk
+        return True
+
+    def _need(self, size):
+        while len(self._buffer) < size:
+            if not self._fill():
+                raise MultipartError('Unexpected end of multipart body')
+
+    def _read_until(self, marker, out=None, digest=None, limit=None):
+        """
+        Consume the body up to and including `marker`, writing everything
+        before it to `out`. Returns the number of bytes written.
+        """
+        size = 0
+        # Hold back enough bytes to catch a marker split across chunks
+        keep = len(marker) - 1
+        while True:
+            pos = self._buffer.find(marker)
+            if pos >= 0:
+                data = self._buffer[:pos]
+                self._buffer = self._buffer[pos + len(marker):]
+            elif len(self._buffer) > keep:
+                data = self._buffer[:len(self._buffer) - keep]
+                self._buffer = self._buffer[len(self._buffer) - keep:]
+            else:
+                data = b''
+            
+            if data:
+                size += len(data)
+                if limit is not None and size > limit:
+                    raise MultipartError('Multipart headers too large')
+                if out is not None:
+                    out.write(data)
+                if digest is not None:
+                    digest.update(data)
+            
+            if pos >= 0:
+                return size
+            if not self._fill():
+                raise MultipartError('Unexpected end of multipart body')
+
+
+class StageMemoryTracer:
+    """
+    tracemalloc peaks of request stages. tracemalloc is process-wide, so
+    tracing is started once and left on, and the peak is reset only when no
+    stage is open. A stage that overlapped a stage of another thread reports
+    no peak, since the peak would include that thread's allocations. Work
+    outside stages (background jobs, the pandas warm-up) is not seen, so the
+    peaks only mean something with one request thread and no jobs running.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # token -> [thread ident, overlapped] of every open stage
+        self._open = {}
+        self._tokens = itertools.count()
+
+    def begin(self):
+        """Start tracing a stage, return its token"""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            if not self._open:
+                tracemalloc.reset_peak()
+            thread = threading.get_ident()
+            overlapped = False
+            for entry in self._open.values():
+                if entry[0] != thread:
+                    entry[1] = overlapped = True
+            token = next(self._tokens)
+            self._open[token] = [thread, overlapped]
+            return token
+
+    def end(self, token):
+        """Return the stage's peak in bytes, or None if it overlapped another thread's stage"""
+        with self._lock:
+            _, overlapped = self._open.pop(token)
+            return None if overlapped else tracemalloc.get_traced_memory()[1]
+
+
+stage_memory_tracer = StageMemoryTracer()
+
+
+class RequestTimer:
+    """
+    Wall-clock time spent in each stage of one request (body read,
+    multipart parsing, read_excel, cleaning, ...). A stage that runs more
+    than once accumulates. With `trace_memory` the tracemalloc peak of each
+    stage is recorded as well (see StageMemoryTracer).
+    """
+
+    def __init__(self, trace_memory=TRACE_MEMORY):
+        self.start = time.perf_counter()
+        self.stages = OrderedDict()
+        self.memory_peaks = OrderedDict()
+        self.info = {}
+        self.trace_memory = trace_memory
+
+    @contextmanager
+    def stage(self, name):
+        token = stage_memory_tracer.begin() if self.trace_memory else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+            if token is not None:
+                peak = stage_memory_tracer.end(token)
+                if peak is not None:
+                    self.memory_peaks[name] = max(self.memory_peaks.get(name, 0), peak)
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        """Server-Timing header value for the stages finished so far"""
+        metrics = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.stages.items()]
+        metrics.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def record(self):
+        """Request info plus timings (and memory peaks) as a log record"""
+        record = dict(self.info)
+        record['duration_ms'] = round(self.elapsed() * 1000, 1)
+        record['stages_ms'] = {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()}
+        if self.trace_memory:
+            record['memory_peak_bytes'] = dict(self.memory_peaks)
+        return record
+
+
+# Uploaded workbooks are kept in-process so later review steps can refer to
+# them by ID instead of re-sending the whole file
+WORKBOOK_TTL_SECONDS = int(os.environ.get('WORKBOOK_TTL_SECONDS', '900'))
+WORKBOOK_STORE_MAX_BYTES = int(os.environ.get('WORKBOOK_STORE_MAX_BYTES', str(200 * 1024 * 1024)))
+
+
+class WorkbookStore:
+    """
+    In-memory store of uploaded workbook bytes (with their SHA-256 and
+    filename) keyed by workbook ID.
+    Entries expire after `ttl` seconds and the least recently used ones are
+    evicted once the total size goes over `max_bytes`.
+    """
+
+    def __init__(self, ttl=WORKBOOK_TTL_SECONDS, max_bytes=WORKBOOK_STORE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, upload):
+        """Store an UploadedFile's bytes and return the new workbook ID"""
+        data = upload.read()
+        workbook_id = uuid.uuid4().hex
+        with self._lock:
+            self._expire()
+            self._entries[workbook_id] = (data, upload.sha256, upload.filename, time.monotonic() + self.ttl)
+            self.total_bytes += len(data)
+            # Evict least recently used entries, but always keep the new one
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                _, (old_data, _, _, _) = self._entries.popitem(last=False)
+                self.total_bytes -= len(old_data)
+        return workbook_id
+
+    def get(self, workbook_id):
+        """Return the workbook as an UploadedFile, or None if unknown or expired"""
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(workbook_id)
+            if entry is None:
+                return None
+            data, sha256, filename, _ = entry
+            # Refresh expiry and LRU position on every access
+            self._entries[workbook_id] = (data, sha256, filename, time.monotonic() + self.ttl)
+            self._entries.move_to_end(workbook_id)
+        return UploadedFile.from_bytes(data, sha256, filename)
+
+    def _expire(self):
+        now = time.monotonic()
+        for workbook_id in [k for k, (_, _, _, expires) in self._entries.items() if expires <= now]:
+            data, _, _, _ = self._entries.pop(workbook_id)
+            self.total_bytes -= len(data)
+
+
+class DirectoryWorkbookStore:
+    """
+    WorkbookStore with the same put/get interface that keeps workbooks as
+    files in `directory`, so every process of a multi-worker server (see
+    scripts/serve.py) sees the same uploads. Each workbook is stored as
+    `<id>` plus a `<id>.json` sidecar holding its SHA-256 and filename.
+    Expiry is based on the file's modification time, which get() refreshes.
+    """
+
+    def __init__(self, directory, ttl=WORKBOOK_TTL_SECONDS, max_bytes=WORKBOOK_STORE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, upload):
+        """Store an UploadedFile's bytes and return the new workbook ID"""
+        data = upload.read()
+        workbook_id = uuid.uuid4().hex
+        path = os.path.join(self.directory, workbook_id)
+        # Write the metadata first and rename the data into place last, so a
+        # concurrent get() never sees a half-written workbook
+        with open(path + '.json', 'w') as f:
+            json.dump({'sha256': upload.sha256, 'filename': upload.filename}, f)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        self._expire(keep=workbook_id)
+        return workbook_id
+
+    def get(self, workbook_id):
+        """Return the workbook as an UploadedFile, or None if unknown or expired"""
+        if not re.fullmatch(r'[0-9a-f]{32}', workbook_id or ''):
+            return None
+        path = os.path.join(self.directory, workbook_id)
+        try:
+            if os.path.getmtime(path) + self.ttl <= time.time():
+                return None
+            with open(path + '.json') as f:
+                meta = json.load(f)
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Refresh expiry and LRU position on every access
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            return None
+        return UploadedFile.from_bytes(data, meta['sha256'], meta['filename'])
+
+    def _expire(self, keep=None):
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.directory):
+            if '.' in entry.name:
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.name))
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        for mtime, size, workbook_id in entries:
+            # Drop expired entries, then the least recently used ones until
+            # the total size fits, but always keep the new one
+            if workbook_id == keep or (mtime + self.ttl > now and total_bytes <= self.max_bytes):
+                continue
+            for suffix in ('', '.json'):
+                try:
+                    os.remove(os.path.join(self.directory, workbook_id) + suffix)
+                except FileNotFoundError:
+                    pass
+            total_bytes -= size
+
+
+# Set to a directory to keep uploaded workbooks on disk instead of in memory,
+# e.g. when several server processes share the review steps
+WORKBOOK_STORE_DIR = os.environ.get('WORKBOOK_STORE_DIR', '')
+
+workbook_store = DirectoryWorkbookStore(WORKBOOK_STORE_DIR) if WORKBOOK_STORE_DIR else WorkbookStore()
+
+# Parsed frames are cached by file content so repeated actions on the same
+# upload skip the Excel parse and cleaning entirely
+FRAME_CACHE_MAX_BYTES = int(os.environ.get('FRAME_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+
+def frame_nbytes(df):
+    """Approximate in-memory size of a DataFrame, including object values"""
+    if df is None:
+        return 0
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class FrameCache:
+    """
+    LRU cache of (raw, cleaned) DataFrames keyed by (SHA-256 of the upload,
+    header_row). Evicts least recently used entries once the total memory
+    footprint goes over `max_bytes`. Cached frames are shared between
+    requests and must not be modified in place.
+    """
+
+    def __init__(self, max_bytes=FRAME_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (df_raw, df_cleaned) for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            df_raw, df_cleaned, _ = entry
+            return df_raw, df_cleaned
+
+    def put(self, key, df_raw, df_cleaned):
+        size = frame_nbytes(df_raw)
+        if df_cleaned is not df_raw:
+            size += frame_nbytes(df_cleaned)
+        # Never cache a single entry larger than the whole budget
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[2]
+            self._entries[key] = (df_raw, df_cleaned, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, (_, _, old_size) = self._entries.popitem(last=False)
+                self.total_bytes -= old_size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'total_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+
+frame_cache = FrameCache()
+
+# Serialized downloads are cached by everything that determines their bytes,
+# so re-downloading the same export is served without re-running it
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+# Set to a directory to keep results evicted from memory (and results from
+# other processes) on disk, up to RESULT_CACHE_DIR_MAX_BYTES
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', '')
+RESULT_CACHE_DIR_MAX_BYTES = int(os.environ.get('RESULT_CACHE_DIR_MAX_BYTES', str(512 * 1024 * 1024)))
+# Form fields that change a convert / filter_testing_columns download
+RESULT_KEY_FIELDS = ('engine', 'header_row', 'columns', 'exclude_row_indices', 'post_merger_deletions',
+                     'split_dates', 'sheets', 'merger_match')
+# Bump when a code change alters the bytes of a download, so cached results
+# and the ETags clients hold stop matching
+RESULT_CACHE_VERSION = 2
+
+
+def result_key(sha256, action, export_format, fields, header_rows):
+    """
+    Hex digest identifying a download: the upload's SHA-256, the request
+    fields and the (header_row, header_info) each sheet resolved to. A
+    detected header row can change for the same fields once ColumnResolver
+    has learned the sheet's layout, so the raw header_row field is not enough.
+    """
+    parts = [RESULT_CACHE_VERSION, sha256, action, export_format]
+    parts.extend(fields.get(name, '') for name in RESULT_KEY_FIELDS)
+    parts.append(header_rows)
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    LRU cache of serialized downloads (body bytes plus their count headers)
+    keyed by result_key. Evicts least recently used entries once the total
+    size goes over `max_bytes`. With a `directory`, every result is also
+    written there as `<key>.bin` / `<key>.json` and memory misses fall back
+    to it, so results survive eviction and are shared between processes.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, directory=RESULT_CACHE_DIR,
+                 directory_max_bytes=RESULT_CACHE_DIR_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.directory_max_bytes = directory_max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        """Return (body, counts) for key, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        
+        entry = self._read(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._remember(key, *entry)
+        return entry
+
+    def put(self, key, body, counts):
+        # Never cache a single entry larger than the whole budget
+        if len(body) > max(self.max_bytes, self.directory_max_bytes if self.directory else 0):
+            return
+        self._remember(key, body, counts)
+        if self.directory:
+            self._write(key, body, counts)
+
+    def _remember(self, key, body, counts):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= len(old[0])
+            self._entries[key] = (body, counts)
+            self.total_bytes += len(body)
+            while self.total_bytes > self.max_bytes:
+                _, (old_body, _) = self._entries.popitem(last=False)
+                self.total_bytes -= len(old_body)
+                self.evictions += 1
+
+    def _read(self, key):
+        if not self.directory:
+            return None
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path + '.json') as f:
+                counts = json.load(f)
+            with open(path + '.bin', 'rb') as f:
+                body = f.read()
+            # Refresh the LRU position on disk
+            os.utime(path + '.bin')
+        except (FileNotFoundError, ValueError):
+            return None
+        return body, counts
+
+    def _write(self, key, body, counts):
+        path = os.path.join(self.directory, key)
+        # The body is renamed into place last, so readers never see a
+        # partial file
+        with open(path + '.json', 'w') as f:
+            json.dump(counts, f)
+        with open(f'{path}.{uuid.uuid4().hex}.tmp', 'wb') as f:
+            f.write(body)
+        os.replace(f.name, path + '.bin')
+        
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.bin'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.name[:-4]))
+        entries.sort()
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, old_key in entries:
+            if total_bytes <= self.directory_max_bytes or old_key == key:
+                break
+            for suffix in ('.bin', '.json'):
+                try:
+                    os.remove(os.path.join(self.directory, old_key) + suffix)
+                except FileNotFoundError:
+                    pass
+            total_bytes -= size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'total_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'directory': self.directory or None
+            }
+
+
+result_cache = ResultCache()
+
+
+# convert and filter_testing_columns can run as background jobs (async=1)
+# when a workbook would not finish inside the function's time budget
+JOB_ACTIONS = ('convert', 'filter_testing_columns')
+# Tells the UI (via the upload response) that this process outlives its
+# requests, so it may send large exports as jobs. Off on Vercel, where an
+# instance can be frozen with the job half done; scripts/serve.py sets it
+ASYNC_JOBS = os.environ.get('ASYNC_JOBS', '') == '1'
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+# Jobs waiting for a worker; submissions beyond this are rejected with a 503
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', '8'))
+JOB_STORE_DIR = os.environ.get('JOB_STORE_DIR', os.path.join(tempfile.gettempdir(), 'newfunds-jobs'))
+JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', '3600'))
+JOB_RESULT_CHUNK_BYTES = 64 * 1024
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the job queue is full"""
+
+
+def process_owner():
+    """Identify this process as the owner of the jobs it runs"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def owner_alive(owner):
+    """
+    Whether the process that owns a job is still running. Owners on another
+    host (a shared job directory) or from before owners were recorded are
+    assumed to be alive.
+    """
+    if not owner:
+        return True
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        return True
+    return True
+
+
+@contextmanager
+def _closing_transaction(db):
+    """Commit (or roll back) and close a sqlite3 connection"""
+    try:
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+class SQLiteJobStore:
+    """
+    Job records in a SQLite database, with each job's input workbook and
+    result file stored next to it in `directory`. Jobs are deleted
+    `ttl` seconds after they were submitted. Each job records the process
+    that owns it (see process_owner) so one lost with its process can be
+    told apart from one still running.
+    
+    JobRunner only uses create / get / update / delete / input_path /
+    result_path, so another backend with those methods can replace it.
+    """
+
+    def __init__(self, directory=JOB_STORE_DIR, ttl=JOB_TTL_SECONDS):
+        self.directory = directory
+        self.ttl = ttl
+        self._initialized = False
+        self._lock = threading.Lock()
+
+    def create(self, action, fields, upload, owner=None):
+        """Save the upload and a queued job record, return the job ID"""
+        self._purge_expired()
+        job_id = uuid.uuid4().hex
+        with open(self.input_path(job_id), 'wb') as f:
+            shutil.copyfileobj(upload.open(), f)
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                'INSERT INTO jobs (id, action, fields, filename, sha256, size, status, progress, owner, created, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, action, json.dumps(fields), upload.filename, upload.sha256, upload.size,
+                 'queued', json.dumps({'stage': 'queued'}), owner, now, now)
+            )
+        return job_id
+
+    def get(self, job_id):
+        """Return the job as a dict, or None if it does not exist"""
+        with self._connect() as db:
+            row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for name in ('fields', 'progress', 'summary'):
+            job[name] = json.loads(job[name]) if job[name] else None
+        return job
+
+    def update(self, job_id, **changes):
+        """Update status / progress / summary / error of a job"""
+        for name in ('progress', 'summary'):
+            if name in changes:
+                changes[name] = json.dumps(changes[name])
+        changes['updated'] = time.time()
+        assignments = ', '.join(f'{name} = ?' for name in changes)
+        with self._connect() as db:
+            db.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*changes.values(), job_id))
+
+    def delete(self, job_id):
+        with self._connect() as db:
+            db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        for path in (self.input_path(job_id), self.result_path(job_id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def input_path(self, job_id):
+        return os.path.join(self.directory, f'{job_id}.input')
+
+    def result_path(self, job_id):
+        return os.path.join(self.directory, f'{job_id}.result')
+
+    def _connect(self):
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    os.makedirs(self.directory, exist_ok=True)
+                    with sqlite3.connect(os.path.join(self.directory, 'jobs.db')) as db:
+                        db.execute(
+                            'CREATE TABLE IF NOT EXISTS jobs ('
+                            'id TEXT PRIMARY KEY, action TEXT, fields TEXT, filename TEXT, sha256 TEXT, '
+                            'size INTEGER, status TEXT, progress TEXT, summary TEXT, error TEXT, '
+                            'owner TEXT, created REAL, updated REAL)'
+                        )
+                        columns = {row[1] for row in db.execute('PRAGMA table_info(jobs)')}
+                        if 'owner' not in columns:
+                            db.execute('ALTER TABLE jobs ADD COLUMN owner TEXT')
+                    self._initialized = True
+        db = sqlite3.connect(os.path.join(self.directory, 'jobs.db'), timeout=10)
+        db.row_factory = sqlite3.Row
+        return _closing_transaction(db)
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.ttl
+        with self._connect() as db:
+            expired = [row['id'] for row in db.execute('SELECT id FROM jobs WHERE created < ?', (cutoff,))]
+        for job_id in expired:
+            self.delete(job_id)
+
+
+class JobRunner:
+    """
+    Runs jobs from a bounded queue on a pool of background threads, which
+    are started with the first submission. The work itself is done by
+    JobWorker with the same methods the synchronous actions use.
+    """
+
+    def __init__(self, store, workers=JOB_WORKERS, queue_size=JOB_QUEUE_SIZE):
+        self.store = store
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        # Queued and running job IDs, and whether shutdown() has been called
+        self._unfinished = set()
+        self._closed = False
+
+    def submit(self, action, fields, upload):
+        """Queue a job and return its ID, raises JobQueueFull when busy"""
+        if self._closed:
+            raise JobQueueFull('The server is restarting, please try again shortly')
+        job_id = self.store.create(action, fields, upload, owner=process_owner())
+        with self._lock:
+            self._unfinished.add(job_id)
+        try:
+            self._queue.put_nowait(job_id)
+        except queue.Full:
+            with self._lock:
+                self._unfinished.discard(job_id)
+            self.store.delete(job_id)
+            raise JobQueueFull('Too many jobs queued, please try again shortly')
+        self._start_workers()
+        return job_id
+
+    def get(self, job_id):
+        """
+        Return the job record like the store does, first marking a queued or
+        running job failed if the process running it has gone away
+        """
+        job = self.store.get(job_id)
+        if job is not None and job['status'] in ('queued', 'running') and not owner_alive(job['owner']):
+            self.store.update(job_id, status='failed',
+                              error='The server process running the job stopped, please submit it again')
+            job = self.store.get(job_id)
+        return job
+
+    def shutdown(self, timeout):
+        """
+        Stop taking jobs and wait up to `timeout` seconds for the queued and
+        running ones. Jobs still unfinished then are marked failed, since the
+        worker threads die with the process. Returns how many were failed.
+        """
+        self._closed = True
+        deadline = time.monotonic() + timeout
+        while self._unfinished and time.monotonic() < deadline:
+            time.sleep(0.1)
+        with self._lock:
+            unfinished = list(self._unfinished)
+        for job_id in unfinished:
+            self.store.update(job_id, status='failed',
+                              error='The server stopped before the job finished, please submit it again')
+        return len(unfinished)
+
+    def _start_workers(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                JobWorker(self.store).run(job_id)
+            finally:
+                with self._lock:
+                    self._unfinished.discard(job_id)
+                self._queue.task_done()
+
+
+job_runner = JobRunner(SQLiteJobStore())
+
+# convert and filter_testing_columns can process several sheets of a
+# workbook at once (sheets=all or a JSON list of sheet names)
+SHEET_ACTIONS = ('convert', 'filter_testing_columns')
+# Worker processes for multi-sheet requests; 1 processes sheets in-process
+SHEET_WORKERS = int(os.environ.get('SHEET_WORKERS', str(os.cpu_count() or 1)))
+# Column holding the sheet name in combined multi-sheet output
+SHEET_COLUMN = 'Sheet'
+# How sheet workers are started. Not fork: this process runs other threads
+# (request and job threads, the pandas warm-up) and a child forked while one
+# of them holds a lock can deadlock on it
+SHEET_START_METHOD = os.environ.get(
+    'SHEET_START_METHOD', 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+
+class SheetPool:
+    """
+    Runs the sheets of a multi-sheet request on a pool of worker processes,
+    so they are parsed, cleaned and filtered side by side. The pool is
+    started on first use and kept for later requests. Workers are started
+    with SHEET_START_METHOD and run the module-level process_sheet, which
+    they import from this module. Where processes cannot be started (e.g. no /dev/shm on some serverless platforms) the
+    sheets are processed one after another in this process instead.
+    """
+
+    def __init__(self, workers=SHEET_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def run(self, path, sheet_names, action, fields):
+        """
+        Process the named sheets of the workbook at `path` (see
+        process_sheet) and return their results in the same order.
+        """
+        executor = self._get_executor() if len(sheet_names) > 1 else None
+        if executor is None:
+            return [process_sheet(path, sheet_name, action, fields) for sheet_name in sheet_names]
+        
+        futures = [executor.submit(process_sheet, path, sheet_name, action, fields) for sheet_name in sheet_names]
+        try:
+            return [future.result() for future in futures]
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next request
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise
+
+    def _get_executor(self):
+        if self.workers <= 1:
+            return None
+        with self._lock:
+            if self._executor is None:
+                try:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context(SHEET_START_METHOD)
+                    )
+                except (OSError, NotImplementedError, ValueError):
+                    self.workers = 1
+            return self._executor
+
+
+sheet_pool = SheetPool()
+
+# Rows matching these are dropped by clean_dataframe
+SEPARATOR_PATTERN = re.compile(r'^[-=_\s]+$')
+
+disclaimer_patterns = [
+    r'^source:',
+    r'^data as on',
+    r'^report generated',
+    r'^\*.*returns',
+    r'^note:',
+    r'^disclaimer',
+    r'^less than \d+ year',
+    r'compound annualized',
+    r'absolute returns',
+]
+DISCLAIMER_PATTERN = re.compile('|'.join(disclaimer_patterns), re.IGNORECASE)
+
+# Bracketed text such as the "(31-Oct-2025)" after Portfolio Turnover Ratio
+# values, and the date in the last brackets of a cell
+BRACKETED_TEXT_PATTERN = re.compile(r'\s*\([^)]+\)')
+TRAILING_BRACKETED_DATE_PATTERN = re.compile(r'\(\s*([^)]*?)\s*\)\s*$')
+BRACKETED_DATE_FORMAT = '%d-%b-%Y'
+
+# How POST MERGER rows are paired with their pre-merger rows (merger_match):
+# 'adjacent' compares with the row directly above, 'index' looks the row up
+# anywhere in the sheet
+MERGER_MATCH_MODES = ('adjacent', 'index')
+# Largest %_of_Net_Asset_10 difference between a matching pair
+NET_ASSET_TOLERANCE = 0.01
+# The "post merger" marker in a scheme name, with surrounding brackets or
+# dashes, removed to find the pre-merger scheme's name
+POST_MERGER_MARKER_PATTERN = re.compile(r'[\s\-–:]*[(\[]?\s*post merger\s*[)\]]?', re.IGNORECASE)
+
+# A row below the header whose first non-empty cell matches one of these
+# ends the data: reading stops there, so it and everything under it
+# (benchmark tables, footnotes) is never parsed. FOOTER_SENTINELS replaces
+# the list with a JSON array of regexes; '[]' turns early stopping off.
+footer_sentinel_patterns = [
+    r'^benchmark index\b',
+]
+if 'FOOTER_SENTINELS' in os.environ:
+    footer_sentinel_patterns = json.loads(os.environ['FOOTER_SENTINELS'])
+FOOTER_SENTINEL_PATTERN = (re.compile('|'.join(footer_sentinel_patterns), re.IGNORECASE)
+                           if footer_sentinel_patterns else None)
+
+# Words found in factsheet column headers, used to score header rows
+header_vocabulary = [
+    'scheme', 'fund', 'manager', 'category', 'benchmark', 'p2p', 'return', 'month', 'year',
+    'p/e', 'p/b', 'std', 'beta', 'sharpe', 'sortino', 'ratio', 'corpus', 'expense', 'turnover',
+    'net asset', 'nav', 'aum', 'inception', 'isin', 'plan',
+]
+HEADER_VOCABULARY_PATTERN = re.compile('|'.join(re.escape(word) for word in header_vocabulary), re.IGNORECASE)
+
+
+def is_footer_sentinel(row):
+    """True when the first non-empty cell of a sheet row is a footer sentinel"""
+    for value in row:
+        if isinstance(value, str):
+            value = value.strip()
+            if value:
+                return FOOTER_SENTINEL_PATTERN.match(value) is not None
+        elif not (isinstance(value, float) and np.isnan(value)):
+            return False
+    return False
+
+
+def collect_sheet_rows(rows, header_row):
+    """
+    Gather streamed sheet rows (trailing empty cells already trimmed) into
+    what pandas feeds its TextParser: stop before the first footer sentinel
+    below the header, drop trailing empty rows and pad to a common width.
+    """
+    first_data_row = 0 if header_row is None else header_row + 1
+    data = []
+    for row in rows:
+        if FOOTER_SENTINEL_PATTERN is not None and len(data) >= first_data_row and is_footer_sentinel(row):
+            break
+        data.append(row)
+    
+    while data and not data[-1]:
+        data.pop()
+    if data:
+        width = max(len(row) for row in data)
+        if min(len(row) for row in data) < width:
+            data = [row + [''] * (width - len(row)) for row in data]
+    return data
+
+# Columns kept by filter_testing_columns, in output order
+TESTING_COLUMNS = [
+    'Scheme Name',
+    '6 Months - P2P',
+    '1 Year - P2P',
+    '3 Years - P2P',
+    '5 Years - P2P',
+    '10 Years - P2P',
+    'P/E',
+    'P/B',
+    'Std.Dev.',
+    'Beta',
+    'Sharpe',
+    'Information Ratio',
+    'Sortino',
+    'Corpus (In crs.)',
+    'Expense Ratio (Current)',
+    'Portfolio Turnover Ratio',
+    '%_of_Net_Asset_10(Scheme Portfolio)',
+    'Downside Capture Ratio'
+]
+
+# Column mappings of header layouts seen before, kept across requests and
+# cold starts; the oldest layouts are dropped beyond LAYOUT_STORE_MAX_ENTRIES
+LAYOUT_STORE_PATH = os.environ.get('LAYOUT_STORE_PATH', os.path.join(tempfile.gettempdir(), 'newfunds-layouts.db'))
+LAYOUT_STORE_MAX_ENTRIES = int(os.environ.get('LAYOUT_STORE_MAX_ENTRIES', '1000'))
+
+# Names pandas gives to columns with an empty header cell
+UNNAMED_COLUMN_PATTERN = re.compile(r'^unnamed: \d+$')
+
+
+def layout_signature(names):
+    """
+    SHA-256 of a header list, compared case-insensitively with surrounding
+    whitespace ignored. Trailing unnamed columns (formatted but empty cells
+    right of the table) do not change the signature.
+    """
+    names = [str(name).strip().lower() for name in names]
+    while names and UNNAMED_COLUMN_PATTERN.match(names[-1]):
+        names.pop()
+    return hashlib.sha256(json.dumps(names).encode()).hexdigest()
+
+
+class ColumnResolver:
+    """
+    Finds the columns the app works with in a header list: the testing
+    columns, Scheme Name, Fund Manager, %_of_Net_Asset_10 and Portfolio
+    Turnover Ratio.
+    
+    Matches for full header rows are remembered as column positions under
+    the row's layout signature, together with the header row it was read
+    from, in memory and in a SQLite file. A recurring report format is therefore matched
+    once, and detect_header_row can recognise its header row outright.
+    """
+
+    def __init__(self, path=LAYOUT_STORE_PATH, max_entries=LAYOUT_STORE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._layouts = None
+        self._lock = threading.Lock()
+
+    def resolve(self, columns, header_row=None):
+        """
+        Return the mapping for `columns` as column names:
+        {'testing_columns': [...], 'scheme_name', 'fund_manager', 'net_asset',
+        'portfolio_turnover'}, with None for columns that are missing.
+        
+        Only a full header row, passed with the `header_row` it was read
+        from, is stored as a layout (and its header row recorded for header
+        detection). Other column lists, such as the column subsets of a
+        filtered frame, are looked up among the layouts in memory and
+        matched afresh when unknown, so they never push report layouts out
+        of the capped store.
+        """
+        columns = list(columns)
+        normalized = [str(col).strip().lower() for col in columns]
+        if len(set(normalized)) < len(normalized):
+            # Positions are ambiguous once names are normalized, so these
+            # layouts are matched every time instead of being stored
+            positions = self.match_columns(columns)
+        elif header_row is None:
+            layout = self._load().get(layout_signature(columns))
+            positions = layout['positions'] if layout is not None else self.match_columns(columns)
+        else:
+            signature = layout_signature(columns)
+            layout = self.get(signature)
+            if layout is None:
+                layout = {'header_row': header_row, 'positions': self.match_columns(columns)}
+                self.put(signature, layout)
+            elif layout['header_row'] != header_row:
+                layout = {**layout, 'header_row': header_row}
+                self.put(signature, layout)
+            positions = layout['positions']
+        
+        mapping = {name: None if position is None else columns[position]
+                   for name, position in positions.items() if name != 'testing_columns'}
+        mapping['testing_columns'] = [columns[position] for position in positions['testing_columns']]
+        return mapping
+
+    def find_header_row(self, rows):
+        """
+        Return the index of the first sheet row (list of cell strings) whose
+        layout is known and was last read as a header, or None.
+        """
+        layouts = self._load()
+        for idx, row in enumerate(rows):
+            names = [cell if cell.strip() else f'Unnamed: {j}' for j, cell in enumerate(row)]
+            if sum(1 for cell in row if cell.strip()) < 2:
+                continue
+            layout = layouts.get(layout_signature(names))
+            if layout is not None and layout['header_row'] is not None:
+                return idx
+        return None
+
+    def match_columns(self, columns):
+        """Match `columns` by name and return the positions of the matches"""
+        available_columns = [str(col) for col in columns]
+        testing_positions = []
+        
+        for test_col in TESTING_COLUMNS:
+            test_col_clean = test_col.strip()
+            matched = False
+            
+            # Try exact match first
+            if test_col_clean in available_columns:
+                testing_positions.append(available_columns.index(test_col_clean))
+                matched = True
+            else:
+                # Try case-insensitive match with trimmed whitespace
+                test_col_lower = test_col_clean.lower()
+                for position, col in enumerate(available_columns):
+                    if col.strip().lower() == test_col_lower:
+                        testing_positions.append(position)
+                        matched = True
+                        break
+            
+            # If still not matched, try partial match for %_of_Net_Asset_10
+            if not matched and '%_of_net_asset_10' in test_col_lower:
+                for position, col in enumerate(available_columns):
+                    col_lower = col.lower().strip()
+                    if '%_of_net_asset_10' in col_lower and 'scheme portfolio' in col_lower:
+                        testing_positions.append(position)
+                        break
+        
+        # Final check: ensure %_of_Net_Asset_10 column is included, searching
+        # more aggressively if it is not
+        net_asset_found = any('%_of_net_asset_10' in available_columns[position].lower() or
+                              '% of net asset' in available_columns[position].lower()
+                              for position in testing_positions)
+        if not net_asset_found:
+            for position, col in enumerate(available_columns):
+                col_lower = col.lower().strip()
+                if ('%_of_net_asset' in col_lower or '% of net asset' in col_lower) and 'scheme portfolio' in col_lower:
+                    if col not in [available_columns[p] for p in testing_positions]:
+                        testing_positions.append(position)
+                    break
+        
+        # Portfolio Turnover Ratio among the kept columns (all of them when
+        # no testing column matched)
+        portfolio_turnover = None
+        for position in testing_positions or range(len(available_columns)):
+            col_lower = available_columns[position].strip().lower()
+            if 'portfolio' in col_lower and 'turnover' in col_lower and 'ratio' in col_lower:
+                portfolio_turnover = position
+                break
+        
+        # Merger columns, the last match winning
+        scheme_name = fund_manager = net_asset = None
+        for position, col in enumerate(available_columns):
+            col_lower = col.lower()
+            if 'scheme name' in col_lower or 'schemename' in col_lower:
+                scheme_name = position
+            elif 'fund manager' in col_lower or 'fundmanager' in col_lower:
+                fund_manager = position
+            elif '%_of_net_asset_10' in col_lower or '% of net asset' in col_lower:
+                net_asset = position
+        
+        return {
+            'testing_columns': testing_positions,
+            'scheme_name': scheme_name,
+            'fund_manager': fund_manager,
+            'net_asset': net_asset,
+            'portfolio_turnover': portfolio_turnover
+        }
+
+    def get(self, signature):
+        """Return the stored layout for a signature, or None"""
+        layout = self._load().get(signature)
+        if layout is None:
+            # Another process may have stored it since this one loaded
+            try:
+                with self._connect() as db:
+                    row = db.execute('SELECT header_row, positions FROM layouts WHERE signature = ?',
+                                     (signature,)).fetchone()
+            except sqlite3.Error:
+                return None
+            if row is not None:
+                layout = {'header_row': row[0], 'positions': json.loads(row[1])}
+                with self._lock:
+                    self._layouts[signature] = layout
+        return layout
+
+    def put(self, signature, layout):
+        """Store a layout ({'header_row', 'positions'}) under its signature"""
+        with self._lock:
+            self._layouts[signature] = layout
+            while len(self._layouts) > self.max_entries:
+                self._layouts.pop(next(iter(self._layouts)))
+        try:
+            with self._connect() as db:
+                db.execute(
+                    'INSERT OR REPLACE INTO layouts (signature, header_row, positions, created) VALUES (?, ?, ?, ?)',
+                    (signature, layout['header_row'], json.dumps(layout['positions']), time.time())
+                )
+                db.execute(
+                    'DELETE FROM layouts WHERE signature NOT IN '
+                    '(SELECT signature FROM layouts ORDER BY created DESC LIMIT ?)',
+                    (self.max_entries,)
+                )
+        except sqlite3.Error:
+            # The store only saves work; the in-memory copy still applies
+            pass
+
+    def _load(self):
+        if self._layouts is None:
+            with self._lock:
+                if self._layouts is None:
+                    layouts = {}
+                    try:
+                        with self._connect() as db:
+                            db.execute(
+                                'CREATE TABLE IF NOT EXISTS layouts ('
+                                'signature TEXT PRIMARY KEY, header_row INTEGER, positions TEXT, created REAL)'
+                            )
+                            rows = db.execute(
+                                'SELECT signature, header_row, positions FROM layouts ORDER BY created DESC LIMIT ?',
+                                (self.max_entries,)
+                            ).fetchall()
+                        for signature, header_row, positions in reversed(rows):
+                            layouts[signature] = {'header_row': header_row, 'positions': json.loads(positions)}
+                    except sqlite3.Error:
+                        pass
+                    self._layouts = layouts
+        return self._layouts
+
+    def _connect(self):
+        return _closing_transaction(sqlite3.connect(self.path, timeout=10))
+
+
+column_resolver = ColumnResolver()
+
+# Excel reader engines selectable per request with the 'engine' form field:
+# 'openpyxl' is pandas' own reader, 'fast' is XlsxSheetReader (which falls
+# back to openpyxl for workbooks it cannot handle)
+EXCEL_ENGINES = ('openpyxl', 'fast')
+DEFAULT_EXCEL_ENGINE = os.environ.get('EXCEL_ENGINE', 'openpyxl')
+
+SHEET_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+OFFICE_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+class UnsupportedWorkbook(Exception):
+    """Raised by XlsxSheetReader for files it cannot read"""
+
+
+class XlsxSheetReader:
+    """
+    Minimal reader for one worksheet of an .xlsx file (the first one unless
+    `sheet_name` is given), built on zipfile and ElementTree.iterparse
+    instead of openpyxl's cell objects.
+    
+    Shared strings are resolved once into a list, sheet rows are streamed
+    and cleared as they are consumed, and cells are converted the same way
+    pandas converts openpyxl cells. Anything outside that subset raises
+    UnsupportedWorkbook so the caller can fall back to openpyxl.
+    """
+
+    def __init__(self, file, sheet_name=None):
+        self.sheet_name = sheet_name
+        try:
+            self._zip = zipfile.ZipFile(file)
+        except zipfile.BadZipFile as e:
+            raise UnsupportedWorkbook(str(e))
+        
+        # Row count from the sheet's <dimension>, known once rows are read
+        self.dimension_rows = None
+        self._columns = {}
+        try:
+            self._load()
+        except UnsupportedWorkbook:
+            self.close()
+            raise
+        except (KeyError, ValueError, ET.ParseError) as e:
+            self.close()
+            raise UnsupportedWorkbook(f'{type(e).__name__}: {e}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._zip.close()
+
+    def read_rows(self, header_row=None):
+        """
+        Return the rows up to the first footer sentinel below `header_row`
+        as lists of values (see collect_sheet_rows).
+        """
+        return collect_sheet_rows(self.iter_rows(), header_row)
+
+    def iter_rows(self):
+        """
+        Yield each sheet row as a list of converted cell values, with empty
+        cells as '' and trailing empty cells trimmed. Rows missing from the
+        file are yielded as empty lists.
+        """
+        row_tag = SHEET_MAIN_NS + 'row'
+        cell_tag = SHEET_MAIN_NS + 'c'
+        next_row = 1
+        
+        with self._zip.open(self.sheet_path) as src:
+            for _, elem in ET.iterparse(src):
+                if elem.tag == row_tag:
+                    ref = elem.get('r')
+                    row_number = int(ref) if ref else next_row
+                    if row_number < next_row:
+                        raise UnsupportedWorkbook('Rows are out of order')
+                    for _ in range(next_row, row_number):
+                        yield []
+                    
+                    values = []
+                    for cell in elem.iterfind(cell_tag):
+                        ref = cell.get('r')
+                        column = self._column_index(ref) if ref else len(values) + 1
+                        if column <= len(values):
+                            raise UnsupportedWorkbook('Cells are out of order')
+                        if column > len(values) + 1:
+                            values.extend([''] * (column - 1 - len(values)))
+                        values.append(self._convert_cell(cell))
+                    
+                    # Trim trailing empty cells
+                    while values and values[-1] == '':
+                        values.pop()
+                    yield values
+                    
+                    next_row = row_number + 1
+                    # Drop the parsed cells, only an empty row shell is kept
+                    elem.clear()
+                elif elem.tag == SHEET_MAIN_NS + 'dimension':
+                    last_cell = elem.get('ref', '').split(':')[-1]
+                    digits = last_cell.lstrip('ABCDEFGHIJKLMNOPQRSTUVWXYZ$').replace('$', '')
+                    self.dimension_rows = int(digits) if digits.isdigit() else None
+
+    def _convert_cell(self, cell):
+        data_type = cell.get('t', 'n')
+        
+        if data_type == 'inlineStr':
+            inline = cell.find(SHEET_MAIN_NS + 'is')
+            return self._text_content(inline) if inline is not None else ''
+        
+        value = cell.findtext(SHEET_MAIN_NS + 'v')
+        if not value:
+            return ''
+        
+        try:
+            if data_type == 'n':
+                number = float(value) if ('.' in value or 'E' in value or 'e' in value) else int(value)
+                style = cell.get('s')
+                if style and int(style) in self.date_styles:
+                    try:
+                        return from_excel(number, self.epoch, timedelta=int(style) in self.timedelta_styles)
+                    except (OverflowError, ValueError):
+                        # openpyxl turns these into error cells
+                        return np.nan
+                # Whole numbers come back as int, like pandas does
+                as_int = int(number)
+                return as_int if as_int == number else float(number)
+            if data_type == 's':
+                return self.shared_strings[int(value)]
+            if data_type == 'str':
+                return value
+            if data_type == 'b':
+                return bool(int(value))
+            if data_type == 'e':
+                return np.nan
+            if data_type == 'd':
+                return from_ISO8601(value)
+        except (ValueError, IndexError, OverflowError) as e:
+            raise UnsupportedWorkbook(f'Cannot convert cell {cell.get("r")}: {e}')
+        
+        raise UnsupportedWorkbook(f'Unsupported cell type {data_type!r}')
+
+    def _column_index(self, ref):
+        letters = ref.rstrip('0123456789')
+        index = self._columns.get(letters)
+        if index is None:
+            index = 0
+            for letter in letters:
+                index = index * 26 + ord(letter) - 64
+            self._columns[letters] = index
+        return index
+
+    def _text_content(self, elem):
+        """Plain text of a shared or inline string, without phonetic runs"""
+        text_tag = SHEET_MAIN_NS + 't'
+        parts = []
+        plain = elem.find(text_tag)
+        if plain is not None:
+            parts.append(plain.text or '')
+        for run in elem.iterfind(SHEET_MAIN_NS + 'r'):
+            run_text = run.find(text_tag)
+            if run_text is not None:
+                parts.append(run_text.text or '')
+        return ''.join(parts)
+
+    def _load(self):
+        workbook_path = 'xl/workbook.xml'
+        for rel_type, target in self._relationships('').values():
+            if rel_type.endswith('/officeDocument'):
+                workbook_path = target
+        
+        workbook = ET.fromstring(self._zip.read(workbook_path))
+        if workbook.tag != SHEET_MAIN_NS + 'workbook':
+            raise UnsupportedWorkbook('Unsupported workbook namespace')
+        
+        properties = workbook.find(SHEET_MAIN_NS + 'workbookPr')
+        date1904 = properties is not None and properties.get('date1904', '').lower() in ('1', 'true')
+        self.epoch = CALENDAR_MAC_1904 if date1904 else CALENDAR_WINDOWS_1900
+        
+        sheets = workbook.findall(f'{SHEET_MAIN_NS}sheets/{SHEET_MAIN_NS}sheet')
+        if self.sheet_name is None:
+            sheet = sheets[0] if sheets else None
+        else:
+            sheet = next((sheet for sheet in sheets if sheet.get('name') == self.sheet_name), None)
+        if sheet is None:
+            raise UnsupportedWorkbook('Workbook has no such sheet')
+        
+        relationships = self._relationships(workbook_path)
+        rel_type, self.sheet_path = relationships[sheet.get(OFFICE_REL_NS + 'id')]
+        if not rel_type.endswith('/worksheet'):
+            raise UnsupportedWorkbook('Sheet is not a worksheet')
+        
+        self.shared_strings = []
+        self.date_styles = set()
+        self.timedelta_styles = set()
+        for rel_type, target in relationships.values():
+            if rel_type.endswith('/sharedStrings'):
+                self.shared_strings = self._read_shared_strings(target)
+            elif rel_type.endswith('/styles'):
+                self._read_date_styles(target)
+
+    def _relationships(self, part_path):
+        """Map relationship IDs of a part to (type, resolved target path)"""
+        folder, name = posixpath.split(part_path)
+        rels_path = posixpath.join(folder, '_rels', name + '.rels')
+        try:
+            root = ET.fromstring(self._zip.read(rels_path))
+        except KeyError:
+            return {}
+        
+        relationships = {}
+        for rel in root.iter(PACKAGE_REL_NS + 'Relationship'):
+            if rel.get('TargetMode') == 'External':
+                continue
+            target = rel.get('Target', '')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join(folder, target))
+            relationships[rel.get('Id')] = (rel.get('Type', ''), target)
+        return relationships
+
+    def _read_shared_strings(self, path):
+        strings = []
+        string_tag = SHEET_MAIN_NS + 'si'
+        with self._zip.open(path) as src:
+            root = None
+            for event, elem in ET.iterparse(src, events=('start', 'end')):
+                if root is None:
+                    root = elem
+                elif event == 'end' and elem.tag == string_tag:
+                    strings.append(self._text_content(elem).replace('x005F_', ''))
+                    root.clear()
+        return strings
+
+    def _read_date_styles(self, path):
+        """Find the cell style indexes whose number format is a date or duration"""
+        root = ET.fromstring(self._zip.read(path))
+        custom_formats = {
+            int(fmt.get('numFmtId')): fmt.get('formatCode')
+            for fmt in root.iterfind(f'{SHEET_MAIN_NS}numFmts/{SHEET_MAIN_NS}numFmt')
+        }
+        for index, style in enumerate(root.iterfind(f'{SHEET_MAIN_NS}cellXfs/{SHEET_MAIN_NS}xf')):
+            format_id = int(style.get('numFmtId', 0))
+            number_format = custom_formats[format_id] if format_id in custom_formats else builtin_format_code(format_id)
+            if is_date_format(number_format):
+                self.date_styles.add(index)
+            if is_timedelta_format(number_format):
+                self.timedelta_styles.add(index)
+
 
 class handler(BaseHTTPRequestHandler):
+    # Stage timings of the request being handled (see RequestTimer)
+    timer = None
+    status_code = None
+    # result_key of the download being sent, which is then cached under it
+    result_key = None
+    
     def do_POST(self):
+        form = None
+        self.timer = RequestTimer()
         try:
-            # Parse multipart form data using cgi
+            # Parse multipart form data
             content_type = self.headers.get('Content-Type', '')
             
             if 'multipart/form-data' not in content_type:
                 self.send_error_response(400, 'Invalid content type')
                 return
             
-            # Read the body
-            content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length)
+            # Stream the body through the multipart parser
+            content_length = int(self.headers.get('Content-Length', 0))
+            self.timer.info['input_bytes'] = content_length
+            try:
+                with self.stage('multipart'):
+                    form = MultipartForm(self.rfile, content_type, content_length)
+            except UploadTooLarge as e:
+                self.send_error_response(413, str(e))
+                return
+            except MultipartError as e:
+                self.send_error_response(400, f'Invalid form data: {str(e)}')
+                return
+            
+            # Report waiting on the client separately from parsing
+            parse_seconds = self.timer.stages.pop('multipart') - form.read_seconds
+            self.timer.add('body', form.read_seconds)
+            self.timer.add('multipart', parse_seconds)
+            
+            # Extract action
+            action = form.getvalue('action', 'convert')
+            self.timer.info['action'] = action
+            
+            if action == 'cache_stats':
+                response = {
+                    'success': True,
+                    'frame_cache': frame_cache.stats(),
+                    'result_cache': result_cache.stats()
+                }
+                
+                self.send_json_response(response)
+                return
+            
+            if action in ('job_status', 'job_result'):
+                job = job_runner.get(form.getvalue('job_id', ''))
+                if job is None:
+                    self.send_error_response(404, 'Unknown or expired job')
+                    return
+                
+                if action == 'job_status':
+                    response = {
+                        'success': True,
+                        'job_id': job['id'],
+                        'action': job['action'],
+                        'status': job['status'],
+                        'progress': job['progress'],
+                        'summary': job['summary'],
+                        'error': job['error']
+                    }
+                    
+                    self.send_json_response(response)
+                    return
+                
+                if job['status'] == 'failed':
+                    self.send_error_response(409, f"Job failed: {job['error']}")
+                    return
+                if job['status'] != 'done':
+                    self.send_error_response(409, f"Job is {job['status']}, no result available yet")
+                    return
+                
+                self.send_download(self.iter_file_chunks(job_runner.store.result_path(job['id'])),
+                                   job['fields']['format'], job['filename'], self.count_headers(job['summary']))
+                return
+            
+            # Extract file - either uploaded with this request or referenced
+            # by the workbook ID returned from an earlier 'upload' action
+            workbook_id = form.getvalue('workbook_id', '')
+            if 'file' in form.files:
+                upload = form.files['file']
+            elif workbook_id and action != 'upload':
+                upload = workbook_store.get(workbook_id)
+                if upload is None:
+                    self.send_error_response(410, 'Workbook session expired, please upload the file again')
+                    return
+            else:
+                self.send_error_response(400, 'No file uploaded')
+                return
+            self.timer.info['file_bytes'] = upload.size
+            
+            if action == 'upload':
+                # Keep the file server-side and hand back its ID
+                workbook_id = workbook_store.put(upload)
+                response = {
+                    'success': True,
+                    'workbook_id': workbook_id,
+                    'size': upload.size,
+                    'expires_in': workbook_store.ttl,
+                    'async_jobs': ASYNC_JOBS
+                }
+                
+                self.send_json_response(response)
+                return
             
-            # Parse using cgi.FieldStorage
-            environ = {
-                'REQUEST_METHOD': 'POST',
-                'CONTENT_TYPE': content_type,
-                'CONTENT_LENGTH': str(content_length),
-            }
+            # Excel reader engine for this request
+            engine = form.getvalue('engine', DEFAULT_EXCEL_ENGINE)
+            if engine not in EXCEL_ENGINES:
+                self.send_error_response(400, f'Unknown engine: {engine}')
+                return
+            self.timer.info['engine'] = engine
             
-            form = cgi.FieldStorage(
-                fp=io.BytesIO(body),
-                headers=self.headers,
-                environ=environ
-            )
+            # Raw download format for convert / filter_testing_columns
+            export_format = form.getvalue('format', '')
+            if export_format and export_format not in EXPORT_CONTENT_TYPES:
+                self.send_error_response(400, f'Unknown format: {export_format}')
+                return
             
-            # Extract file
-            if 'file' not in form:
-                self.send_error_response(400, 'No file uploaded')
+            # Several sheets at once, combined under a Sheet column or
+            # returned one by one (JSON only)
+            sheets = form.getvalue('sheets', '') if action in SHEET_ACTIONS else ''
+            sheet_output = form.getvalue('sheet_output', 'combined')
+            if sheets and sheet_output not in ('combined', 'separate'):
+                self.send_error_response(400, f'Unknown sheet_output: {sheet_output}')
+                return
+            if sheets and sheet_output == 'separate' and (export_format or form.getvalue('async', '') in ('1', 'true')):
+                self.send_error_response(400, 'sheet_output=separate is only available as a JSON response')
                 return
             
-            file_item = form['file']
-            if not file_item.file:
-                self.send_error_response(400, 'No file uploaded')
+            # Run long conversions as a background job; the client polls
+            # job_status and fetches the file with job_result
+            if action in JOB_ACTIONS and form.getvalue('async', '') in ('1', 'true'):
+                fields = dict(form.fields, format=export_format or 'csv', engine=engine)
+                try:
+                    job_id = job_runner.submit(action, fields, upload)
+                except JobQueueFull as e:
+                    self.send_error_response(503, str(e))
+                    return
+                
+                response = {
+                    'success': True,
+                    'job_id': job_id,
+                    'status': 'queued'
+                }
+                
+                self.send_json_response(response, 202)
                 return
             
-            file_data = file_item.file.read()
+            # Downloads are served from the result cache, or answered with a
+            # 304 when the client already holds this exact result
+            header_rows = None
+            if action in JOB_ACTIONS and export_format and sheet_output == 'combined':
+                try:
+                    header_rows = self.resolve_header_rows(form.getvalue('header_row', ''), upload, engine, sheets)
+                except Exception:
+                    # Reported below, where the request is processed
+                    pass
+            if header_rows is not None:
+                self.result_key = result_key(upload.sha256, action, export_format, dict(form.fields, engine=engine),
+                                             header_rows)
+                etag = self.etag_matches(self.result_key)
+                if etag is not None:
+                    self.timer.info['result_cache'] = 'not_modified'
+                    self.send_not_modified(etag)
+                    return
+                cached = result_cache.get(self.result_key)
+                self.timer.info['result_cache'] = 'miss' if cached is None else 'hit'
+                if cached is not None:
+                    body, counts = cached
+                    self.send_download([body], export_format, upload.filename, counts)
+                    return
             
-            # Extract action
-            action = form.getvalue('action', 'convert')
+            if sheets:
+                self.send_sheets_response(action, dict(form.fields, engine=engine), upload, export_format, sheet_output)
+                return
             
             # Handle different actions
             if action == 'get_preview':
                 # Get raw preview of first rows without any header assumption
                 try:
-                    df_raw = pd.read_excel(io.BytesIO(file_data), header=None)
+                    with self.stage('read'):
+                        preview_data, total_rows = self.read_preview(upload, PREVIEW_ROWS, engine)
                 except Exception as e:
                     self.send_error_response(400, f'Failed to read Excel file: {str(e)}')
                     return
                 
-                # Get first 10 rows for preview
-                preview_rows = df_raw.head(10).values.tolist()
-                
-                # Convert to JSON-serializable format
-                preview_data = []
-                for row in preview_rows:
-                    preview_data.append([str(cell) if cell is not None and str(cell) != 'nan' else '' for cell in row])
-                
                 response = {
                     'success': True,
                     'rows': preview_data,
-                    'total_rows': len(df_raw)
+                    'total_rows': total_rows
                 }
                 
-                # Send response
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(json.dumps(response).encode())
+                self.send_json_response(response)
+                warm_up_pandas()
+                return
+            
+            # For other actions, get header_row parameter (detected when omitted)
+            try:
+                if header_rows is not None:
+                    header_row, header_info = header_rows[0]
+                else:
+                    header_row, header_info = self.resolve_header_row(form.getvalue('header_row', ''), upload, engine)
+            except InvalidRequest as e:
+                self.send_error_response(400, str(e))
+                return
+            except Exception as e:
+                self.send_error_response(400, f'Failed to read Excel file: {str(e)}')
                 return
             
-            # For other actions, get header_row parameter
-            header_row = int(form.getvalue('header_row', '0'))
+            if action == 'get_headers' and not pandas_loaded():
+                # First request of a fresh process: list the headers without
+                # waiting for pandas, which is imported after the response
+                try:
+                    with self.stage('read'):
+                        response = self.read_headers(upload, header_row, engine)
+                except Exception:
+                    # load_frames below reports the error
+                    response = None
+                if response is not None:
+                    self.timer.info.update({'header_row': header_row, 'cleaned_rows': response['total_rows'],
+                                            'columns': len(response['columns'])})
+                    response.update(header_info)
+                    self.send_json_response(response)
+                    warm_up_pandas()
+                    return
             
             # Read Excel file with specified header row
             try:
-                df = pd.read_excel(io.BytesIO(file_data), header=header_row)
+                df, df_cleaned = self.load_frames(upload, header_row, engine=engine)
             except Exception as e:
                 self.send_error_response(400, f'Failed to read Excel file: {str(e)}')
                 return
             
-            # Clean the dataframe
+            # Row counts before and after cleaning
             original_rows = len(df)
-            df_cleaned = self.clean_dataframe(df)
             cleaned_rows = len(df_cleaned)
-            removed_rows = original_rows - cleaned_rows
+            self.timer.info.update({
+                'header_row': header_row,
+                'rows': original_rows,
+                'cleaned_rows': cleaned_rows,
+                'columns': len(df_cleaned.columns)
+            })
             
             # Handle different actions
             if action == 'get_headers':
                 # Return column headers
-                columns = df_cleaned.columns.tolist()
-                response = {
-                    'success': True,
-                    'columns': columns,
-                    'total_rows': cleaned_rows
-                }
+                response = self.headers_response(df_cleaned)
             elif action == 'get_bottom_rows':
                 # Get bottom rows for exclusion preview
                 selected_columns_json = form.getvalue('columns', '')
@@ -116,32 +1905,9 @@ class handler(BaseHTTPRequestHandler):
                         self.send_error_response(400, f'Invalid column selection: {str(e)}')
                         return
                 
-                # Get last 30 rows (or all if less than 30)
-                num_rows_to_show = min(30, len(df_cleaned))
-                bottom_rows_df = df_cleaned.tail(num_rows_to_show)
-                
-                # Convert to list format with row indices
-                # Get column names in the correct order
-                column_names = df_cleaned.columns.tolist()
-                bottom_rows_data = []
-                for idx, row in bottom_rows_df.iterrows():
-                    # Get values in the exact order of columns
-                    row_values = [str(row[col]) if pd.notna(row[col]) else '' for col in column_names]
-                    row_data = {
-                        'index': int(idx),  # Original dataframe index (for exclusion)
-                        'display_index': int(idx),  # Row number in dataframe (0-indexed)
-                        'values': row_values
-                    }
-                    bottom_rows_data.append(row_data)
-                
-                response = {
-                    'success': True,
-                    'rows': bottom_rows_data,
-                    'total_rows': len(df_cleaned),
-                    'columns': df_cleaned.columns.tolist()
-                }
-            elif action == 'get_post_merger_candidates':
-                # Get POST MERGER candidates for review
+                response = self.bottom_rows_response(df_cleaned)
+            elif action == 'get_rows':
+                # Page through the cleaned rows for exclusion review
                 selected_columns_json = form.getvalue('columns', '')
                 
                 if selected_columns_json:
@@ -153,413 +1919,579 @@ class handler(BaseHTTPRequestHandler):
                         self.send_error_response(400, f'Invalid column selection: {str(e)}')
                         return
                 
-                # Get POST MERGER candidates
-                candidates, skipped = self.get_post_merger_candidates(df_cleaned)
-                
-                response = {
-                    'success': True,
-                    'candidates': candidates,
-                    'skipped': skipped,
-                    'columns': df_cleaned.columns.tolist(),
-                    'total_rows': len(df_cleaned)
-                }
-            elif action == 'filter_testing_columns':
-                # Filter to only testing columns
+                try:
+                    response = self.rows_response(df_cleaned, form.getvalue('offset', '0'),
+                                                  form.getvalue('limit', str(ROW_WINDOW_ROWS)))
+                except InvalidRequest as e:
+                    self.send_error_response(400, str(e))
+                    return
+            elif action == 'get_post_merger_candidates':
+                # Get POST MERGER candidates for review
                 selected_columns_json = form.getvalue('columns', '')
                 
                 if selected_columns_json:
                     try:
                         selected_columns = json.loads(selected_columns_json)
-                        # Filter to only selected columns first
+                        # Filter to only selected columns
                         df_cleaned = df_cleaned[selected_columns]
                     except Exception as e:
                         self.send_error_response(400, f'Invalid column selection: {str(e)}')
                         return
                 
-                # Handle POST MERGER deletions
-                post_merger_deletions_json = form.getvalue('post_merger_deletions', '')
-                if post_merger_deletions_json:
-                    try:
-                        post_merger_deletions = json.loads(post_merger_deletions_json)
-                        if post_merger_deletions and len(post_merger_deletions) > 0:
-                            deletion_set = set(post_merger_deletions)
-                            df_cleaned = df_cleaned[~df_cleaned.index.isin(deletion_set)]
-                    except Exception as e:
-                        self.send_error_response(400, f'Invalid POST MERGER deletions: {str(e)}')
-                        return
-                
-                # Handle row exclusion
-                exclude_rows_json = form.getvalue('exclude_row_indices', '')
-                if exclude_rows_json:
-                    try:
-                        exclude_indices = json.loads(exclude_rows_json)
-                        if exclude_indices and len(exclude_indices) > 0:
-                            exclude_set = set(exclude_indices)
-                            df_cleaned = df_cleaned[~df_cleaned.index.isin(exclude_set)]
-                    except Exception as e:
-                        self.send_error_response(400, f'Invalid row exclusion indices: {str(e)}')
-                        return
-                
-                # Define testing columns to keep
-                testing_columns = [
-                    'Scheme Name',
-                    '6 Months - P2P',
-                    '1 Year - P2P',
-                    '3 Years - P2P',
-                    '5 Years - P2P',
-                    '10 Years - P2P',
-                    'P/E',
-                    'P/B',
-                    'Std.Dev.',
-                    'Beta',
-                    'Sharpe',
-                    'Information Ratio',
-                    'Sortino',
-                    'Corpus (In crs.)',
-                    'Expense Ratio (Current)',
-                    'Portfolio Turnover Ratio',
-                    '%_of_Net_Asset_10(Scheme Portfolio)',
-                    'Downside Capture Ratio'
-                ]
-                
-                # Find matching columns (case-insensitive, handle variations and whitespace)
-                available_columns = df_cleaned.columns.tolist()
-                columns_to_keep = []
-                
-                for test_col in testing_columns:
-                    test_col_clean = test_col.strip()
-                    matched = False
-                    
-                    # Try exact match first
-                    if test_col_clean in available_columns:
-                        columns_to_keep.append(test_col_clean)
-                        matched = True
-                    else:
-                        # Try case-insensitive match with trimmed whitespace
-                        test_col_lower = test_col_clean.lower()
-                        for col in available_columns:
-                            col_clean = str(col).strip()
-                            if col_clean.lower() == test_col_lower:
-                                columns_to_keep.append(col)  # Use original column name
-                                matched = True
-                                break
-                    
-                    # If still not matched, try partial match for %_of_Net_Asset_10
-                    if not matched and '%_of_net_asset_10' in test_col_lower:
-                        for col in available_columns:
-                            col_lower = str(col).lower().strip()
-                            if '%_of_net_asset_10' in col_lower and 'scheme portfolio' in col_lower:
-                                columns_to_keep.append(col)
-                                matched = True
-                                break
-                
-                # Final check: ensure %_of_Net_Asset_10 column is included
-                net_asset_found = False
-                for col in columns_to_keep:
-                    if '%_of_net_asset_10' in str(col).lower() or '% of net asset' in str(col).lower():
-                        net_asset_found = True
-                        break
-                
-                # If not found, search more aggressively
-                if not net_asset_found:
-                    for col in available_columns:
-                        col_lower = str(col).lower().strip()
-                        if ('%_of_net_asset' in col_lower or '% of net asset' in col_lower) and 'scheme portfolio' in col_lower:
-                            if col not in columns_to_keep:
-                                columns_to_keep.append(col)
-                            break
+                try:
+                    response = self.post_merger_candidates_response(df_cleaned, form.getvalue('merger_match', 'adjacent'))
+                except InvalidRequest as e:
+                    self.send_error_response(400, str(e))
+                    return
+            elif action == 'review_bundle':
+                # Run several review actions against the one parsed and cleaned frame
+                try:
+                    review_requests = json.loads(form.getvalue('requests', '[]'))
+                    if not isinstance(review_requests, list):
+                        raise ValueError('expected a list of requests')
+                except ValueError as e:
+                    self.send_error_response(400, f'Invalid review requests: {str(e)}')
+                    return
                 
-                # Filter dataframe to only testing columns
-                if columns_to_keep:
-                    df_filtered = df_cleaned[columns_to_keep]
-                else:
-                    df_filtered = df_cleaned.copy()
+                response = {
+                    'success': True,
+                    'results': [self.run_review_request(df_cleaned, request) for request in review_requests],
+                    'total_rows': cleaned_rows
+                }
+            elif action == 'filter_testing_columns':
+                # Filter to only testing columns
+                try:
+                    df_filtered, summary, columns_to_keep = self.filter_frame(form.fields, df_cleaned)
+                except InvalidRequest as e:
+                    self.send_error_response(400, str(e))
+                    return
                 
-                # Clean Portfolio Turnover Ratio column - remove dates in brackets
-                portfolio_turnover_col = None
-                for col in df_filtered.columns:
-                    col_str = str(col).strip()
-                    col_lower = col_str.lower()
-                    # Match Portfolio Turnover Ratio column by name (case-insensitive, handle variations)
-                    if 'portfolio' in col_lower and 'turnover' in col_lower and 'ratio' in col_lower:
-                        portfolio_turnover_col = col  # Use original column name from dataframe
-                        break
+                if export_format:
+                    self.send_export(df_filtered, export_format, upload.filename, self.count_headers({**summary, **header_info}))
+                    return
                 
-                if portfolio_turnover_col is not None:
-                    def clean_portfolio_turnover(value):
-                        # Handle NaN/null values
-                        if pd.isna(value):
-                            return value
-                        
-                        value_str = str(value).strip()
-                        
-                        # Keep null or "--" as is
-                        if value_str == '' or value_str.lower() == '--' or value_str.lower() == 'nan':
-                            return value_str
-                        
-                        # Remove date in brackets like "(31-Oct-2025)" or " (31-Oct-2025)"
-                        # Pattern: optional whitespace, opening bracket, anything, closing bracket, optional whitespace at end
-                        # Try multiple patterns to be sure
-                        cleaned = re.sub(r'\s*\([^)]+\)\s*$', '', value_str)
-                        # Also try pattern without requiring end of string (in case there's trailing whitespace)
-                        cleaned = re.sub(r'\s*\([^)]+\)', '', cleaned)
-                        cleaned = cleaned.strip()
-                        
-                        # Return cleaned value, or original if cleaning resulted in empty string
-                        return cleaned if cleaned else value_str
+                with self.stage('serialize'):
+                    # Convert to CSV
+                    csv_buffer = io.StringIO()
+                    df_output = self.untype_frame(df_filtered)
+                    df_output.to_csv(csv_buffer, index=False)
+                    csv_data = csv_buffer.getvalue()
                     
-                    # Apply cleaning to the column - use .loc to ensure we modify the dataframe
-                    df_filtered.loc[:, portfolio_turnover_col] = df_filtered[portfolio_turnover_col].apply(clean_portfolio_turnover)
-                
-                # Convert to CSV
-                csv_buffer = io.StringIO()
-                df_filtered.to_csv(csv_buffer, index=False)
-                csv_data = csv_buffer.getvalue()
-                
-                # Convert to JSON
-                json_data = df_filtered.to_json(orient='records', indent=2, date_format='iso')
+                    # Convert to JSON
+                    json_data = df_output.to_json(orient='records', indent=2, date_format='iso')
                 
                 response = {
                     'success': True,
                     'csv_data': csv_data,
                     'json_data': json_data,
-                    'original_rows': len(df_cleaned),
-                    'filtered_rows': len(df_filtered),
+                    'original_rows': summary['original_rows'],
+                    'filtered_rows': summary['filtered_rows'],
                     'columns': columns_to_keep,
-                    'columns_count': len(columns_to_keep)
+                    'columns_count': summary['columns_count']
                 }
             else:
                 # Convert with selected columns
-                selected_columns_json = form.getvalue('columns', '')
-
-                if selected_columns_json:
-                    try:
-                        selected_columns = json.loads(selected_columns_json)
-                        # Filter to only selected columns
-                        df_cleaned = df_cleaned[selected_columns]
-                    except Exception as e:
-                        self.send_error_response(400, f'Invalid column selection: {str(e)}')
-                        return
-
-                # Handle POST MERGER deletions - accept list of pre-merger row indices to delete
-                post_merger_deletions_json = form.getvalue('post_merger_deletions', '')
-                post_merger_deleted_count = 0
-                post_merger_report = {'deleted': [], 'kept': [], 'skipped': []}
-                
-                if post_merger_deletions_json:
-                    try:
-                        post_merger_deletions = json.loads(post_merger_deletions_json)
-                        if post_merger_deletions and len(post_merger_deletions) > 0:
-                            # post_merger_deletions is a list of pre_merger row indices to delete
-                            deletion_set = set(post_merger_deletions)
-                            # Filter out deleted pre-merger rows
-                            df_cleaned = df_cleaned[~df_cleaned.index.isin(deletion_set)]
-                            post_merger_deleted_count = len(post_merger_deletions)
-                            # Build report for display
-                            for idx in post_merger_deletions:
-                                if idx < len(df_cleaned) + post_merger_deleted_count:  # Check if index was valid
-                                    post_merger_report['deleted'].append({
-                                        'row_index': int(idx),
-                                        'scheme_name': 'Pre-merger row'
-                                    })
-                    except Exception as e:
-                        self.send_error_response(400, f'Invalid POST MERGER deletions: {str(e)}')
-                        return
+                try:
+                    df_cleaned, summary = self.convert_frame(form.fields, df, df_cleaned)
+                except InvalidRequest as e:
+                    self.send_error_response(400, str(e))
+                    return
 
-                # Handle row exclusion - accept list of row indices to exclude
-                exclude_rows_json = form.getvalue('exclude_row_indices', '')
-                excluded_count = 0
+                if export_format:
+                    self.send_export(df_cleaned, export_format, upload.filename, self.count_headers({**summary, **header_info}))
+                    return
                 
-                if exclude_rows_json:
-                    try:
-                        exclude_indices = json.loads(exclude_rows_json)
-                        if exclude_indices and len(exclude_indices) > 0:
-                            # Convert to set for faster lookup
-                            exclude_set = set(exclude_indices)
-                            # Filter out excluded rows
-                            df_cleaned = df_cleaned[~df_cleaned.index.isin(exclude_set)]
-                            excluded_count = len(exclude_indices)
-                    except Exception as e:
-                        self.send_error_response(400, f'Invalid row exclusion indices: {str(e)}')
-                        return
-
-                # Update final row count after exclusion
-                final_rows = len(df_cleaned)
+                with self.stage('serialize'):
+                    # Convert to CSV
+                    csv_buffer = io.StringIO()
+                    df_output = self.untype_frame(df_cleaned)
+                    df_output.to_csv(csv_buffer, index=False)
+                    csv_data = csv_buffer.getvalue()
 
-                # Convert to CSV
-                csv_buffer = io.StringIO()
-                df_cleaned.to_csv(csv_buffer, index=False)
-                csv_data = csv_buffer.getvalue()
-
-                # Convert to JSON
-                json_data = df_cleaned.to_json(orient='records', indent=2, date_format='iso')
+                    # Convert to JSON
+                    json_data = df_output.to_json(orient='records', indent=2, date_format='iso')
 
                 response = {
                     'success': True,
                     'csv_data': csv_data,
-                    'json_data': json_data,
-                    'original_rows': original_rows,
-                    'cleaned_rows': final_rows,
-                    'removed_rows': removed_rows,
-                    'excluded_rows': excluded_count,
-                    'post_merger_deleted': post_merger_deleted_count
+                    'json_data': json_data
                 }
+                response.update(summary)
             
             # Send response
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode())
+            response.update(header_info)
+            self.send_json_response(response)
             
         except Exception as e:
             self.send_error_response(500, f'Internal server error: {str(e)}')
+        finally:
+            if form is not None:
+                form.close()
+            self.log_request_metrics()
     
     def do_OPTIONS(self):
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match')
         self.end_headers()
     
-    def get_post_merger_candidates(self, df):
+    def stage(self, name):
+        """Time a stage of the current request (a no-op outside do_POST)"""
+        if self.timer is None:
+            return nullcontext()
+        return self.timer.stage(name)
+    
+    def log_request(self, code='-', size='-'):
+        # POST requests get a JSON line from log_request_metrics instead of
+        # the plain access log line
+        self.status_code = code
+        if self.timer is None:
+            super().log_request(code, size)
+    
+    def log_request_metrics(self):
+        """Write one structured JSON log line for the request to stderr"""
+        record = {
+            'method': self.command,
+            'path': self.path,
+            'status': self.status_code
+        }
+        record.update(self.timer.record())
+        sys.stderr.write(json.dumps(record, default=str) + '\n')
+        sys.stderr.flush()
+    
+    def headers_response(self, df_cleaned):
+        return {
+            'success': True,
+            'columns': df_cleaned.columns.tolist(),
+            'total_rows': len(df_cleaned)
+        }
+    
+    def bottom_rows_response(self, df_cleaned):
+        # Get last 30 rows (or all if less than 30)
+        return {
+            'success': True,
+            'rows': self.row_window(df_cleaned, max(len(df_cleaned) - 30, 0), 30),
+            'total_rows': len(df_cleaned),
+            'columns': df_cleaned.columns.tolist()
+        }
+    
+    def rows_response(self, df_cleaned, offset=0, limit=ROW_WINDOW_ROWS):
         """
-        Find POST MERGER duplicate candidates without deleting them.
-        Returns candidates for user review.
+        Return the page of `limit` rows starting at row position `offset`,
+        shaped like get_bottom_rows' response. offset / limit may be form
+        strings; invalid values raise InvalidRequest.
+        """
+        try:
+            offset = int(offset)
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise InvalidRequest(f'Invalid row window: offset={offset}, limit={limit}')
+        if offset < 0 or not 0 < limit <= ROW_WINDOW_MAX_ROWS:
+            raise InvalidRequest(f'Invalid row window: offset must be 0 or more and limit 1 to {ROW_WINDOW_MAX_ROWS}')
         
-        Returns:
-        - candidates: list of dicts with pre_merger and post_merger row info
-        - skipped: list of skipped POST MERGER rows with reasons
+        return {
+            'success': True,
+            'rows': self.row_window(df_cleaned, offset, limit),
+            'offset': offset,
+            'limit': limit,
+            'total_rows': len(df_cleaned),
+            'columns': df_cleaned.columns.tolist()
+        }
+    
+    def row_window(self, df, offset, limit):
         """
-        candidates = []
-        skipped = []
+        Rows `offset` to `offset + limit` (positions) of `df` as
+        {'index', 'display_index', 'values'} dicts, with the values as
+        strings in column order ('' for empty cells). Only the window is
+        converted, in one vectorized pass, so the cost per page does not
+        depend on the size of the frame.
+        """
+        window = self.untype_frame(df.iloc[offset:offset + limit])
+        values = window.astype(object).where(window.notna(), '').astype(str).to_numpy().tolist()
+        return [
+            {
+                'index': int(idx),  # Original dataframe index (for exclusion)
+                'display_index': int(idx),  # Row number in dataframe (0-indexed)
+                'values': row_values
+            }
+            for idx, row_values in zip(window.index.tolist(), values)
+        ]
+    
+    def post_merger_candidates_response(self, df_cleaned, match_mode='adjacent'):
+        with self.stage('merger'):
+            candidates, skipped = self.get_post_merger_candidates(df_cleaned, match_mode)
+        
+        return {
+            'success': True,
+            'candidates': candidates,
+            'skipped': skipped,
+            'columns': df_cleaned.columns.tolist(),
+            'total_rows': len(df_cleaned),
+            'merger_match': match_mode
+        }
+    
+    def run_review_request(self, df_cleaned, request):
+        """
+        Run one review_bundle sub-request, e.g.
+        {"action": "get_bottom_rows", "columns": ["Scheme Name", ...]}.
+        Errors are reported in that sub-request's result instead of failing
+        the whole bundle.
+        """
+        builders = {
+            'get_headers': self.headers_response,
+            'get_bottom_rows': self.bottom_rows_response,
+            'get_rows': lambda df: self.rows_response(df, request.get('offset', 0), request.get('limit', ROW_WINDOW_ROWS)),
+            'get_post_merger_candidates': lambda df: self.post_merger_candidates_response(
+                df, request.get('merger_match', 'adjacent')),
+        }
         
-        # Check if required columns exist
-        scheme_name_col = None
-        fund_manager_col = None
-        net_asset_col = None
+        action = request.get('action') if isinstance(request, dict) else None
+        if action not in builders:
+            return {'success': False, 'action': action, 'error': f'Unknown review action: {action}'}
         
-        # Find column names (case-insensitive, handle variations)
-        for col in df.columns:
-            col_lower = str(col).lower()
-            if 'scheme name' in col_lower or 'schemename' in col_lower:
-                scheme_name_col = col
-            elif 'fund manager' in col_lower or 'fundmanager' in col_lower:
-                fund_manager_col = col
-            elif '%_of_net_asset_10' in col_lower or '% of net asset' in col_lower:
-                net_asset_col = col
+        selected_columns = request.get('columns')
+        if selected_columns:
+            try:
+                df_cleaned = df_cleaned[selected_columns]
+            except Exception as e:
+                return {'success': False, 'action': action, 'error': f'Invalid column selection: {str(e)}'}
         
-        # If required columns don't exist, return empty
-        if not scheme_name_col:
-            return candidates, skipped
+        try:
+            response = builders[action](df_cleaned)
+        except InvalidRequest as e:
+            return {'success': False, 'action': action, 'error': str(e)}
+        response['action'] = action
+        return response
+    
+    def select_rows(self, fields, df_cleaned):
+        """
+        Apply the 'columns' selection, then drop the rows listed in
+        'post_merger_deletions' and 'exclude_row_indices'.
         
-        # If comparison columns don't exist, we can't match
-        can_match = fund_manager_col and net_asset_col
+        Returns (df_cleaned, post_merger_deleted_count, excluded_count).
+        """
+        selected_columns_json = fields.get('columns', '')
+        if selected_columns_json:
+            try:
+                selected_columns = json.loads(selected_columns_json)
+                # Filter to only selected columns
+                df_cleaned = df_cleaned[selected_columns]
+            except Exception as e:
+                raise InvalidRequest(f'Invalid column selection: {str(e)}')
         
-        # Find POST MERGER rows
-        post_merger_indices = []
-        for idx, row in df.iterrows():
-            scheme_name = str(row[scheme_name_col]) if pd.notna(row[scheme_name_col]) else ''
-            if 'post merger' in scheme_name.lower():
-                post_merger_indices.append(idx)
+        # Handle POST MERGER deletions - list of pre-merger row indices to delete
+        post_merger_deletions_json = fields.get('post_merger_deletions', '')
+        post_merger_deleted_count = 0
+        if post_merger_deletions_json:
+            try:
+                post_merger_deletions = json.loads(post_merger_deletions_json)
+                if post_merger_deletions and len(post_merger_deletions) > 0:
+                    deletion_set = set(post_merger_deletions)
+                    df_cleaned = df_cleaned[~df_cleaned.index.isin(deletion_set)]
+                    post_merger_deleted_count = len(post_merger_deletions)
+            except Exception as e:
+                raise InvalidRequest(f'Invalid POST MERGER deletions: {str(e)}')
         
-        # Process each POST MERGER row (from bottom to top)
-        post_merger_indices_sorted = sorted(post_merger_indices, reverse=True)
+        # Handle row exclusion - list of row indices to exclude
+        exclude_rows_json = fields.get('exclude_row_indices', '')
+        excluded_count = 0
+        if exclude_rows_json:
+            try:
+                exclude_indices = json.loads(exclude_rows_json)
+                if exclude_indices and len(exclude_indices) > 0:
+                    exclude_set = set(exclude_indices)
+                    df_cleaned = df_cleaned[~df_cleaned.index.isin(exclude_set)]
+                    excluded_count = len(exclude_indices)
+            except Exception as e:
+                raise InvalidRequest(f'Invalid row exclusion indices: {str(e)}')
         
-        for post_merger_idx in post_merger_indices_sorted:
-            post_merger_row = df.iloc[post_merger_idx]
-            scheme_name = str(post_merger_row[scheme_name_col]) if pd.notna(post_merger_row[scheme_name_col]) else ''
-            
-            # Check if row above exists
-            if post_merger_idx == 0:
-                skipped.append({
-                    'row_index': int(post_merger_idx),
-                    'scheme_name': scheme_name,
-                    'reason': 'no row above'
-                })
-                continue
-            
-            # Get row above
-            row_above_idx = post_merger_idx - 1
-            row_above = df.iloc[row_above_idx]
-            row_above_scheme = str(row_above[scheme_name_col]) if pd.notna(row_above[scheme_name_col]) else ''
-            
-            # Check if row above is also POST MERGER
-            if 'post merger' in row_above_scheme.lower():
-                skipped.append({
-                    'row_index': int(post_merger_idx),
-                    'scheme_name': scheme_name,
-                    'reason': 'row above is also POST MERGER'
-                })
-                continue
-            
-            # If we can't match (missing columns), skip
-            if not can_match:
-                skipped.append({
-                    'row_index': int(post_merger_idx),
-                    'scheme_name': scheme_name,
-                    'reason': 'missing comparison columns'
-                })
-                continue
-            
-            # Get comparison values
-            post_merger_fund_manager = str(post_merger_row[fund_manager_col]).strip() if pd.notna(post_merger_row[fund_manager_col]) else ''
-            post_merger_net_asset = post_merger_row[net_asset_col] if pd.notna(post_merger_row[net_asset_col]) else None
-            
-            row_above_fund_manager = str(row_above[fund_manager_col]).strip() if pd.notna(row_above[fund_manager_col]) else ''
-            row_above_net_asset = row_above[net_asset_col] if pd.notna(row_above[net_asset_col]) else None
-            
-            # Check for missing values
-            if not post_merger_fund_manager or post_merger_net_asset is None:
-                skipped.append({
-                    'row_index': int(post_merger_idx),
-                    'scheme_name': scheme_name,
-                    'reason': 'missing Fund Manager data' if not post_merger_fund_manager else 'missing %_of_Net_Asset_10 data'
-                })
-                continue
-            
-            if not row_above_fund_manager or row_above_net_asset is None:
-                skipped.append({
+        return df_cleaned, post_merger_deleted_count, excluded_count
+    
+    def convert_frame(self, fields, df, df_cleaned):
+        """
+        Build the convert action's output frame from the form fields.
+        
+        Returns (df_cleaned, summary) where summary holds the row counts
+        reported to the client.
+        """
+        cleaned_rows = len(df_cleaned)
+        df_cleaned, post_merger_deleted_count, excluded_count = self.select_rows(fields, df_cleaned)
+        
+        return df_cleaned, {
+            'original_rows': len(df),
+            'cleaned_rows': len(df_cleaned),
+            'removed_rows': len(df) - cleaned_rows,
+            'excluded_rows': excluded_count,
+            'post_merger_deleted': post_merger_deleted_count
+        }
+    
+    def filter_frame(self, fields, df_cleaned):
+        """
+        Build the filter_testing_columns action's output frame from the form
+        fields.
+        
+        Returns (df_filtered, summary, columns_to_keep).
+        """
+        df_cleaned, _, _ = self.select_rows(fields, df_cleaned)
+        
+        # Keep only the testing columns and clean Portfolio Turnover Ratio
+        with self.stage('filter'):
+            df_filtered, columns_to_keep = self.filter_testing_columns(
+                df_cleaned, split_dates=fields.get('split_dates', '') == '1'
+            )
+        
+        return df_filtered, {
+            'original_rows': len(df_cleaned),
+            'filtered_rows': len(df_filtered),
+            'columns_count': len(columns_to_keep)
+        }, columns_to_keep
+    
+    def count_headers(self, summary):
+        """Response headers for a summary: {'original_rows': 5} -> {'X-Original-Rows': 5}"""
+        return {
+            'X-' + '-'.join(word.capitalize() for word in name.split('_')): value
+            for name, value in summary.items()
+        }
+    
+    def send_sheets_response(self, action, fields, upload, export_format, sheet_output):
+        """
+        Run convert / filter_testing_columns on several sheets (the 'sheets'
+        field) and send the output: one frame with a Sheet column (combined,
+        also available as a download) or one result per sheet (separate).
+        """
+        try:
+            results = self.process_sheets(upload, action, fields)
+        except InvalidRequest as e:
+            self.send_error_response(400, str(e))
+            return
+        except Exception as e:
+            self.send_error_response(400, f'Failed to read Excel file: {str(e)}')
+            return
+        self.timer.info['sheets'] = len(results)
+        
+        if sheet_output == 'separate':
+            sheets = []
+            for sheet_name, df_out, summary, header_info in results:
+                csv_data, json_data = self.serialize_frame(df_out)
+                sheets.append({'sheet': sheet_name, 'csv_data': csv_data, 'json_data': json_data,
+                               'columns': df_out.columns.tolist(), **summary, **header_info})
+            self.send_json_response({'success': True, 'sheets': sheets})
+            return
+        
+        df_out, summary = self.combine_sheets(results)
+        if export_format:
+            self.send_export(df_out, export_format, upload.filename, self.count_headers(summary))
+            return
+        
+        csv_data, json_data = self.serialize_frame(df_out)
+        response = {
+            'success': True,
+            'csv_data': csv_data,
+            'json_data': json_data,
+            'columns': df_out.columns.tolist(),
+            **summary,
+            'sheets': [
+                {'sheet': sheet_name, **sheet_summary, **header_info}
+                for sheet_name, _, sheet_summary, header_info in results
+            ]
+        }
+        self.send_json_response(response)
+    
+    def process_sheets(self, upload, action, fields):
+        """
+        Process every sheet named by the 'sheets' field on sheet_pool.
+        Row indices are per sheet, so post_merger_deletions and
+        exclude_row_indices are rejected.
+        
+        Returns [(sheet_name, df_out, summary, header_info)] in the order
+        the sheets were requested.
+        """
+        for name in ('post_merger_deletions', 'exclude_row_indices'):
+            if fields.get(name, '') not in ('', '[]'):
+                raise InvalidRequest(f'{name} cannot be used with sheets')
+        sheet_names = self.select_sheets(upload, fields['sheets'])
+        
+        with self.stage('sheets'):
+            # Worker processes read the workbook from a file of their own
+            with tempfile.NamedTemporaryFile(prefix='newfunds-sheets-') as f:
+                shutil.copyfileobj(upload.open(), f)
+                f.flush()
+                results = sheet_pool.run(f.name, sheet_names, action, fields)
+        return [(sheet_name, *result) for sheet_name, result in zip(sheet_names, results)]
+    
+    def select_sheets(self, upload, value):
+        """
+        Turn the sheets field ('all' or a JSON list of names) into the names
+        of the worksheets to process.
+        """
+        available = self.list_sheets(upload)
+        if value == 'all':
+            return available
+        
+        try:
+            sheet_names = json.loads(value)
+            if not isinstance(sheet_names, list) or not sheet_names:
+                raise ValueError('expected "all" or a list of sheet names')
+        except ValueError as e:
+            raise InvalidRequest(f'Invalid sheets: {str(e)}')
+        unknown = [str(name) for name in sheet_names if name not in available]
+        if unknown:
+            raise InvalidRequest(f'Unknown sheets: {", ".join(unknown)}')
+        return sheet_names
+    
+    def list_sheets(self, upload):
+        """Names of the workbook's worksheets, in workbook order"""
+        try:
+            workbook = load_workbook(upload.open(), read_only=True, keep_links=False)
+        except (InvalidFileException, zipfile.BadZipFile):
+            return pd.ExcelFile(upload.open()).sheet_names
+        try:
+            return [sheet.title for sheet in workbook.worksheets]
+        finally:
+            workbook.close()
+    
+    def combine_sheets(self, results):
+        """
+        Concatenate per-sheet output frames under a leading Sheet column.
+        
+        Returns (df_combined, summary) with the row counts summed over the
+        sheets.
+        """
+        frames = [df_out for _, df_out, _, _ in results]
+        combined = pd.concat(frames, ignore_index=True)
+        sheet_names = np.repeat([sheet_name for sheet_name, _, _, _ in results], [len(df) for df in frames])
+        combined.insert(0, SHEET_COLUMN, sheet_names.astype(object), allow_duplicates=True)
+        
+        summary = {}
+        for _, _, sheet_summary, _ in results:
+            for name, value in sheet_summary.items():
+                summary[name] = summary.get(name, 0) + value
+        if 'columns_count' in summary:
+            summary['columns_count'] = len(combined.columns)
+        summary['sheets'] = len(results)
+        return combined, summary
+    
+    def serialize_frame(self, df):
+        """Return the frame as (csv_data, json_data) for a JSON response"""
+        with self.stage('serialize'):
+            df = self.untype_frame(df)
+            csv_buffer = io.StringIO()
+            df.to_csv(csv_buffer, index=False)
+            return csv_buffer.getvalue(), df.to_json(orient='records', indent=2, date_format='iso')
+    
+    def filter_testing_columns(self, df_cleaned, split_dates=False):
+        """
+        Reduce the frame to the testing columns and strip the dates from
+        Portfolio Turnover Ratio values. With split_dates the ratio becomes
+        a float column followed by a 'Portfolio Turnover Ratio As Of' date
+        column (see split_bracketed_dates).
+        
+        Returns (df_filtered, columns_to_keep).
+        """
+        # Find matching columns (case-insensitive, handle variations and whitespace)
+        mapping = column_resolver.resolve(df_cleaned.columns)
+        columns_to_keep = mapping['testing_columns']
+        
+        # Filter dataframe to only testing columns
+        if columns_to_keep:
+            df_filtered = df_cleaned[columns_to_keep]
+        else:
+            df_filtered = df_cleaned.copy()
+        
+        # Clean Portfolio Turnover Ratio column - remove dates in brackets
+        portfolio_turnover_col = mapping['portfolio_turnover']
+        
+        if portfolio_turnover_col is not None:
+            if split_dates and isinstance(df_filtered.columns.get_loc(portfolio_turnover_col), int):
+                # Ratio as a number, with its as-of date in a column of its own
+                numbers, dates = self.split_bracketed_dates(df_filtered[portfolio_turnover_col])
+                date_col = f'{portfolio_turnover_col} As Of'
+                df_filtered = df_filtered.copy()
+                df_filtered[portfolio_turnover_col] = numbers
+                if date_col not in df_filtered.columns:
+                    df_filtered.insert(df_filtered.columns.get_loc(portfolio_turnover_col) + 1, date_col, dates)
+                    if columns_to_keep:
+                        columns_to_keep = df_filtered.columns.tolist()
+            else:
+                # Apply cleaning to the column - use .loc to ensure we modify the dataframe
+                df_filtered.loc[:, portfolio_turnover_col] = self.strip_bracketed_dates(df_filtered[portfolio_turnover_col])
+        
+        return df_filtered, columns_to_keep
+    
+    def strip_bracketed_dates(self, series):
+        """
+        Remove bracketed text such as " (31-Oct-2025)" from every cell of a
+        column, with one vectorized replace. Cells are stringified and
+        stripped; a cell that would end up empty keeps its text, null cells
+        are left as they are.
+        """
+        values = series.to_numpy(dtype=object, copy=True)
+        present = pd.notna(values)
+        text = pd.Series(values[present], dtype=object).astype(str).str.strip()
+        cleaned = text.str.replace(BRACKETED_TEXT_PATTERN, '', regex=True).str.strip()
+        values[present] = cleaned.where(cleaned != '', text).to_numpy(dtype=object)
+        return pd.Series(values, index=series.index, name=series.name)
+    
+    def split_bracketed_dates(self, series):
+        """
+        Split cells such as "41% (31-Oct-2025)" into the number and the date
+        in the last brackets, parsed with BRACKETED_DATE_FORMAT. Percentages
+        become ratios (41% -> 0.41) so they share a scale with cells written
+        as plain ratios ("0.85 (30-Sep-2026)").
+        
+        Returns (numbers, dates) Series, with NaN / NaT where a cell has none.
+        """
+        text = self.column_strings(series)
+        dates = pd.to_datetime(text.str.extract(TRAILING_BRACKETED_DATE_PATTERN, expand=False),
+                               format=BRACKETED_DATE_FORMAT, errors='coerce')
+        values = text.str.replace(BRACKETED_TEXT_PATTERN, '', regex=True).str.strip()
+        is_percent = values.str.endswith('%')
+        numbers = pd.to_numeric(values.str.rstrip('%').str.strip(), errors='coerce')
+        return numbers.where(~is_percent, numbers / 100), dates
+    
+    def get_post_merger_candidates(self, df, match_mode='adjacent'):
+        """
+        Find POST MERGER duplicate candidates without deleting them.
+        Returns candidates for user review.
+        
+        Returns:
+        - candidates: list of dicts with pre_merger and post_merger row info
+        - skipped: list of skipped POST MERGER rows with reasons
+        """
+        matches, skipped = self.find_post_merger_matches(df, match_mode)
+        if not matches:
+            return [], skipped
+        
+        scheme_name_col, fund_manager_col, net_asset_col = self.find_merger_columns(df)
+        
+        # Stringify only the matched rows, in one go
+        positions = [pos for pair in matches for pos in pair]
+        matched_rows = self.untype_frame(df.iloc[positions])
+        row_values = self.stringify_rows(matched_rows)
+        scheme_names = matched_rows[scheme_name_col].tolist()
+        fund_managers = matched_rows[fund_manager_col].tolist()
+        net_assets = matched_rows[net_asset_col].tolist()
+        
+        candidates = []
+        for i, (row_above_idx, post_merger_idx) in enumerate(matches):
+            pre, post = 2 * i, 2 * i + 1
+            candidates.append({
+                'pre_merger': {
+                    'row_index': int(row_above_idx),
+                    'scheme_name': self.cell_str(scheme_names[pre]),
+                    'fund_manager': str(fund_managers[pre]).strip(),
+                    'net_asset': str(net_assets[pre]),
+                    'values': row_values[pre]
+                },
+                'post_merger': {
                     'row_index': int(post_merger_idx),
-                    'scheme_name': scheme_name,
-                    'reason': 'row above missing Fund Manager data' if not row_above_fund_manager else 'row above missing %_of_Net_Asset_10 data'
-                })
-                continue
-            
-            # Compare Fund Manager (case-insensitive)
-            fund_manager_match = post_merger_fund_manager.lower() == row_above_fund_manager.lower()
-            
-            # Compare %_of_Net_Asset_10 (numeric, handle float comparison)
-            try:
-                pm_net_asset_val = float(str(post_merger_net_asset).replace('%', '').strip())
-                ra_net_asset_val = float(str(row_above_net_asset).replace('%', '').strip())
-                net_asset_match = abs(pm_net_asset_val - ra_net_asset_val) < 0.01
-            except (ValueError, TypeError):
-                net_asset_match = False
-            
-            # If both match, add as candidate
-            if fund_manager_match and net_asset_match:
-                # Get full row data for display
-                column_names = df.columns.tolist()
-                pre_merger_values = [str(row_above[col]) if pd.notna(row_above[col]) else '' for col in column_names]
-                post_merger_values = [str(post_merger_row[col]) if pd.notna(post_merger_row[col]) else '' for col in column_names]
-                
-                candidates.append({
-                    'pre_merger': {
-                        'row_index': int(row_above_idx),
-                        'scheme_name': row_above_scheme,
-                        'fund_manager': row_above_fund_manager,
-                        'net_asset': str(row_above_net_asset),
-                        'values': pre_merger_values
-                    },
-                    'post_merger': {
-                        'row_index': int(post_merger_idx),
-                        'scheme_name': scheme_name,
-                        'fund_manager': post_merger_fund_manager,
-                        'net_asset': str(post_merger_net_asset),
-                        'values': post_merger_values
-                    }
-                })
+                    'scheme_name': self.cell_str(scheme_names[post]),
+                    'fund_manager': str(fund_managers[post]).strip(),
+                    'net_asset': str(net_assets[post]),
+                    'values': row_values[post]
+                }
+            })
         
         return candidates, skipped
     
@@ -575,200 +2507,1008 @@ class handler(BaseHTTPRequestHandler):
         - cleaned_df: DataFrame with duplicates removed
         - report: dict with deleted, kept, and skipped rows info
         """
+        matches, skipped = self.find_post_merger_matches(df)
         report = {
             'deleted': [],
             'kept': [],
-            'skipped': []
+            'skipped': skipped
         }
         
-        # Check if required columns exist
-        scheme_name_col = None
-        fund_manager_col = None
-        net_asset_col = None
+        if not matches:
+            return df.copy(), report
         
-        # Find column names (case-insensitive, handle variations)
-        for col in df.columns:
-            col_lower = str(col).lower()
-            if 'scheme name' in col_lower or 'schemename' in col_lower:
-                scheme_name_col = col
-            elif 'fund manager' in col_lower or 'fundmanager' in col_lower:
-                fund_manager_col = col
-            elif '%_of_net_asset_10' in col_lower or '% of net asset' in col_lower:
-                net_asset_col = col
+        scheme_name_col, _, _ = self.find_merger_columns(df)
+        scheme_names = df[scheme_name_col]
+        rows_to_delete = set()
+        for row_above_idx, post_merger_idx in matches:
+            rows_to_delete.add(row_above_idx)
+            report['deleted'].append({
+                'row_index': int(row_above_idx),
+                'scheme_name': self.cell_str(scheme_names.iat[row_above_idx])
+            })
+            report['kept'].append({
+                'row_index': int(post_merger_idx),
+                'scheme_name': self.cell_str(scheme_names.iat[post_merger_idx])
+            })
+        
+        # Remove duplicate rows
+        df_cleaned = df[~df.index.isin(rows_to_delete)].reset_index(drop=True)
+        return df_cleaned, report
+    
+    def find_merger_columns(self, df):
+        """
+        Find the Scheme Name, Fund Manager and %_of_Net_Asset_10 columns
+        (case-insensitive, handle variations). Missing ones are None.
+        """
+        mapping = column_resolver.resolve(df.columns)
+        return mapping['scheme_name'], mapping['fund_manager'], mapping['net_asset']
+    
+    def find_post_merger_matches(self, df, match_mode='adjacent'):
+        """
+        Match every POST MERGER row with the row directly above it using
+        whole-column operations. A pair matches when Fund Manager is equal
+        (case-insensitive) and %_of_Net_Asset_10 is within 0.01. With
+        match_mode 'index' the pre-merger row may be anywhere in the sheet
+        (see find_indexed_post_merger_matches).
         
-        # If required columns don't exist, return original dataframe
+        Returns (both ordered from the bottom of the sheet to the top):
+        - matches: list of (row_above_idx, post_merger_idx) positions
+        - skipped: list of skipped POST MERGER rows with reasons
+        """
+        if match_mode not in MERGER_MATCH_MODES:
+            raise InvalidRequest(f'Unknown merger_match: {match_mode}')
+        scheme_name_col, fund_manager_col, net_asset_col = self.find_merger_columns(df)
+        
+        # If required columns don't exist, nothing to match
         if not scheme_name_col:
-            return df, report
+            return [], []
         
-        # If comparison columns don't exist, we can still detect POST MERGER but can't match
-        can_match = fund_manager_col and net_asset_col
+        scheme_names = self.column_strings(df[scheme_name_col])
+        is_post_merger = scheme_names.str.lower().str.contains('post merger', regex=False).to_numpy(dtype=bool)
+        if not is_post_merger.any():
+            return [], []
         
-        # Find POST MERGER rows
-        post_merger_indices = []
-        for idx, row in df.iterrows():
-            scheme_name = str(row[scheme_name_col]) if pd.notna(row[scheme_name_col]) else ''
-            if 'post merger' in scheme_name.lower():
-                post_merger_indices.append(idx)
+        if match_mode == 'index':
+            return self.find_indexed_post_merger_matches(df, scheme_names, is_post_merger, fund_manager_col, net_asset_col)
         
-        # Process each POST MERGER row (from bottom to top to avoid index shifting issues)
-        rows_to_delete = set()
+        # Row above each row (the first row has none)
+        has_row_above = np.arange(len(df)) > 0
+        above_is_post_merger = np.roll(is_post_merger, 1) & has_row_above
         
-        # Sort indices in reverse order (bottom to top)
-        post_merger_indices_sorted = sorted(post_merger_indices, reverse=True)
+        # If comparison columns don't exist, we can't match
+        can_match = bool(fund_manager_col and net_asset_col)
         
-        for post_merger_idx in post_merger_indices_sorted:
-            post_merger_row = df.iloc[post_merger_idx]
-            scheme_name = str(post_merger_row[scheme_name_col]) if pd.notna(post_merger_row[scheme_name_col]) else ''
-            
-            # Check if row above exists
-            if post_merger_idx == 0:
-                report['skipped'].append({
-                    'row_index': int(post_merger_idx),
-                    'scheme_name': scheme_name,
-                    'reason': 'no row above'
-                })
-                continue
-            
-            # Get row above
-            row_above_idx = post_merger_idx - 1
-            
-            # Check if row above is also POST MERGER
-            row_above_scheme = str(df.iloc[row_above_idx][scheme_name_col]) if pd.notna(df.iloc[row_above_idx][scheme_name_col]) else ''
-            if 'post merger' in row_above_scheme.lower():
-                report['skipped'].append({
-                    'row_index': int(post_merger_idx),
-                    'scheme_name': scheme_name,
-                    'reason': 'row above is also POST MERGER'
-                })
-                continue
-            
-            # If we can't match (missing columns), skip
-            if not can_match:
-                report['skipped'].append({
-                    'row_index': int(post_merger_idx),
-                    'scheme_name': scheme_name,
-                    'reason': 'missing comparison columns'
-                })
-                continue
-            
-            # Get comparison values
-            post_merger_fund_manager = str(post_merger_row[fund_manager_col]).strip() if pd.notna(post_merger_row[fund_manager_col]) else ''
-            post_merger_net_asset = post_merger_row[net_asset_col] if pd.notna(post_merger_row[net_asset_col]) else None
-            
-            row_above = df.iloc[row_above_idx]
-            row_above_fund_manager = str(row_above[fund_manager_col]).strip() if pd.notna(row_above[fund_manager_col]) else ''
-            row_above_net_asset = row_above[net_asset_col] if pd.notna(row_above[net_asset_col]) else None
+        reasons = [
+            (~has_row_above, 'no row above'),
+            (above_is_post_merger, 'row above is also POST MERGER'),
+        ]
+        if can_match:
+            fund_managers = self.column_strings(df[fund_manager_col]).str.strip()
+            fund_managers_lower = fund_managers.str.lower()
+            has_fund_manager = (fund_managers != '').to_numpy(dtype=bool)
+            net_asset_values, has_net_asset = self.merger_net_assets(df, net_asset_col)
             
-            # Check for missing values
-            if not post_merger_fund_manager or post_merger_net_asset is None:
-                report['skipped'].append({
-                    'row_index': int(post_merger_idx),
-                    'scheme_name': scheme_name,
-                    'reason': 'missing Fund Manager data' if not post_merger_fund_manager else 'missing %_of_Net_Asset_10 data'
-                })
-                continue
+            fund_manager_match = (fund_managers_lower == fund_managers_lower.shift(1)).to_numpy(dtype=bool)
+            net_asset_match = ((net_asset_values - net_asset_values.shift(1)).abs() < NET_ASSET_TOLERANCE).to_numpy(dtype=bool)
+            is_match = fund_manager_match & net_asset_match
             
-            if not row_above_fund_manager or row_above_net_asset is None:
-                report['skipped'].append({
+            reasons += [
+                (~has_fund_manager, 'missing Fund Manager data'),
+                (~has_net_asset, 'missing %_of_Net_Asset_10 data'),
+                (~np.roll(has_fund_manager, 1), 'row above missing Fund Manager data'),
+                (~np.roll(has_net_asset, 1), 'row above missing %_of_Net_Asset_10 data'),
+            ]
+        else:
+            is_match = np.zeros(len(df), dtype=bool)
+            reasons.append((np.ones(len(df), dtype=bool), 'missing comparison columns'))
+        
+        # First applicable reason wins, in the order listed above
+        skip_reason = np.select([condition for condition, _ in reasons], [reason for _, reason in reasons], default='')
+        
+        matches = []
+        skipped = []
+        # Process each POST MERGER row (from bottom to top)
+        for post_merger_idx in np.flatnonzero(is_post_merger)[::-1]:
+            reason = skip_reason[post_merger_idx]
+            if reason:
+                skipped.append({
                     'row_index': int(post_merger_idx),
-                    'scheme_name': scheme_name,
-                    'reason': 'row above missing Fund Manager data' if not row_above_fund_manager else 'row above missing %_of_Net_Asset_10 data'
+                    'scheme_name': scheme_names.iat[post_merger_idx],
+                    'reason': str(reason)
                 })
+            elif is_match[post_merger_idx]:
+                matches.append((int(post_merger_idx) - 1, int(post_merger_idx)))
+        
+        return matches, skipped
+    
+    def find_indexed_post_merger_matches(self, df, scheme_names, is_post_merger, fund_manager_col, net_asset_col):
+        """
+        Match POST MERGER rows with pre-merger rows anywhere in the sheet
+        through a hash index on (Fund Manager, %_of_Net_Asset_10 in 0.01
+        buckets, scheme name without "post merger"). Neighbouring buckets
+        are looked up too, so every pair within the tolerance is found.
+        
+        POST MERGER rows are processed from the bottom of the sheet to the
+        top and each takes the nearest unmatched pre-merger row, preferring
+        the one above on a tie. Returns (matches, skipped) like
+        find_post_merger_matches; pre-merger rows may be below their POST
+        MERGER row.
+        """
+        post_merger_positions = np.flatnonzero(is_post_merger)[::-1]
+        if not (fund_manager_col and net_asset_col):
+            return [], [
+                {'row_index': int(pos), 'scheme_name': scheme_names.iat[pos], 'reason': 'missing comparison columns'}
+                for pos in post_merger_positions
+            ]
+        
+        fund_managers = self.column_strings(df[fund_manager_col]).str.lower().str.split().str.join(' ')
+        has_fund_manager = (fund_managers != '').to_numpy(dtype=bool)
+        net_asset_values, has_net_asset = self.merger_net_assets(df, net_asset_col)
+        net_asset_values = net_asset_values.to_numpy(dtype=np.float64)
+        has_value = ~np.isnan(net_asset_values)
+        buckets = np.zeros(len(df), dtype=np.int64)
+        buckets[has_value] = np.floor(net_asset_values[has_value] / NET_ASSET_TOLERANCE)
+        base_names = (scheme_names.str.replace(POST_MERGER_MARKER_PATTERN, ' ', regex=True)
+                      .str.lower().str.split().str.join(' ').str.strip(' -–:'))
+        
+        # Index of the pre-merger rows that could be matched
+        index = {}
+        indexable = ~is_post_merger & has_fund_manager & has_value
+        for pos, key in zip(np.flatnonzero(indexable).tolist(),
+                            zip(fund_managers.to_numpy()[indexable], buckets[indexable].tolist(),
+                                base_names.to_numpy()[indexable])):
+            index.setdefault(key, []).append(pos)
+        
+        matches = []
+        skipped = []
+        used = set()
+        for post_merger_idx in post_merger_positions.tolist():
+            reason = ''
+            if not has_fund_manager[post_merger_idx]:
+                reason = 'missing Fund Manager data'
+            elif not has_net_asset[post_merger_idx]:
+                reason = 'missing %_of_Net_Asset_10 data'
+            else:
+                fund_manager = fund_managers.iat[post_merger_idx]
+                base_name = base_names.iat[post_merger_idx]
+                value = net_asset_values[post_merger_idx]
+                bucket = buckets[post_merger_idx]
+                candidates = [
+                    pos
+                    for near in (bucket - 1, bucket, bucket + 1)
+                    for pos in index.get((fund_manager, near, base_name), ())
+                    if pos not in used and abs(net_asset_values[pos] - value) < NET_ASSET_TOLERANCE
+                ] if has_value[post_merger_idx] else []
+                if candidates:
+                    pre_merger_idx = min(candidates, key=lambda pos: (abs(pos - post_merger_idx), pos > post_merger_idx))
+                    used.add(pre_merger_idx)
+                    matches.append((pre_merger_idx, post_merger_idx))
+                    continue
+                reason = 'no matching pre-merger row'
+            skipped.append({
+                'row_index': post_merger_idx,
+                'scheme_name': scheme_names.iat[post_merger_idx],
+                'reason': reason
+            })
+        
+        return matches, skipped
+    
+    def merger_net_assets(self, df, net_asset_col):
+        """
+        Return the %_of_Net_Asset_10 column as numbers (NaN where not
+        numeric) and a boolean array of the cells that hold any value.
+        """
+        net_assets = df[net_asset_col]
+        null_markers = df.attrs.get('null_markers', {})
+        if net_asset_col in null_markers and net_assets.dtype == np.float64:
+            # Already numeric (see type_frame); cells holding the null
+            # marker count as present, like any other text
+            has_net_asset = (net_assets.notna() | (null_markers[net_asset_col] is not None)).to_numpy(dtype=bool)
+            return net_assets, has_net_asset
+        
+        has_net_asset = net_assets.notna().to_numpy(dtype=bool)
+        # Numeric %_of_Net_Asset_10 with percentage signs removed
+        net_asset_values = pd.to_numeric(
+            self.column_strings(net_assets).str.replace('%', '', regex=False).str.strip(),
+            errors='coerce'
+        )
+        return net_asset_values, has_net_asset
+    
+    def column_strings(self, series):
+        """Return the column as strings, with empty strings for null cells"""
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Stringify each category once; code -1 (null) picks the ''
+            strings = np.append(series.cat.categories.astype(str).to_numpy(dtype=object), '')
+            return pd.Series(strings[series.cat.codes.to_numpy()], index=series.index, name=series.name)
+        return series.where(series.notna(), '').astype(str)
+    
+    def cell_str(self, value):
+        return str(value) if pd.notna(value) else ''
+    
+    def stringify_rows(self, df):
+        """
+        Return the rows as lists of strings, with empty strings for null
+        cells, stringified the same way as iterating a row would.
+        """
+        values = pd.DataFrame(df.values).astype(object, copy=False)
+        return values.where(values.notna(), '').astype(str).to_numpy().tolist()
+    
+    def resolve_header_row(self, value, upload, engine=DEFAULT_EXCEL_ENGINE, sheet_name=None):
+        """
+        Turn the header_row form value into a row index. When it is omitted
+        ('' or 'auto') the header is detected from the first rows.
+        
+        Returns (header_row, header_info) where header_info is sent back to
+        the client: the detected row and its confidence, or {} when the row
+        was given. A row matching a known header layout (see ColumnResolver)
+        is taken with confidence 1.0 without scoring.
+        """
+        if value not in ('', 'auto'):
+            try:
+                return int(value), {}
+            except ValueError:
+                raise InvalidRequest(f'Invalid header_row: {value}')
+        
+        with self.stage('detect'):
+            rows, _ = self.read_preview(upload, HEADER_SCAN_ROWS, engine, count_rows=False, sheet_name=sheet_name)
+            header_row = column_resolver.find_header_row(rows)
+            if header_row is not None:
+                # A header layout seen before
+                confidence = 1.0
+            else:
+                header_row, confidence = self.detect_header_row(rows)
+        return header_row, {'header_row': header_row, 'header_confidence': confidence}
+    
+    def resolve_header_rows(self, value, upload, engine, sheets=''):
+        """
+        resolve_header_row for the first sheet, or for each sheet named by a
+        'sheets' field. Returns a list of (header_row, header_info).
+        """
+        sheet_names = self.select_sheets(upload, sheets) if sheets else [None]
+        return [self.resolve_header_row(value, upload, engine, sheet_name) for sheet_name in sheet_names]
+    
+    def detect_header_row(self, rows):
+        """
+        Pick the header among the first sheet rows (lists of cell strings).
+        
+        Every row scores 0..1: how full it is compared with the widest row,
+        times the average of its share of text (non-numeric) cells, twice
+        its share of cells matching the header vocabulary, and its share of
+        distinct values. Rows with fewer than two cells, separators and
+        disclaimers score 0. The first best-scoring row wins.
+        
+        Returns (row_index, confidence), confidence being the winner's lead
+        over the runner-up relative to its own score (0 = a tie, 1 = no
+        other candidate).
+        """
+        row_cells = [[cell.strip() for cell in row if cell.strip()] for row in rows]
+        max_width = max((len(cells) for cells in row_cells), default=0)
+        
+        scores = []
+        for cells in row_cells:
+            joined = ' '.join(cells)
+            if len(cells) < 2 or SEPARATOR_PATTERN.match(joined) or DISCLAIMER_PATTERN.search(joined):
+                scores.append(0.0)
                 continue
+            text = sum(1 for cell in cells if not self.is_number(cell)) / len(cells)
+            vocabulary = sum(1 for cell in cells if HEADER_VOCABULARY_PATTERN.search(cell)) / len(cells)
+            distinct = len(set(cells)) / len(cells)
+            fill = len(cells) / max_width
+            scores.append(fill * (text + 2 * vocabulary + distinct) / 4)
+        
+        if not scores or max(scores) == 0:
+            return 0, 0.0
+        best = scores.index(max(scores))
+        runner_up = max(scores[:best] + scores[best + 1:], default=0.0)
+        return best, round((scores[best] - runner_up) / scores[best], 2)
+    
+    def is_number(self, text):
+        try:
+            float(text)
+        except ValueError:
+            return False
+        return True
+    
+    def read_preview(self, upload, num_rows, engine=DEFAULT_EXCEL_ENGINE, count_rows=True, sheet_name=None):
+        """
+        Read the first `num_rows` rows of the first sheet (or `sheet_name`) as
+        lists of strings.
+        
+        .xlsx files are streamed (with XlsxSheetReader for the 'fast' engine,
+        otherwise openpyxl in read-only mode) and reading stops after
+        `num_rows`, so the cost does not grow with the workbook. total_rows
+        then comes from the sheet's dimension metadata, which may count
+        trailing formatted-but-empty rows. Anything openpyxl cannot open
+        (e.g. .xls) goes through the full pandas parse instead.
+        
+        Returns:
+        - rows: list of lists of cell strings ('' for empty cells)
+        - total_rows: number of rows in the sheet (None with count_rows=False
+          when the sheet has no dimension metadata)
+        """
+        if engine == 'fast':
+            try:
+                with XlsxSheetReader(upload.open(), sheet_name) as reader:
+                    rows = []
+                    row_iter = reader.iter_rows()
+                    for row in row_iter:
+                        values = ['' if self.is_empty_cell(value) else str(value) for value in row]
+                        # Error cells are blank in the preview, trim them too
+                        while values and values[-1] == '':
+                            values.pop()
+                        rows.append(values)
+                        if len(rows) >= num_rows:
+                            break
+                    total_rows = reader.dimension_rows
+                    if total_rows is None and count_rows:
+                        total_rows = len(rows) + sum(1 for _ in row_iter)
+            except UnsupportedWorkbook:
+                pass
+            else:
+                return self.pad_preview_rows(rows), total_rows
+        
+        try:
+            workbook = load_workbook(upload.open(), read_only=True, data_only=True, keep_links=False)
+        except (InvalidFileException, zipfile.BadZipFile):
+            df_raw, _ = self.load_frames(upload, None, clean=False, sheet_name=sheet_name)
+            preview_rows = df_raw.head(num_rows).values.tolist()
+            rows = [[str(cell) if cell is not None and str(cell) != 'nan' else '' for cell in row] for row in preview_rows]
+            return rows, len(df_raw)
+        
+        try:
+            sheet = workbook.worksheets[0] if sheet_name is None else workbook[sheet_name]
+            total_rows = sheet.max_row
+            # Don't trust the dimension for the column range (same as pandas)
+            sheet.reset_dimensions()
             
-            # Compare Fund Manager (case-insensitive)
-            fund_manager_match = post_merger_fund_manager.lower() == row_above_fund_manager.lower()
+            rows = []
+            row_iter = iter(sheet.rows)
+            for row in row_iter:
+                values = [self.preview_cell_str(cell) for cell in row]
+                # Trim trailing empty cells
+                while values and values[-1] == '':
+                    values.pop()
+                rows.append(values)
+                if len(rows) >= num_rows:
+                    break
             
-            # Compare %_of_Net_Asset_10 (numeric, handle float comparison)
+            if total_rows is None and count_rows:
+                # No dimension metadata - count the remaining rows without
+                # converting any cells
+                total_rows = len(rows) + sum(1 for _ in row_iter)
+        finally:
+            workbook.close()
+        
+        return self.pad_preview_rows(rows), total_rows
+    
+    def pad_preview_rows(self, rows):
+        """Trim trailing empty rows and pad the rest to a common width"""
+        while rows and not rows[-1]:
+            rows.pop()
+        width = max((len(row) for row in rows), default=0)
+        return [row + [''] * (width - len(row)) for row in rows]
+    
+    def is_empty_cell(self, value):
+        return isinstance(value, float) and np.isnan(value) or (isinstance(value, str) and value == '')
+    
+    def preview_cell_str(self, cell):
+        """Stringify an openpyxl cell the way a pandas read of it would"""
+        value = cell.value
+        if value is None or cell.data_type == 'e':
+            return ''
+        if cell.data_type == 'n' and isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+    
+    def load_frames(self, upload, header_row, clean=True, engine=DEFAULT_EXCEL_ENGINE, sheet_name=None,
+                    on_clean_rows=None):
+        """
+        Parse the first sheet (or `sheet_name`) of the workbook and optionally
+        clean it, going through the frame cache so the same upload, sheet and
+        header_row are only parsed once. Both engines produce the same frame,
+        so the engine is not part of the key. `on_clean_rows` is passed to
+        clean_dataframe as its progress callback.
+        
+        Returns:
+        - df_raw: DataFrame as read from Excel
+        - df_cleaned: output of clean_dataframe, or None when clean=False
+        """
+        key = (upload.sha256, header_row) if sheet_name is None else (upload.sha256, header_row, sheet_name)
+        cached = frame_cache.get(key)
+        if self.timer is not None:
+            self.timer.info['frame_cache'] = 'miss' if cached is None else 'hit'
+        if cached is not None:
+            df_raw, df_cleaned = cached
+            if df_cleaned is not None or not clean:
+                return df_raw, df_cleaned
+        else:
+            with self.stage('read'):
+                df_raw = self.read_excel(upload, header_row, engine, sheet_name)
+        
+            if header_row is not None:
+                # Remember where this layout's header is
+                column_resolver.resolve(df_raw.columns, header_row)
+        
+        if clean:
+            with self.stage('clean'):
+                df_cleaned = self.clean_dataframe(df_raw, on_clean_rows)
+            if TYPED_FRAMES:
+                with self.stage('type'):
+                    df_cleaned, saved_bytes = self.type_frame(df_cleaned)
+                if self.timer is not None:
+                    self.timer.info['typed_bytes_saved'] = saved_bytes
+        else:
+            df_cleaned = None
+        frame_cache.put(key, df_raw, df_cleaned)
+        return df_raw, df_cleaned
+    
+    def read_excel(self, upload, header_row, engine=DEFAULT_EXCEL_ENGINE, sheet_name=None):
+        """
+        Read the first sheet (or `sheet_name`) into a DataFrame with the
+        selected engine.
+        
+        .xlsx rows are streamed and reading stops at the first footer
+        sentinel below the header, so trailing benchmark and footnote rows
+        are never materialized. The openpyxl engine converts cells the way
+        pd.read_excel does; files openpyxl cannot open (e.g. .xls) are
+        handed to pd.read_excel as a whole.
+        """
+        rows = self.read_sheet_rows(upload, header_row, engine, sheet_name)
+        if rows is None:
+            return pd.read_excel(upload.open(), header=header_row, sheet_name=0 if sheet_name is None else sheet_name)
+        return self.frame_from_rows(rows, header_row)
+    
+    def read_sheet_rows(self, upload, header_row, engine=DEFAULT_EXCEL_ENGINE, sheet_name=None):
+        """
+        Stream the sheet's rows as read_excel feeds them to the TextParser
+        (see collect_sheet_rows), or return None when openpyxl cannot open
+        the file and it has to go through pd.read_excel.
+        """
+        if engine == 'fast':
             try:
-                # Convert to float, handle percentage signs
-                pm_net_asset_val = float(str(post_merger_net_asset).replace('%', '').strip())
-                ra_net_asset_val = float(str(row_above_net_asset).replace('%', '').strip())
-                net_asset_match = abs(pm_net_asset_val - ra_net_asset_val) < 0.01  # Small tolerance for floating point
-            except (ValueError, TypeError):
-                net_asset_match = False
-            
-            # If both match, mark row above for deletion
-            if fund_manager_match and net_asset_match:
-                # Safety check: don't delete if row above is already marked or is a POST MERGER row
-                if row_above_idx not in rows_to_delete and row_above_idx not in post_merger_indices:
-                    rows_to_delete.add(row_above_idx)
-                    report['deleted'].append({
-                        'row_index': int(row_above_idx),
-                        'scheme_name': row_above_scheme
-                    })
-                    report['kept'].append({
-                        'row_index': int(post_merger_idx),
-                        'scheme_name': scheme_name
-                    })
+                with XlsxSheetReader(upload.open(), sheet_name) as reader:
+                    return reader.read_rows(header_row)
+            except UnsupportedWorkbook:
+                pass
         
-        # Remove duplicate rows
-        if rows_to_delete:
-            df_cleaned = df[~df.index.isin(rows_to_delete)].reset_index(drop=True)
+        try:
+            workbook = load_workbook(upload.open(), read_only=True, data_only=True, keep_links=False)
+        except Exception:
+            return None
+        
+        try:
+            sheet = workbook.worksheets[0] if sheet_name is None else workbook[sheet_name]
+            # Don't trust the dimension for the column range (same as pandas)
+            sheet.reset_dimensions()
+            return collect_sheet_rows(self.iter_openpyxl_rows(sheet), header_row)
+        finally:
+            workbook.close()
+    
+    def read_headers(self, upload, header_row, engine=DEFAULT_EXCEL_ENGINE):
+        """
+        The get_headers response worked out from the sheet rows without
+        pandas: column names as the TextParser would name them and the row
+        count clean_dataframe would leave. Returns None for anything this
+        does not cover (files openpyxl cannot open, header cells that are
+        not text, a header row past the data), which then goes through
+        load_frames.
+        """
+        rows = self.read_sheet_rows(upload, header_row, engine)
+        if rows is None:
+            return None
+        if not rows:
+            columns, data_rows = [], []
+        elif header_row is None:
+            columns, data_rows = list(range(len(rows[0]))), rows
+        elif header_row < len(rows) and all(isinstance(cell, str) for cell in rows[header_row]):
+            columns, data_rows = self.parser_column_names(rows[header_row]), rows[header_row + 1:]
         else:
-            df_cleaned = df.copy()
+            return None
         
-        return df_cleaned, report
+        if header_row is not None:
+            # Remember where this layout's header is, as load_frames does
+            column_resolver.resolve(columns, header_row)
+        
+        kept = 0
+        for row in data_rows:
+            joined = ' '.join(
+                str(cell) for cell in row
+                if not (isinstance(cell, float) and cell != cell) and not (isinstance(cell, str) and cell in PANDAS_NA_STRINGS)
+            ).strip()
+            if joined and not SEPARATOR_PATTERN.match(joined) and not DISCLAIMER_PATTERN.search(joined):
+                kept += 1
+        
+        return {
+            'success': True,
+            'columns': columns,
+            # clean_dataframe keeps every row when it would drop them all
+            'total_rows': kept or len(data_rows)
+        }
+    
+    def parser_column_names(self, names):
+        """
+        Name columns from a header row of strings like pandas' python
+        parser: empty cells become 'Unnamed: <position>' and repeated names
+        get '.1', '.2', ... suffixes, named columns first.
+        """
+        names = list(names)
+        unnamed = set()
+        for i, name in enumerate(names):
+            if name == '':
+                names[i] = f'Unnamed: {i}'
+                unnamed.add(i)
+        
+        counts = {}
+        for i in [i for i in range(len(names)) if i not in unnamed] + sorted(unnamed):
+            name = original = names[i]
+            count = counts.get(name, 0)
+            while count > 0:
+                counts[original] = count + 1
+                name = f'{original}.{count}'
+                count = count + 1 if name in names else counts.get(name, 0)
+            names[i] = name
+            counts[name] = count + 1
+        return names
+    
+    def iter_openpyxl_rows(self, sheet):
+        """Yield sheet rows converted like pandas' openpyxl reader does"""
+        for row in sheet.rows:
+            values = [self.openpyxl_cell_value(cell) for cell in row]
+            # Trim trailing empty cells
+            while values and values[-1] == '':
+                values.pop()
+            yield values
+    
+    def openpyxl_cell_value(self, cell):
+        value = cell.value
+        if value is None:
+            return ''
+        if cell.data_type == 'e':
+            return np.nan
+        if cell.data_type == 'n':
+            as_int = int(value)
+            return as_int if as_int == value else float(value)
+        return value
+    
+    def frame_from_rows(self, rows, header_row):
+        """
+        Build a DataFrame from sheet rows through pandas' TextParser with the
+        options read_excel uses, so headers, NA values and dtype inference
+        come out the same as pd.read_excel.
+        """
+        if not rows:
+            return pd.DataFrame()
+        # Through pd, so a first use waits for an import in progress
+        try:
+            return pd.io.parsers.TextParser(rows, header=header_row, skip_blank_lines=False).read()
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame()
+    
+    def rows_to_keep(self, df):
+        """Boolean array of the rows clean_dataframe keeps"""
+        row_str = self.join_row_strings(df)
+        
+        # Skip completely empty rows
+        is_empty = row_str == ''
+        
+        # Skip separator rows (all dashes, equals, underscores, etc.)
+        is_separator = row_str.str.match(SEPARATOR_PATTERN)
+        
+        # Check for common disclaimer patterns
+        is_disclaimer = row_str.str.contains(DISCLAIMER_PATTERN)
+        
+        # Keep everything else - no special cases!
+        return ~(is_empty | is_separator | is_disclaimer).to_numpy(dtype=bool)
     
-    def clean_dataframe(self, df):
+    def clean_dataframe(self, df, on_rows=None):
         """
         Clean the dataframe by removing:
         1. Completely empty rows
         2. Rows that are disclaimers or metadata
         3. Separator rows (all dashes, equals, etc.)
         Keep everything else - no hardcoded names!
+        
+        Works column-wise: every row is joined into one string (non-null
+        cells separated by spaces) and the checks run on that whole series.
+        With `on_rows` the frame is checked CLEAN_PROGRESS_ROWS rows at a
+        time and on_rows(rows_checked, total_rows) is called after each
+        block.
         """
-        rows_to_keep = []
+        if on_rows is None:
+            keep = self.rows_to_keep(df)
+        else:
+            keep = np.zeros(len(df), dtype=bool)
+            for start in range(0, len(df), CLEAN_PROGRESS_ROWS):
+                block = df.iloc[start:start + CLEAN_PROGRESS_ROWS]
+                keep[start:start + len(block)] = self.rows_to_keep(block)
+                on_rows(start + len(block), len(df))
         
-        for idx, row in df.iterrows():
-            # Convert row to string and check if it's mostly empty
-            row_str = ' '.join([str(val) for val in row if pd.notna(val)]).strip()
-            
-            # Skip completely empty rows
-            if not row_str:
+        # Return cleaned dataframe
+        if keep.any():
+            return df.loc[keep].reset_index(drop=True)
+        return df
+    
+    def type_frame(self, df):
+        """
+        Return a compact copy of a cleaned frame:
+        - object columns holding only numbers, apart from empty cells or a
+          single null marker such as '--', become float64. The marker is kept
+          in attrs['null_markers'] so untype_frame can restore the cells
+        - text columns where at most CATEGORY_MAX_DISTINCT of the values are
+          distinct become category
+        Portfolio Turnover Ratio is left as it is, it is cleaned as text.
+        
+        Returns (typed_df, bytes_saved).
+        """
+        if not df.columns.is_unique:
+            return df, 0
+        turnover_col = column_resolver.resolve(df.columns)['portfolio_turnover']
+        
+        typed_columns = {}
+        null_markers = {}
+        for col in df.columns:
+            series = df[col]
+            if col == turnover_col or series.dtype != object:
                 continue
-            
-            # Skip separator rows (all dashes, equals, underscores, etc.)
-            if re.match(r'^[-=_\s]+$', row_str):
+            kind = pd.api.types.infer_dtype(series, skipna=True)
+            if kind == 'string':
+                non_null = series.count()
+                if series.nunique() <= non_null * CATEGORY_MAX_DISTINCT:
+                    typed_columns[col] = series.astype('category')
                 continue
             
-            # Check for common disclaimer patterns
-            disclaimer_patterns = [
-                r'^source:',
-                r'^data as on',
-                r'^report generated',
-                r'^\*.*returns',
-                r'^note:',
-                r'^disclaimer',
-                r'^less than \d+ year',
-                r'compound annualized',
-                r'absolute returns',
-            ]
-            
-            # Check if row matches any disclaimer pattern
-            is_disclaimer = any(re.search(pattern, row_str, re.IGNORECASE) 
-                              for pattern in disclaimer_patterns)
-            
-            if is_disclaimer:
+            marker = None
+            if kind in ('mixed', 'mixed-integer'):
+                # Numbers plus one null marker, and no empty cells
+                is_text = series.map(type).eq(str).to_numpy(dtype=bool)
+                markers = series[is_text].unique()
+                if len(markers) != 1 or markers[0].strip().lower() not in NULL_MARKERS or series.isna().any():
+                    continue
+                marker = markers[0]
+                series = series.where(~is_text)
+                kind = pd.api.types.infer_dtype(series, skipna=True)
+            if kind not in ('integer', 'floating', 'mixed-integer-float'):
                 continue
-            
-            # Keep everything else - no special cases!
-            rows_to_keep.append(idx)
+            values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            # Integers beyond this would not survive the round trip
+            if np.nanmax(np.abs(values)) > 2 ** 53:
+                continue
+            typed_columns[col] = pd.Series(values, index=df.index, name=col)
+            null_markers[col] = marker
         
-        # Return cleaned dataframe
-        if rows_to_keep:
-            return df.loc[rows_to_keep].reset_index(drop=True)
-        return df
+        if not typed_columns:
+            return df, 0
+        typed = df.copy(deep=False)
+        for col, series in typed_columns.items():
+            typed[col] = series
+        typed.attrs['null_markers'] = null_markers
+        return typed, frame_nbytes(df) - frame_nbytes(typed)
+    
+    def untype_frame(self, df):
+        """
+        Undo type_frame's numeric coercion on (a slice of) a typed frame for
+        output: NaN goes back to the column's null marker and whole numbers
+        back to ints, the way the Excel readers produce cells. Other frames
+        are returned as they are.
+        """
+        null_markers = df.attrs.get('null_markers')
+        if not null_markers:
+            return df
+        
+        untyped = None
+        for position, col in enumerate(df.columns):
+            if col not in null_markers or df.dtypes.iloc[position] != np.float64:
+                continue
+            values = df.iloc[:, position].to_numpy()
+            cells = values.astype(object)
+            whole = np.isfinite(values) & (values == np.floor(values))
+            cells[whole] = values[whole].astype(np.int64).astype(object)
+            if null_markers[col] is not None:
+                cells[np.isnan(values)] = null_markers[col]
+            if untyped is None:
+                untyped = df.copy(deep=False)
+            untyped.isetitem(position, cells)
+        return df if untyped is None else untyped
+    
+    def join_row_strings(self, df):
+        """
+        Return a Series with each row's non-null values converted with str()
+        and joined by single spaces, stripped of surrounding whitespace.
+        """
+        # Go through .values so cells are stringified exactly as iterrows()
+        # would see them (e.g. ints upcast to float in all-numeric frames)
+        values = pd.DataFrame(df.values).astype(object, copy=False)
+        
+        joined = None
+        for col in values.columns:
+            cells = values[col]
+            cells = cells.where(cells.isna(), cells.astype(str))
+            if joined is None:
+                joined = cells
+            else:
+                both = joined.notna() & cells.notna()
+                joined = joined.where(cells.isna(), cells.where(~both, joined + ' ' + cells))
+        
+        if joined is None:
+            return pd.Series('', index=range(len(df)), dtype=object)
+        return joined.fillna('').astype(str).str.strip()
+    
+    def send_export(self, df, export_format, source_filename, counts):
+        """
+        Send the frame as a raw CSV / JSON / NDJSON download. Rows are
+        serialized and written to wfile a chunk at a time; `counts` are sent
+        as response headers.
+        """
+        chunks = self.iter_export_chunks(df, export_format)
+        if self.result_key is not None:
+            chunks = self.cache_result(chunks, self.result_key, counts)
+        self.send_download(chunks, export_format, source_filename, counts)
+    
+    def cache_result(self, chunks, key, counts):
+        """Pass the chunks through and store the whole body in result_cache once they are done"""
+        body = []
+        for chunk in chunks:
+            body.append(chunk)
+            yield chunk
+        result_cache.put(key, b''.join(body), counts)
+    
+    def send_download(self, chunks, export_format, source_filename, counts):
+        """Send already serialized chunks as an export download"""
+        base_name = os.path.splitext(os.path.basename(source_filename or ''))[0]
+        base_name = re.sub(r'[^A-Za-z0-9._ -]', '_', base_name) or 'export'
+        
+        self.send_response(200)
+        self.send_header('Content-type', EXPORT_CONTENT_TYPES[export_format])
+        self.send_header('Content-Disposition', f'attachment; filename="{base_name}_cleaned.{export_format}"')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        exposed = list(counts)
+        if self.result_key is not None:
+            exposed.append('ETag')
+        self.send_header('Access-Control-Expose-Headers', ', '.join(exposed))
+        for name, value in counts.items():
+            self.send_header(name, str(value))
+        self.write_body(chunks, etag_key=self.result_key)
+    
+    def etag(self, key, gzipped):
+        """
+        Strong ETag of result `key` as sent: the gzip-encoded body is a
+        different representation, so it gets a tag of its own
+        """
+        return f'"{key}-gzip"' if gzipped else f'"{key}"'
+    
+    def etag_matches(self, key):
+        """
+        Return the ETag of result `key` listed in the request's If-None-Match,
+        or None. The gzip variant only matches while the client still
+        accepts gzip.
+        """
+        if_none_match = self.headers.get('If-None-Match', '')
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        variants = (True, False) if self.accepts_gzip() else (False,)
+        for gzipped in variants:
+            etag = self.etag(key, gzipped)
+            if etag in tags or f'W/{etag}' in tags:
+                return etag
+        return None
+    
+    def send_not_modified(self, etag):
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Expose-Headers', 'ETag')
+        self.end_headers()
+    
+    def iter_file_chunks(self, path):
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(JOB_RESULT_CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+    
+    def iter_export_chunks(self, df, export_format, on_rows=None):
+        """
+        Yield the serialized frame as UTF-8 chunks of EXPORT_CHUNK_ROWS rows.
+        `on_rows` is called with the number of rows serialized so far after
+        each chunk.
+        """
+        wrote_records = False
+        if export_format == 'json':
+            yield b'['
+        
+        for start in range(0, max(len(df), 1), EXPORT_CHUNK_ROWS):
+            chunk = self.untype_frame(df.iloc[start:start + EXPORT_CHUNK_ROWS])
+            if export_format == 'csv':
+                text = chunk.to_csv(index=False, header=(start == 0))
+            elif export_format == 'ndjson':
+                text = chunk.to_json(orient='records', lines=True, date_format='iso') if len(chunk) else ''
+                if text and not text.endswith('\n'):
+                    text += '\n'
+            else:
+                # Strip the brackets so chunks join into one array
+                text = chunk.to_json(orient='records', date_format='iso')[1:-1]
+                if text and wrote_records:
+                    text = ',' + text
+                wrote_records = wrote_records or bool(text)
+            yield text.encode('utf-8')
+            if on_rows is not None:
+                on_rows(start + len(chunk))
+        
+        if export_format == 'json':
+            yield b']'
+    
+    def send_json_response(self, response, code=200):
+        """Send a JSON response"""
+        self.send_response(code)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        with self.stage('serialize'):
+            body = json.dumps(response).encode()
+        self.write_body([body])
     
     def send_error_response(self, code, message):
         """Send an error response"""
         self.send_response(code)
         self.send_header('Content-type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.end_headers()
         
         error_response = {
             'success': False,
             'error': message
         }
-        self.wfile.write(json.dumps(error_response).encode())
+        self.write_body([json.dumps(error_response).encode()])
+    
+    def write_body(self, chunks, etag_key=None):
+        """
+        Finish the headers and write the body chunks. The body is streamed
+        through a gzip compressor when the client accepts gzip and the body
+        reaches GZIP_MIN_BYTES (chunks are buffered only until then). With
+        `etag_key` the ETag for the chosen encoding is sent as well.
+        """
+        chunks = iter(chunks)
+        head = []
+        head_size = 0
+        if self.accepts_gzip():
+            for chunk in chunks:
+                head.append(chunk)
+                head_size += len(chunk)
+                if head_size >= GZIP_MIN_BYTES:
+                    break
+        
+        compress = head_size >= GZIP_MIN_BYTES
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        if etag_key is not None:
+            self.send_header('ETag', self.etag(etag_key, compress))
+        self.send_header('Vary', 'Accept-Encoding')
+        if self.timer is not None:
+            # Streamed bodies are serialized after this point, so their
+            # serialization time only shows up in the request log line
+            self.send_header('Server-Timing', self.timer.server_timing())
+            self.send_header('Timing-Allow-Origin', '*')
+        self.end_headers()
+        
+        with self.stage('write'):
+            if not compress:
+                for chunk in itertools.chain(head, chunks):
+                    self.wfile.write(chunk)
+                return
+            
+            # wbits=31 writes a gzip header and trailer around the deflate stream
+            compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            for chunk in itertools.chain(head, chunks):
+                data = compressor.compress(chunk)
+                if data:
+                    self.wfile.write(data)
+            self.wfile.write(compressor.flush())
+    
+    def accepts_gzip(self):
+        """True when the request's Accept-Encoding allows gzip"""
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = coding.partition(';')
+            if name.strip().lower() not in ('gzip', '*'):
+                continue
+            quality = re.search(r'q=([0-9.]+)', params)
+            try:
+                if quality is None or float(quality.group(1)) > 0:
+                    return True
+            except ValueError:
+                continue
+        return False
+
+
+class JobWorker(handler):
+    """
+    Runs one queued job with the handler's processing methods. It is never
+    bound to a request, so BaseHTTPRequestHandler's constructor (which
+    handles a request straight away) is not called.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def run(self, job_id):
+        job = self.store.get(job_id)
+        if job is None:
+            return
+        fields = job['fields']
+        progress = {'stage': 'reading'}
+        
+        try:
+            self.store.update(job_id, status='running', progress=progress)
+            sheets = fields.get('sheets', '')
+            with open(self.store.input_path(job_id), 'rb') as f:
+                upload = UploadedFile(f, job['size'], job['sha256'], job['filename'])
+                if sheets:
+                    # Sheets are read, cleaned and filtered on the sheet pool
+                    df_out, summary = self.combine_sheets(self.process_sheets(upload, job['action'], fields))
+                    header_info = {}
+                else:
+                    header_row, header_info = self.resolve_header_row(fields.get('header_row', ''), upload, fields['engine'])
+                    
+                    def on_clean_rows(rows_cleaned, total_rows):
+                        progress.update({'stage': 'cleaning', 'rows_cleaned': rows_cleaned, 'total_rows': total_rows})
+                        self.store.update(job_id, progress=progress)
+                    
+                    df, df_cleaned = self.load_frames(upload, header_row, engine=fields['engine'],
+                                                      on_clean_rows=on_clean_rows)
+            
+            if not sheets:
+                progress.update({'stage': 'filtering', 'rows_cleaned': len(df_cleaned)})
+                self.store.update(job_id, progress=progress)
+                if job['action'] == 'filter_testing_columns':
+                    df_out, summary, _ = self.filter_frame(fields, df_cleaned)
+                else:
+                    df_out, summary = self.convert_frame(fields, df, df_cleaned)
+            
+            progress.update({'stage': 'writing', 'rows_written': 0, 'total_rows': len(df_out)})
+            self.store.update(job_id, progress=progress)
+            
+            def on_rows(rows_written):
+                progress['rows_written'] = rows_written
+                self.store.update(job_id, progress=progress)
+            
+            with open(self.store.result_path(job_id), 'wb') as f:
+                for chunk in self.iter_export_chunks(df_out, fields['format'], on_rows):
+                    f.write(chunk)
+            
+            progress['stage'] = 'done'
+            summary.update(header_info)
+            self.store.update(job_id, status='done', progress=progress, summary=summary)
+        except Exception as e:
+            self.store.update(job_id, status='failed', progress=progress, error=str(e))
+
+
+class SheetWorker(handler):
+    """
+    Processes one sheet of a multi-sheet request, usually in a SheetPool
+    worker process. Like JobWorker it is never bound to a request.
+    """
+
+    def __init__(self):
+        pass
+
+    def run(self, path, sheet_name, action, fields):
+        """Returns (df_out, summary, header_info) for the sheet"""
+        with open(path, 'rb') as f:
+            upload = UploadedFile(f, os.path.getsize(path), '', os.path.basename(path))
+            header_row, header_info = self.resolve_header_row(fields.get('header_row', ''), upload, fields['engine'], sheet_name)
+            df = self.read_excel(upload, header_row, fields['engine'], sheet_name)
+        if header_row is not None:
+            column_resolver.resolve(df.columns, header_row)
+        df_cleaned = self.clean_dataframe(df)
+        # POST MERGER pairs are only counted; deleting them needs a review
+        matches, _ = self.find_post_merger_matches(df_cleaned, fields.get('merger_match', 'adjacent'))
+        
+        if action == 'filter_testing_columns':
+            df_out, summary, _ = self.filter_frame(fields, df_cleaned)
+        else:
+            df_out, summary = self.convert_frame(fields, df, df_cleaned)
+        summary['post_merger_candidates'] = len(matches)
+        return df_out, summary, header_info
+
+
+def process_sheet(path, sheet_name, action, fields):
+    """SheetPool task, a module-level function so it can be pickled"""
+    return SheetWorker().run(path, sheet_name, action, fields)
@@ -1,11 +1,20 @@
 let selectedFile = null;
+let workbookId = null;
+// Whether the server runs background jobs (sent back by the upload action)
+let asyncJobs = false;
+// Set once an upload could not be found again (each serverless instance
+// keeps its own uploads); the file is then sent along with every action
+let sendFileInline = false;
 let convertedCsvData = null;
 let convertedJsonData = null;
+let lastExportFields = null;
 let availableColumns = [];
 let selectedHeaderRow = 0;
 let bottomRowsData = [];
+let exclusionWindowStart = 0;
 let excludedRowIndices = new Set();
 let postMergerCandidates = [];
+let prefetchedPostMerger = null;
 let selectedPostMergerDeletions = new Set();
 
 // Get DOM elements
@@ -26,6 +35,7 @@ const columnSelection = document.getElementById('columnSelection');
 const columnsGrid = document.getElementById('columnsGrid');
 const selectAllBtn = document.getElementById('selectAllBtn');
 const deselectAllBtn = document.getElementById('deselectAllBtn');
+const changeHeaderBtn = document.getElementById('changeHeaderBtn');
 const selectedCount = document.getElementById('selectedCount');
 const proceedBtn = document.getElementById('proceedBtn');
 const rowExclusion = document.getElementById('rowExclusion');
@@ -35,6 +45,7 @@ const exclusionTableBody = document.getElementById('exclusionTableBody');
 const excludedRowsCount = document.getElementById('excludedRowsCount');
 const selectAllRowsBtn = document.getElementById('selectAllRowsBtn');
 const deselectAllRowsBtn = document.getElementById('deselectAllRowsBtn');
+const loadEarlierRowsBtn = document.getElementById('loadEarlierRowsBtn');
 const backToColumnsBtn = document.getElementById('backToColumnsBtn');
 const continueToPostMergerBtn = document.getElementById('continueToPostMergerBtn');
 const postMergerReview = document.getElementById('postMergerReview');
@@ -114,6 +125,9 @@ function handleFile(file) {
     }
     
     selectedFile = file;
+    workbookId = null;
+    sendFileInline = false;
+    prefetchedPostMerger = null;
     
     // Show file info
     fileName.textContent = file.name;
@@ -140,6 +154,9 @@ function formatFileSize(bytes) {
 // Remove file handler
 removeBtn.addEventListener('click', () => {
     selectedFile = null;
+    workbookId = null;
+    sendFileInline = false;
+    prefetchedPostMerger = null;
     selectedHeaderRow = 0;
     fileInput.value = '';
     fileInfo.style.display = 'none';
@@ -152,7 +169,207 @@ removeBtn.addEventListener('click', () => {
     hideRowPreview();
 });
 
-// Convert button handler - First step: Show row preview
+// Upload the selected file once and remember its workbook ID
+async function ensureWorkbookUploaded() {
+    if (workbookId) return;
+    
+    const formData = new FormData();
+    formData.append('file', selectedFile);
+    formData.append('action', 'upload');
+    
+    const response = await fetch('/api/convert', {
+        method: 'POST',
+        body: formData
+    });
+    
+    const contentType = response.headers.get('content-type') || '';
+    if (!response.ok) {
+        if (contentType.includes('application/json')) {
+            const errorData = await response.json();
+            throw new Error(errorData.error || 'Failed to upload file');
+        } else {
+            const text = await response.text();
+            throw new Error(text || 'Failed to upload file');
+        }
+    }
+    
+    const data = await response.json();
+    workbookId = data.workbook_id;
+    asyncJobs = Boolean(data.async_jobs);
+}
+
+// Send an action against the uploaded workbook. If the session expired it
+// re-uploads once; if that upload cannot be found either (it reached another
+// instance), the file is sent with the action from then on
+async function postWorkbookAction(fields, headers = {}) {
+    const send = async () => {
+        const formData = new FormData();
+        if (sendFileInline) {
+            formData.append('file', selectedFile);
+        } else {
+            await ensureWorkbookUploaded();
+            formData.append('workbook_id', workbookId);
+        }
+        Object.entries(fields).forEach(([key, value]) => formData.append(key, value));
+        return fetch('/api/convert', {
+            method: 'POST',
+            headers,
+            body: formData
+        });
+    };
+    
+    let response = await send();
+    if (response.status === 410) {
+        workbookId = null;
+        response = await send();
+    }
+    if (response.status === 410) {
+        workbookId = null;
+        sendFileInline = true;
+        response = await send();
+    }
+    return response;
+}
+
+// Workbooks at least this big are exported through a background job, when
+// the server supports them
+const ASYNC_EXPORT_BYTES = 8 * 1024 * 1024;
+const JOB_POLL_INTERVAL_MS = 1000;
+// Recent export bodies kept to answer repeated downloads after a 304
+const EXPORT_CACHE_ENTRIES = 4;
+const exportCache = new Map();
+
+// Fetch the current export in one format as a raw download body
+async function fetchExport(fields, format, failureMessage) {
+    let response = null;
+    if (asyncJobs && selectedFile && selectedFile.size >= ASYNC_EXPORT_BYTES) {
+        response = await runExportJob(fields, format, failureMessage);
+    }
+    if (!response) {
+        response = await fetchCachedExport({ ...fields, format });
+    }
+    
+    if (!response.ok) {
+        const contentType = response.headers.get('content-type') || '';
+        if (contentType.includes('application/json')) {
+            const errorData = await response.json();
+            throw new Error(errorData.error || failureMessage);
+        } else {
+            const text = await response.text();
+            throw new Error(text || failureMessage);
+        }
+    }
+    
+    return response;
+}
+
+// Send an export request with the ETag of the same export fetched earlier,
+// so an unchanged result comes back as a 304 and is served from exportCache
+async function fetchCachedExport(fields) {
+    const cacheKey = JSON.stringify([selectedFile.name, selectedFile.size, selectedFile.lastModified, fields]);
+    const cached = exportCache.get(cacheKey);
+    const response = await postWorkbookAction(fields, cached ? { 'If-None-Match': cached.etag } : {});
+    if (response.status === 304 && cached) {
+        return new Response(cached.body, { status: 200, headers: cached.headers });
+    }
+    
+    const etag = response.headers.get('ETag');
+    if (!response.ok || !etag) return response;
+    
+    const body = await response.blob();
+    exportCache.delete(cacheKey);
+    exportCache.set(cacheKey, { etag, body, headers: [...response.headers] });
+    while (exportCache.size > EXPORT_CACHE_ENTRIES) {
+        exportCache.delete(exportCache.keys().next().value);
+    }
+    return new Response(body, { status: response.status, headers: response.headers });
+}
+
+// Send a job_status / job_result request
+function postJobAction(action, jobId) {
+    const formData = new FormData();
+    formData.append('action', action);
+    formData.append('job_id', jobId);
+    return fetch('/api/convert', {
+        method: 'POST',
+        body: formData
+    });
+}
+
+// Submit the export as a background job and poll until its file is ready.
+// Resolves to the job_result response, or null when the job could not be
+// submitted or followed, in which case the caller exports synchronously
+async function runExportJob(fields, format, failureMessage) {
+    const loadingText = loading.querySelector('p');
+    try {
+        const submitted = await postWorkbookAction({ ...fields, format, async: '1' });
+        if (submitted.status !== 202) return null;
+        
+        const { job_id: jobId } = await submitted.json();
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+            const response = await postJobAction('job_status', jobId);
+            if (!response.ok) return null;
+            
+            const job = await response.json();
+            if (job.status === 'failed') {
+                throw new Error(job.error || failureMessage);
+            }
+            if (job.status === 'done') {
+                const result = await postJobAction('job_result', jobId);
+                return result.ok ? result : null;
+            }
+            
+            const progress = job.progress || {};
+            if (progress.stage === 'writing' && progress.total_rows) {
+                loadingText.textContent = `Writing rows... ${progress.rows_written} / ${progress.total_rows}`;
+            } else if (progress.stage === 'cleaning' && progress.total_rows) {
+                loadingText.textContent = `Cleaning rows... ${progress.rows_cleaned} / ${progress.total_rows}`;
+            } else if (progress.rows_cleaned) {
+                loadingText.textContent = `Processing... ${progress.rows_cleaned} rows cleaned`;
+            }
+        }
+    } catch (error) {
+        // A network error while submitting or polling; a failed job is reported
+        if (error instanceof TypeError) return null;
+        throw error;
+    } finally {
+        loadingText.textContent = 'Processing...';
+    }
+}
+
+// Read an integer count sent back in a response header
+function headerCount(response, name) {
+    return parseInt(response.headers.get(name) || '0', 10);
+}
+
+// Header detection confidence needed to skip the header row preview
+const AUTO_HEADER_CONFIDENCE = 0.5;
+
+// Fetch the first raw rows for the header row preview
+async function fetchPreviewRows() {
+    const response = await postWorkbookAction({
+        action: 'get_preview'
+    });
+    
+    // Try to parse JSON response safely
+    const contentType = response.headers.get('content-type') || '';
+    if (!response.ok) {
+        if (contentType.includes('application/json')) {
+            const errorData = await response.json();
+            throw new Error(errorData.error || 'Failed to process file');
+        } else {
+            const text = await response.text();
+            throw new Error(text || 'Failed to process file');
+        }
+    }
+    
+    const data = contentType.includes('application/json') ? await response.json() : JSON.parse(await response.text());
+    return data.rows;
+}
+
+// Convert button handler - First step: detect the header row, or show the
+// row preview when detection is not confident enough
 convertBtn.addEventListener('click', async () => {
     if (!selectedFile) return;
     
@@ -166,16 +383,11 @@ convertBtn.addEventListener('click', async () => {
     loading.style.display = 'block';
     
     try {
-        const formData = new FormData();
-        formData.append('file', selectedFile);
-        formData.append('action', 'get_preview');
-        
-        const response = await fetch('/api/convert', {
-            method: 'POST',
-            body: formData
+        // Without header_row the server detects it and returns its columns
+        const response = await postWorkbookAction({
+            action: 'get_headers'
         });
         
-        // Try to parse JSON response safely
         const contentType = response.headers.get('content-type') || '';
         if (!response.ok) {
             if (contentType.includes('application/json')) {
@@ -188,9 +400,18 @@ convertBtn.addEventListener('click', async () => {
         }
         
         const data = contentType.includes('application/json') ? await response.json() : JSON.parse(await response.text());
+        selectedHeaderRow = data.header_row || 0;
         
+        if (data.header_confidence >= AUTO_HEADER_CONFIDENCE && data.columns.length > 0) {
+            availableColumns = data.columns;
+            loading.style.display = 'none';
+            showColumnSelection(availableColumns);
+            return;
+        }
+        
+        const rows = await fetchPreviewRows();
         loading.style.display = 'none';
-        showRowPreview(data.rows);
+        showRowPreview(rows);
         
     } catch (err) {
         loading.style.display = 'none';
@@ -198,6 +419,23 @@ convertBtn.addEventListener('click', async () => {
     }
 });
 
+// Change header button - Back to the row preview from column selection
+changeHeaderBtn.addEventListener('click', async () => {
+    hideError();
+    columnSelection.style.display = 'none';
+    loading.style.display = 'block';
+    
+    try {
+        const rows = await fetchPreviewRows();
+        loading.style.display = 'none';
+        showRowPreview(rows);
+    } catch (err) {
+        loading.style.display = 'none';
+        columnSelection.style.display = 'block';
+        showError(err.message || 'An error occurred while processing the file');
+    }
+});
+
 // Show row preview UI
 function showRowPreview(rows) {
     previewTableBody.innerHTML = '';
@@ -296,14 +534,9 @@ continueBtn.addEventListener('click', async () => {
     loading.style.display = 'block';
     
     try {
-        const formData = new FormData();
-        formData.append('file', selectedFile);
-        formData.append('action', 'get_headers');
-        formData.append('header_row', selectedHeaderRow);
-        
-        const response = await fetch('/api/convert', {
-            method: 'POST',
-            body: formData
+        const response = await postWorkbookAction({
+            action: 'get_headers',
+            header_row: selectedHeaderRow
         });
         
         // Try to parse JSON response safely
@@ -428,16 +661,17 @@ proceedBtn.addEventListener('click', async () => {
     columnSelection.style.display = 'none';
     loading.style.display = 'block';
 
-    try {
-        const formData = new FormData();
-        formData.append('file', selectedFile);
-        formData.append('action', 'get_bottom_rows');
-        formData.append('header_row', selectedHeaderRow);
-        formData.append('columns', JSON.stringify(selectedColumns));
+    prefetchedPostMerger = null;
 
-        const response = await fetch('/api/convert', {
-            method: 'POST',
-            body: formData
+    try {
+        // Fetch bottom rows and POST MERGER candidates from a single parse
+        const response = await postWorkbookAction({
+            action: 'review_bundle',
+            header_row: selectedHeaderRow,
+            requests: JSON.stringify([
+                { action: 'get_bottom_rows', columns: selectedColumns },
+                { action: 'get_post_merger_candidates', columns: selectedColumns }
+            ])
         });
 
         // Try to parse JSON response safely
@@ -452,7 +686,12 @@ proceedBtn.addEventListener('click', async () => {
             }
         }
 
-        const data = contentType.includes('application/json') ? await response.json() : JSON.parse(await response.text());
+        const bundle = contentType.includes('application/json') ? await response.json() : JSON.parse(await response.text());
+        const [data, postMerger] = bundle.results;
+        if (!data.success) {
+            throw new Error(data.error || 'Failed to process file');
+        }
+        prefetchedPostMerger = postMerger && postMerger.success ? postMerger : null;
 
         loading.style.display = 'none';
         showRowExclusion(data.rows, data.columns, data.total_rows);
@@ -484,8 +723,17 @@ downloadCsvBtn.addEventListener('click', () => {
 });
 
 // Download JSON button handler
-downloadJsonBtn.addEventListener('click', () => {
-    if (!convertedJsonData) return;
+downloadJsonBtn.addEventListener('click', async () => {
+    if (!convertedJsonData) {
+        if (!lastExportFields) return;
+        try {
+            const response = await fetchExport(lastExportFields, 'json', 'Failed to export JSON');
+            convertedJsonData = await response.text();
+        } catch (err) {
+            showError(err.message || 'An error occurred while exporting JSON');
+            return;
+        }
+    }
     
     const blob = new Blob([convertedJsonData], { type: 'application/json' });
     const url = window.URL.createObjectURL(blob);
@@ -508,33 +756,21 @@ furtherTestingBtn.addEventListener('click', async () => {
     loading.style.display = 'block';
     
     try {
-        const formData = new FormData();
-        formData.append('file', selectedFile);
-        formData.append('action', 'filter_testing_columns');
-        formData.append('header_row', selectedHeaderRow);
-        formData.append('columns', JSON.stringify(availableColumns));
-        formData.append('exclude_row_indices', JSON.stringify(Array.from(excludedRowIndices)));
-        formData.append('post_merger_deletions', JSON.stringify(Array.from(selectedPostMergerDeletions)));
-
-        const response = await fetch('/api/convert', {
-            method: 'POST',
-            body: formData
-        });
-
-        const contentType = response.headers.get('content-type') || '';
-        if (!response.ok) {
-            if (contentType.includes('application/json')) {
-                const errorData = await response.json();
-                throw new Error(errorData.error || 'Filtering failed');
-            } else {
-                const text = await response.text();
-                throw new Error(text || 'Filtering failed');
-            }
-        }
-
-        const data = contentType.includes('application/json') ? await response.json() : JSON.parse(await response.text());
-        convertedCsvData = data.csv_data;
-        convertedJsonData = data.json_data;
+        const fields = {
+            action: 'filter_testing_columns',
+            header_row: selectedHeaderRow,
+            columns: JSON.stringify(availableColumns),
+            exclude_row_indices: JSON.stringify(Array.from(excludedRowIndices)),
+            post_merger_deletions: JSON.stringify(Array.from(selectedPostMergerDeletions))
+        };
+        const response = await fetchExport(fields, 'csv', 'Filtering failed');
+        convertedCsvData = await response.text();
+        convertedJsonData = null;
+        lastExportFields = fields;
+        const data = {
+            filtered_rows: headerCount(response, 'X-Filtered-Rows'),
+            columns_count: headerCount(response, 'X-Columns-Count')
+        };
 
         loading.style.display = 'none';
         
@@ -552,8 +788,13 @@ furtherTestingBtn.addEventListener('click', async () => {
 // New file button handler
 newFileBtn.addEventListener('click', () => {
     selectedFile = null;
+    workbookId = null;
+    sendFileInline = false;
+    exportCache.clear();
+    prefetchedPostMerger = null;
     convertedCsvData = null;
     convertedJsonData = null;
+    lastExportFields = null;
     availableColumns = [];
     selectedHeaderRow = 0;
     bottomRowsData = [];
@@ -789,7 +1030,17 @@ function showRowExclusion(rows, columns, totalRows) {
     
     exclusionTableHead.appendChild(headerRow);
     
-    // Build table body with rows (displayed in reverse order - bottom rows first)
+    // Rows are displayed in reverse order - bottom rows first
+    appendExclusionRows(rows);
+    exclusionWindowStart = Math.max(totalRows - rows.length, 0);
+    loadEarlierRowsBtn.style.display = exclusionWindowStart > 0 ? 'inline-block' : 'none';
+    
+    updateExcludedRowsCount();
+    rowExclusion.style.display = 'block';
+}
+
+// Add rows to the bottom of the exclusion table, last row first
+function appendExclusionRows(rows) {
     const reversedRows = [...rows].reverse();
     
     reversedRows.forEach((rowData) => {
@@ -839,9 +1090,6 @@ function showRowExclusion(rows, columns, totalRows) {
         
         exclusionTableBody.appendChild(tr);
     });
-    
-    updateExcludedRowsCount();
-    rowExclusion.style.display = 'block';
 }
 
 // Update excluded rows count
@@ -866,6 +1114,39 @@ selectAllRowsBtn.addEventListener('click', () => {
     updateExcludedRowsCount();
 });
 
+// Rows fetched per click of Load Earlier Rows
+const ROW_PAGE_SIZE = 30;
+
+// Load earlier rows button handler - pages upwards from the bottom rows
+loadEarlierRowsBtn.addEventListener('click', async () => {
+    const offset = Math.max(exclusionWindowStart - ROW_PAGE_SIZE, 0);
+    loadEarlierRowsBtn.disabled = true;
+    hideError();
+    
+    try {
+        const response = await postWorkbookAction({
+            action: 'get_rows',
+            header_row: selectedHeaderRow,
+            columns: JSON.stringify(availableColumns),
+            offset,
+            limit: exclusionWindowStart - offset
+        });
+        const data = await response.json();
+        if (!response.ok || !data.success) {
+            throw new Error(data.error || 'Failed to load rows');
+        }
+        
+        bottomRowsData = [...data.rows, ...bottomRowsData];
+        appendExclusionRows(data.rows);
+        exclusionWindowStart = offset;
+        loadEarlierRowsBtn.style.display = offset > 0 ? 'inline-block' : 'none';
+    } catch (err) {
+        showError(err.message || 'An error occurred while loading rows');
+    } finally {
+        loadEarlierRowsBtn.disabled = false;
+    }
+});
+
 // Deselect all rows button handler
 deselectAllRowsBtn.addEventListener('click', () => {
     const checkboxes = exclusionTableBody.querySelectorAll('input[type="checkbox"]');
@@ -889,29 +1170,28 @@ continueToPostMergerBtn.addEventListener('click', async () => {
     loading.style.display = 'block';
 
     try {
-        const formData = new FormData();
-        formData.append('file', selectedFile);
-        formData.append('action', 'get_post_merger_candidates');
-        formData.append('header_row', selectedHeaderRow);
-        formData.append('columns', JSON.stringify(availableColumns));
-
-        const response = await fetch('/api/convert', {
-            method: 'POST',
-            body: formData
-        });
-
-        const contentType = response.headers.get('content-type') || '';
-        if (!response.ok) {
-            if (contentType.includes('application/json')) {
-                const errorData = await response.json();
-                throw new Error(errorData.error || 'Failed to get POST MERGER candidates');
-            } else {
-                const text = await response.text();
-                throw new Error(text || 'Failed to get POST MERGER candidates');
+        // Candidates are normally prefetched alongside the bottom rows
+        let data = prefetchedPostMerger;
+        if (!data) {
+            const response = await postWorkbookAction({
+                action: 'get_post_merger_candidates',
+                header_row: selectedHeaderRow,
+                columns: JSON.stringify(availableColumns)
+            });
+
+            const contentType = response.headers.get('content-type') || '';
+            if (!response.ok) {
+                if (contentType.includes('application/json')) {
+                    const errorData = await response.json();
+                    throw new Error(errorData.error || 'Failed to get POST MERGER candidates');
+                } else {
+                    const text = await response.text();
+                    throw new Error(text || 'Failed to get POST MERGER candidates');
+                }
             }
-        }
 
-        const data = contentType.includes('application/json') ? await response.json() : JSON.parse(await response.text());
+            data = contentType.includes('application/json') ? await response.json() : JSON.parse(await response.text());
+        }
         postMergerCandidates = data.candidates || [];
         
         loading.style.display = 'none';
@@ -954,33 +1234,24 @@ async function generateExport() {
     loading.style.display = 'block';
 
     try {
-        const formData = new FormData();
-        formData.append('file', selectedFile);
-        formData.append('action', 'convert');
-        formData.append('columns', JSON.stringify(availableColumns));
-        formData.append('header_row', selectedHeaderRow);
-        formData.append('exclude_row_indices', JSON.stringify(Array.from(excludedRowIndices)));
-        formData.append('post_merger_deletions', JSON.stringify(Array.from(selectedPostMergerDeletions)));
-
-        const response = await fetch('/api/convert', {
-            method: 'POST',
-            body: formData
-        });
-
-        const contentType = response.headers.get('content-type') || '';
-        if (!response.ok) {
-            if (contentType.includes('application/json')) {
-                const errorData = await response.json();
-                throw new Error(errorData.error || 'Conversion failed');
-            } else {
-                const text = await response.text();
-                throw new Error(text || 'Conversion failed');
-            }
-        }
-
-        const data = contentType.includes('application/json') ? await response.json() : JSON.parse(await response.text());
-        convertedCsvData = data.csv_data;
-        convertedJsonData = data.json_data;
+        const fields = {
+            action: 'convert',
+            columns: JSON.stringify(availableColumns),
+            header_row: selectedHeaderRow,
+            exclude_row_indices: JSON.stringify(Array.from(excludedRowIndices)),
+            post_merger_deletions: JSON.stringify(Array.from(selectedPostMergerDeletions))
+        };
+        const response = await fetchExport(fields, 'csv', 'Conversion failed');
+        convertedCsvData = await response.text();
+        convertedJsonData = null;
+        lastExportFields = fields;
+        const data = {
+            original_rows: headerCount(response, 'X-Original-Rows'),
+            cleaned_rows: headerCount(response, 'X-Cleaned-Rows'),
+            removed_rows: headerCount(response, 'X-Removed-Rows'),
+            excluded_rows: headerCount(response, 'X-Excluded-Rows'),
+            post_merger_deleted: headerCount(response, 'X-Post-Merger-Deleted')
+        };
 
         loading.style.display = 'none';
         result.style.display = 'block';
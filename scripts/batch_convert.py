@@ -0,0 +1,189 @@
+"""
+Convert many factsheet workbooks at once, without the web server.
+
+Every .xlsx / .xlsm / .xls file in the given directories (searched
+recursively) and zip archives goes through the same pipeline as the web
+app: header detection, clean_dataframe, POST MERGER handling and, with
+--action filter_testing_columns, the testing-column filter. Files are
+spread over a process pool, each output is streamed to disk next to its
+relative path under --output, and a summary line is printed per file:
+
+    python scripts/batch_convert.py factsheets/ archive.zip --output out/
+    python scripts/batch_convert.py factsheets/ --output out/ --format json --workers 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'api'))
+
+import convert
+
+WORKBOOK_EXTENSIONS = ('.xlsx', '.xlsm', '.xls')
+
+
+class BatchConverter(convert.handler):
+    """
+    Runs the conversion pipeline on a file instead of a request. It is
+    never bound to a request, so BaseHTTPRequestHandler's constructor is
+    not called.
+    """
+
+    def __init__(self, options):
+        self.options = options
+
+    def convert_file(self, upload, output_path):
+        """Convert one workbook, write the output file and return its summary"""
+        options = self.options
+        header_row, _ = self.resolve_header_row(options['header_row'], upload, options['engine'])
+        df = self.read_excel(upload, header_row, options['engine'])
+        df_cleaned = self.clean_dataframe(df)
+
+        # Rows to drop, as the web app's review steps would send them
+        fields = {}
+        if options['post_merger'] == 'delete':
+            matches, _ = self.find_post_merger_matches(df_cleaned, options['merger_match'])
+            fields['post_merger_deletions'] = json.dumps([row_above for row_above, _ in matches])
+        if options['exclude_last']:
+            fields['exclude_row_indices'] = json.dumps(df_cleaned.index[-options['exclude_last']:].tolist())
+        df_selected, post_merger_deleted, excluded = self.select_rows(fields, df_cleaned)
+
+        if options['action'] == 'filter_testing_columns':
+            df_out, _ = self.filter_testing_columns(df_selected, split_dates=options['split_dates'])
+        else:
+            df_out = df_selected
+
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        with open(output_path, 'wb') as f:
+            for chunk in self.iter_export_chunks(df_out, options['format']):
+                f.write(chunk)
+
+        return {
+            'rows': len(df),
+            'removed': len(df) - len(df_cleaned),
+            'excluded': excluded,
+            'post_merger_deleted': post_merger_deleted,
+            'output_rows': len(df_out),
+            'header_row': header_row,
+        }
+
+
+def find_workbooks(inputs):
+    """
+    Return (name, path, member) for every workbook under the inputs: member
+    is the file's name inside a zip archive, or None for plain files. Names
+    are relative paths used for the output files.
+    """
+    tasks = []
+    for source in inputs:
+        if os.path.isdir(source):
+            for folder, _, files in os.walk(source):
+                for filename in sorted(files):
+                    if filename.lower().endswith(WORKBOOK_EXTENSIONS) and not filename.startswith('~$'):
+                        path = os.path.join(folder, filename)
+                        tasks.append((os.path.relpath(path, source), path, None))
+        elif zipfile.is_zipfile(source) and not source.lower().endswith(WORKBOOK_EXTENSIONS):
+            archive_name = os.path.splitext(os.path.basename(source))[0]
+            with zipfile.ZipFile(source) as archive:
+                for member in archive.namelist():
+                    filename = os.path.basename(member)
+                    if (member.lower().endswith(WORKBOOK_EXTENSIONS) and not member.startswith('__MACOSX/')
+                            and not filename.startswith('~$')):
+                        tasks.append((os.path.join(archive_name, member), source, member))
+        elif os.path.isfile(source):
+            tasks.append((os.path.basename(source), source, None))
+        else:
+            raise FileNotFoundError(f'No such file or directory: {source}')
+    return tasks
+
+
+def convert_task(name, path, member, output_dir, options):
+    """Process pool entry point: convert one workbook, return its summary"""
+    start = time.perf_counter()
+    output_path = os.path.join(output_dir, f'{os.path.splitext(name)[0]}_cleaned.{options["format"]}')
+    try:
+        if member is None:
+            with open(path, 'rb') as f:
+                upload = convert.UploadedFile(f, os.path.getsize(path), '', name)
+                summary = BatchConverter(options).convert_file(upload, output_path)
+        else:
+            with zipfile.ZipFile(path) as archive:
+                upload = convert.UploadedFile.from_bytes(archive.read(member), filename=name)
+            summary = BatchConverter(options).convert_file(upload, output_path)
+    except Exception as e:
+        summary = {'error': f'{type(e).__name__}: {e}'}
+    summary.update({'file': name, 'output': output_path, 'seconds': round(time.perf_counter() - start, 3)})
+    return summary
+
+
+def print_summary(summary):
+    if 'error' in summary:
+        print(f'{summary["file"]:50} FAILED  {summary["error"]}', flush=True)
+    else:
+        print(f'{summary["file"]:50} {summary["rows"]:>8} {summary["removed"]:>8} {summary["excluded"]:>8} '
+              f'{summary["post_merger_deleted"]:>8} {summary["seconds"]:>8.2f}s', flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+', help='workbooks, directories or zip archives')
+    parser.add_argument('--output', required=True, help='directory for the converted files')
+    parser.add_argument('--action', choices=convert.JOB_ACTIONS, default='convert')
+    parser.add_argument('--format', choices=list(convert.EXPORT_CONTENT_TYPES), default='csv')
+    parser.add_argument('--engine', choices=convert.EXCEL_ENGINES, default=convert.DEFAULT_EXCEL_ENGINE)
+    parser.add_argument('--header-row', default='', help='0-based header row (default: detected per file)')
+    parser.add_argument('--post-merger', choices=('delete', 'keep'), default='delete',
+                        help='delete the rows replaced by matching POST MERGER rows (default) or keep them')
+    parser.add_argument('--merger-match', choices=convert.MERGER_MATCH_MODES, default='adjacent',
+                        help='pair POST MERGER rows with the row above (default) or with any row in the sheet')
+    parser.add_argument('--exclude-last', type=int, default=0, metavar='N',
+                        help='drop the last N cleaned rows of every file')
+    parser.add_argument('--split-dates', action='store_true',
+                        help='with filter_testing_columns, split Portfolio Turnover Ratio into number and date')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--summary-json', metavar='PATH', help='also write the per-file summaries as JSON')
+    args = parser.parse_args()
+
+    options = {
+        'action': args.action,
+        'format': args.format,
+        'engine': args.engine,
+        'header_row': args.header_row,
+        'post_merger': args.post_merger,
+        'merger_match': args.merger_match,
+        'exclude_last': max(args.exclude_last, 0),
+        'split_dates': args.split_dates,
+    }
+    tasks = find_workbooks(args.inputs)
+    print(f'{len(tasks)} workbooks, {args.workers} workers', file=sys.stderr)
+    print(f'{"file":50} {"rows":>8} {"removed":>8} {"excluded":>8} {"merged":>8} {"time":>9}')
+
+    start = time.perf_counter()
+    summaries = []
+    with ProcessPoolExecutor(max_workers=max(args.workers, 1)) as executor:
+        futures = [executor.submit(convert_task, name, path, member, args.output, options)
+                   for name, path, member in tasks]
+        for future in as_completed(futures):
+            summary = future.result()
+            print_summary(summary)
+            summaries.append(summary)
+
+    failed = sum(1 for summary in summaries if 'error' in summary)
+    converted = [summary for summary in summaries if 'error' not in summary]
+    print(f'\n{len(converted)} converted, {failed} failed, {sum(s["rows"] for s in converted)} rows '
+          f'in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+
+    if args.summary_json:
+        summaries.sort(key=lambda summary: summary['file'])
+        with open(args.summary_json, 'w') as f:
+            json.dump(summaries, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
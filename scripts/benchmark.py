@@ -0,0 +1,397 @@
+"""
+Benchmark api/convert.py in-process.
+
+Generates synthetic fund-factsheet workbooks (title rows, the real
+factsheet column set, POST MERGER pairs, separator rows, a benchmark
+table and disclaimer footers), drives every action through the `handler` class and reports
+wall time, per-stage time and peak RSS for each one. Results are written
+as JSON so runs from different commits can be compared:
+
+    python scripts/benchmark.py --sizes 1000,10000 --output before.json
+    python scripts/benchmark.py --sizes 1000,10000 --output after.json --compare before.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'api'))
+
+import openpyxl
+from openpyxl import Workbook
+
+import convert
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+# Rows above the header in generated workbooks (title, date, blank)
+HEADER_ROW = 3
+
+FACTSHEET_COLUMNS = [
+    'Scheme Name',
+    'Category',
+    'Fund Manager',
+    'Inception Date',
+    '6 Months - P2P',
+    '1 Year - P2P',
+    '3 Years - P2P',
+    '5 Years - P2P',
+    '10 Years - P2P',
+    'P/E',
+    'P/B',
+    'Std.Dev.',
+    'Beta',
+    'Sharpe',
+    'Information Ratio',
+    'Sortino',
+    'Corpus (In crs.)',
+    'Expense Ratio (Current)',
+    'Portfolio Turnover Ratio',
+    '%_of_Net_Asset_10(Scheme Portfolio)',
+    'Downside Capture Ratio',
+    'Benchmark',
+]
+
+FUND_HOUSES = ['Aditya', 'Bharat', 'Canara', 'Deccan', 'Everest', 'Franklin', 'Ganges', 'Himalaya']
+CATEGORIES = ['Large Cap', 'Mid Cap', 'Small Cap', 'Flexi Cap', 'ELSS', 'Value', 'Focused', 'Sectoral']
+MANAGERS = ['Anil Kumar', 'Bhavna Shah', 'Chetan Rao', 'Deepa Iyer', 'Farhan Ali', 'Gita Menon', 'Harish Nair']
+BENCHMARKS = ['NIFTY 50 TRI', 'NIFTY 500 TRI', 'NIFTY Midcap 150 TRI', 'BSE 250 SmallCap TRI']
+
+FOOTER_ROWS = [
+    'Source: ACE MF',
+    'Data as on 30-Sep-2026',
+    '* Returns above 1 year are compound annualized',
+    'Less than 1 year returns are absolute returns',
+    'Note: P2P returns are point to point',
+    'Disclaimer: Past performance may or may not be sustained in future',
+]
+
+TESTING_COLUMNS = ['Scheme Name', '1 Year - P2P', 'Sharpe', 'Portfolio Turnover Ratio',
+                   '%_of_Net_Asset_10(Scheme Portfolio)', 'Fund Manager']
+
+
+def generate_factsheet(num_rows, seed=0):
+    """
+    Build a factsheet-style .xlsx with roughly `num_rows` scheme rows and
+    return its bytes. About 1 in 25 schemes is followed by a POST MERGER
+    row (most of them real duplicates), and the sheet is sprinkled with
+    separator and blank rows and ends with a Benchmark Index table and
+    disclaimer footers.
+    """
+    rng = random.Random(seed)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Factsheet')
+
+    sheet.append(['Mutual Fund Factsheet - Equity Schemes'])
+    sheet.append(['Report generated on 18-Oct-2026'])
+    sheet.append([])
+    sheet.append(FACTSHEET_COLUMNS)
+
+    def p2p():
+        return '--' if rng.random() < 0.08 else round(rng.uniform(-12, 45), 2)
+
+    def turnover():
+        if rng.random() < 0.05:
+            return '--'
+        value = round(rng.uniform(0.05, 2.5), 2)
+        if rng.random() < 0.5:
+            return f'{int(value * 100)}% (30-Sep-2026)'
+        return f'{value} (30-Sep-2026)'
+
+    for i in range(num_rows):
+        manager = rng.choice(MANAGERS)
+        net_asset = round(rng.uniform(25, 75), 2)
+        name = f'{rng.choice(FUND_HOUSES)} {rng.choice(CATEGORIES)} Fund {i} - Regular Plan - Growth'
+        row = [
+            name,
+            rng.choice(CATEGORIES),
+            manager,
+            datetime(2000 + rng.randint(0, 25), rng.randint(1, 12), rng.randint(1, 28)),
+            p2p(), p2p(), p2p(), p2p(), p2p(),
+            round(rng.uniform(8, 60), 2),
+            round(rng.uniform(1, 12), 2),
+            round(rng.uniform(8, 25), 2),
+            round(rng.uniform(0.6, 1.3), 2),
+            round(rng.uniform(-0.5, 2.5), 2),
+            round(rng.uniform(-1, 1.5), 2),
+            round(rng.uniform(-0.5, 3.5), 2),
+            round(rng.uniform(50, 80000), 2),
+            round(rng.uniform(0.3, 2.5), 2),
+            turnover(),
+            net_asset,
+            round(rng.uniform(40, 120), 2),
+            rng.choice(BENCHMARKS),
+        ]
+        sheet.append(row)
+
+        if i % 25 == 12:
+            merged = list(row)
+            merged[0] = name + ' - POST MERGER'
+            if rng.random() < 0.8:
+                merged[2] = manager.upper()
+            else:
+                merged[2] = rng.choice(MANAGERS)
+                merged[19] = round(net_asset + rng.uniform(1, 5), 2)
+            sheet.append(merged)
+
+        if i % 200 == 199:
+            sheet.append(['-' * 40])
+            sheet.append([])
+
+    # Benchmark table below the schemes, which readers stop at
+    sheet.append([])
+    sheet.append(['Benchmark Index'])
+    for i in range(max(num_rows // 20, 50)):
+        sheet.append([f'{rng.choice(BENCHMARKS)} ({i})', None, None, None, p2p(), p2p(), p2p(), p2p(), p2p()])
+
+    sheet.append([])
+    for footer in FOOTER_ROWS:
+        sheet.append([footer])
+
+    buf = io.BytesIO()
+    workbook.save(buf)
+    return buf.getvalue()
+
+
+def encode_multipart(fields, file_data=None, filename='factsheet.xlsx'):
+    """Return (body, content_type) for a multipart/form-data request"""
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    if file_data is not None:
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+                   'Content-Type: application/vnd.openxmlformats-officedocument.spreadsheetml.sheet\r\n\r\n'.encode())
+        body.write(file_data)
+        body.write(b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+class _Socket:
+    """Just enough of a socket for BaseHTTPRequestHandler"""
+
+    def __init__(self, request):
+        self.request = request
+        self.response = io.BytesIO()
+
+    def makefile(self, mode, *args, **kwargs):
+        return io.BytesIO(self.request) if 'r' in mode else self.response
+
+    def sendall(self, data):
+        self.response.write(data)
+
+
+class TimedHandler(convert.handler):
+    """handler that keeps the request's stage timings instead of logging them"""
+
+    last_record = None
+
+    def log_request_metrics(self):
+        TimedHandler.last_record = self.timer.record()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RssSampler:
+    """
+    Track peak resident memory while a block runs by polling
+    /proc/self/statm. Falls back to the process-wide ru_maxrss where /proc
+    is not available (macOS), which only ever goes up.
+    """
+
+    INTERVAL = 0.005
+
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+        self._use_proc = os.path.exists('/proc/self/statm')
+
+    def current(self):
+        if self._use_proc:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * self._page_size
+        import resource
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes on Linux
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+    def _run(self):
+        while not self._stop.wait(self.INTERVAL):
+            self.peak = max(self.peak, self.current())
+
+
+def run_action(fields, file_data):
+    """
+    Send one POST through TimedHandler. Returns (status, response_bytes,
+    wall_seconds, stage_seconds, peak_rss_bytes).
+    """
+    body, content_type = encode_multipart(fields, file_data)
+    head = (f'POST /api/convert HTTP/1.1\r\nHost: localhost\r\n'
+            f'Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n')
+    sock = _Socket(head.encode() + body)
+
+    TimedHandler.last_record = None
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        TimedHandler(sock, ('127.0.0.1', 0), None)
+        wall = time.perf_counter() - start
+
+    raw = sock.response.getvalue()
+    status = int(raw.split(b' ', 2)[1])
+    payload = raw.partition(b'\r\n\r\n')[2]
+    stages = {name: ms / 1000 for name, ms in TimedHandler.last_record['stages_ms'].items()}
+    return status, len(payload), wall, stages, rss.peak
+
+
+def benchmark_actions():
+    """(name, form fields) for every action exercised by the benchmark"""
+    header = str(HEADER_ROW)
+    columns = json.dumps(TESTING_COLUMNS)
+    return [
+        ('get_preview', {'action': 'get_preview'}),
+        ('get_headers', {'action': 'get_headers', 'header_row': header}),
+        ('get_bottom_rows', {'action': 'get_bottom_rows', 'header_row': header, 'columns': columns}),
+        ('get_post_merger_candidates', {'action': 'get_post_merger_candidates', 'header_row': header,
+                                        'columns': columns}),
+        ('review_bundle', {'action': 'review_bundle', 'header_row': header, 'requests': json.dumps([
+            {'action': 'get_bottom_rows', 'columns': TESTING_COLUMNS},
+            {'action': 'get_post_merger_candidates', 'columns': TESTING_COLUMNS},
+        ])}),
+        ('convert', {'action': 'convert', 'header_row': header}),
+        ('convert_csv', {'action': 'convert', 'header_row': header, 'format': 'csv'}),
+        ('filter_testing_columns', {'action': 'filter_testing_columns', 'header_row': header}),
+        ('filter_testing_columns_csv', {'action': 'filter_testing_columns', 'header_row': header,
+                                        'format': 'csv'}),
+    ]
+
+
+def run_benchmark(sizes, engine, repeat, warm, actions=None, seed=0):
+    results = []
+    for size in sizes:
+        start = time.perf_counter()
+        data = generate_factsheet(size, seed)
+        print(f'\n{size} rows: {len(data) / 1024 / 1024:.1f} MB workbook '
+              f'(generated in {time.perf_counter() - start:.1f}s)', file=sys.stderr)
+
+        for name, fields in benchmark_actions():
+            if actions and name not in actions:
+                continue
+            fields = dict(fields, engine=engine)
+            runs = []
+            for _ in range(repeat):
+                # Fresh frame and result caches per run measure the full parse
+                # and export unless --warm. The result cache gets no directory,
+                # so files left by earlier runs cannot answer either
+                if not warm:
+                    convert.frame_cache = convert.FrameCache()
+                    convert.result_cache = convert.ResultCache(directory=None)
+                runs.append(run_action(fields, data))
+
+            # Report the fastest run; 'other' is whatever its stages do not cover
+            status, response_bytes, wall, stages, _ = min(runs, key=lambda run: run[2])
+            stages = {stage: round(seconds * 1000, 2) for stage, seconds in stages.items()}
+            stages['other'] = round(max(wall * 1000 - sum(stages.values()), 0.0), 2)
+            result = {
+                'rows': size,
+                'action': name,
+                'status': status,
+                'wall_ms': round(wall * 1000, 2),
+                'wall_ms_runs': [round(run[2] * 1000, 2) for run in runs],
+                'stages_ms': stages,
+                'peak_rss_mb': round(max(run[4] for run in runs) / 1024 / 1024, 1),
+                'response_bytes': response_bytes,
+            }
+            results.append(result)
+            print(f'  {name:28} {result["wall_ms"]:10.1f} ms  {result["peak_rss_mb"]:7.1f} MB  '
+                  + ' '.join(f'{stage}={ms:.1f}' for stage, ms in stages.items()), file=sys.stderr)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Print wall time ratios against a previous results file"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r['rows'], r['action']): r for r in baseline['results']}
+    print(f'\nCompared with {baseline_path} ({baseline["meta"].get("git_revision")}):', file=sys.stderr)
+    for result in results:
+        old = previous.get((result['rows'], result['action']))
+        if old is None or not old['wall_ms']:
+            continue
+        ratio = result['wall_ms'] / old['wall_ms']
+        print(f'  {result["rows"]:>7} {result["action"]:28} {old["wall_ms"]:10.1f} -> '
+              f'{result["wall_ms"]:10.1f} ms  x{ratio:.2f}', file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma-separated scheme row counts (default: %(default)s)')
+    parser.add_argument('--engine', choices=convert.EXCEL_ENGINES, default=convert.DEFAULT_EXCEL_ENGINE)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per action, fastest is reported')
+    parser.add_argument('--actions', help='comma-separated subset of actions to run')
+    parser.add_argument('--warm', action='store_true', help='keep the frame and result caches between runs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', metavar='RESULTS_JSON', help='earlier results to compare against')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    actions = set(args.actions.split(',')) if args.actions else None
+    results = run_benchmark(sizes, args.engine, max(args.repeat, 1), args.warm, actions, args.seed)
+
+    report = {
+        'meta': {
+            'git_revision': git_revision(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': convert.pd.__version__,
+            'openpyxl': openpyxl.__version__,
+            'platform': platform.platform(),
+            'engine': args.engine,
+            'repeat': args.repeat,
+            'warm': args.warm,
+            'header_row': HEADER_ROW,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'\nWrote {args.output}', file=sys.stderr)
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
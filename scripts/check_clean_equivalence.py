@@ -0,0 +1,159 @@
+"""
+Check that handler.clean_dataframe keeps exactly the rows the original
+row-by-row (iterrows) implementation kept.
+
+clean_dataframe was rewritten to work column-wise; the original is kept
+below as the reference. Both are run on generated factsheets (read with
+each engine, header row detected as in a request) and on random frames of
+mixed cells: empty and whitespace strings, separators, disclaimer lines,
+numbers, timestamps, NaN / None and all-numeric frames, where iterrows
+upcasts ints to float. The block-wise path jobs use for progress reports
+(on_rows) is checked too, with small blocks. The output frame and its index
+must be identical:
+
+    python scripts/check_clean_equivalence.py
+    python scripts/check_clean_equivalence.py --frames 5000 --sizes 100,20000 --seed 3
+"""
+import argparse
+import os
+import random
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from benchmark import generate_factsheet
+
+import convert
+
+# Cells the random frames are built from
+CELLS = [
+    None, np.nan, '', ' ', '---', '== ==', '\t_', 'Source: AMFI', '  source: x', 'Data as on 31-Oct-2025',
+    'Report generated on 01-Nov-2025', '*returns', '* 1Y returns', 'Note: x', 'Disclaimer', 'less than 1 year',
+    'Less than 10 Years', 'x compound annualized', 'ABSOLUTE RETURNS', 'less than', 'year', '*x\nreturns',
+    'Fund A', 'Fund A - POST MERGER', 'a\nb', '--', 'nan', 'None', 1, 2.5, 0.0, -1.0, True,
+    pd.Timestamp('2025-10-31'),
+]
+
+
+def reference_clean_dataframe(df):
+    """clean_dataframe as it was before it was vectorized"""
+    rows_to_keep = []
+
+    for idx, row in df.iterrows():
+        # Convert row to string and check if it's mostly empty
+        row_str = ' '.join([str(val) for val in row if pd.notna(val)]).strip()
+
+        # Skip completely empty rows
+        if not row_str:
+            continue
+
+        # Skip separator rows (all dashes, equals, underscores, etc.)
+        if re.match(r'^[-=_\s]+$', row_str):
+            continue
+
+        # Check for common disclaimer patterns
+        disclaimer_patterns = [
+            r'^source:',
+            r'^data as on',
+            r'^report generated',
+            r'^\*.*returns',
+            r'^note:',
+            r'^disclaimer',
+            r'^less than \d+ year',
+            r'compound annualized',
+            r'absolute returns',
+        ]
+
+        # Check if row matches any disclaimer pattern
+        is_disclaimer = any(re.search(pattern, row_str, re.IGNORECASE)
+                            for pattern in disclaimer_patterns)
+
+        if is_disclaimer:
+            continue
+
+        # Keep everything else - no special cases!
+        rows_to_keep.append(idx)
+
+    # Return cleaned dataframe
+    if rows_to_keep:
+        return df.loc[rows_to_keep].reset_index(drop=True)
+    return df
+
+
+class Cleaner(convert.handler):
+    """The handler's frame methods without a request"""
+
+    def __init__(self):
+        pass
+
+
+def random_frame(rng):
+    columns = rng.randint(0, 6)
+    rows = rng.randint(0, 15)
+    kind = rng.random()
+    if kind < 0.15:
+        # All-numeric: iterrows turns the ints into floats
+        return pd.DataFrame({f'c{j}': [rng.choice([1.0, np.nan, 2.5]) if j % 2 else rng.choice([1, 2, 3])
+                                       for _ in range(rows)] for j in range(columns)})
+    if kind < 0.25:
+        return pd.DataFrame({f'c{j}': [pd.Timestamp(2025, 1, rng.randint(1, 28)) if rng.random() < 0.8 else pd.NaT
+                                       for _ in range(rows)] for j in range(columns)})
+    df = pd.DataFrame({f'c{j}': [rng.choice(CELLS) for _ in range(rows)] for j in range(columns)})
+    return df.infer_objects() if kind < 0.5 else df
+
+
+def same(expected, actual):
+    return expected.equals(actual) and list(expected.index) == list(actual.index)
+
+
+def check(cleaner, df):
+    """True when both clean_dataframe paths match the reference on `df`"""
+    expected = reference_clean_dataframe(df)
+    return (same(expected, cleaner.clean_dataframe(df))
+            and same(expected, cleaner.clean_dataframe(df, on_rows=lambda rows, total: None)))
+
+
+def factsheet_frames(sizes, seed):
+    """Yield (label, frame) for generated workbooks read the way requests read them"""
+    cleaner = Cleaner()
+    for size in sizes:
+        upload = convert.UploadedFile.from_bytes(generate_factsheet(size, seed), filename='factsheet.xlsx')
+        for engine in convert.EXCEL_ENGINES:
+            header_row, _ = cleaner.resolve_header_row('', upload, engine)
+            yield f'{size} rows ({engine})', cleaner.read_excel(upload, header_row, engine)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=1000, help='random frames to compare')
+    parser.add_argument('--sizes', default='100,5000', help='comma-separated scheme rows of generated factsheets')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    # Blocks of a few rows, so the random frames span several of them
+    convert.CLEAN_PROGRESS_ROWS = 4
+
+    cleaner = Cleaner()
+    failures = 0
+    for label, df in factsheet_frames([int(size) for size in args.sizes.split(',')], args.seed):
+        ok = check(cleaner, df)
+        failures += not ok
+        print(f'{label:24} {len(df):>7} rows -> {len(cleaner.clean_dataframe(df)):>7}  {"ok" if ok else "MISMATCH"}')
+
+    rng = random.Random(args.seed)
+    random_failures = 0
+    for _ in range(args.frames):
+        df = random_frame(rng)
+        if not check(cleaner, df):
+            random_failures += 1
+            if random_failures <= 3:
+                print('Mismatch on:', df, sep='\n')
+    print(f'{args.frames} random frames: {random_failures} mismatches')
+
+    sys.exit(1 if failures or random_failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+Measure import time and cold-start latency of api/convert.py.
+
+Every sample runs in a fresh interpreter, the way a serverless cold start
+does: it imports convert, sends one request through `handler` in-process
+and reports the import time, the request time and whether the request
+needed pandas. --eager-pandas imports pandas before convert, which is what every
+cold start paid when convert.py imported it at the top:
+
+    python scripts/cold_start.py
+    python scripts/cold_start.py --actions get_preview,get_headers --runs 10 --eager-pandas
+    python scripts/cold_start.py --importtime    # heaviest imports (python -X importtime)
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(ROOT, 'api')
+
+DEFAULT_ACTIONS = ('upload', 'get_preview', 'get_headers', 'convert')
+
+
+def child(action, path, eager_pandas):
+    """One sample, in a fresh interpreter: print a JSON line with its timings"""
+    start = time.perf_counter()
+    if eager_pandas:
+        import pandas  # noqa: F401
+    sys.path.insert(0, API_DIR)
+    import convert
+    imported = time.perf_counter()
+    # benchmark imports convert (and so must not be imported before it is
+    # timed) but not pandas, so the request still finds it unloaded
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from benchmark import _Socket, encode_multipart
+
+    class QuietHandler(convert.handler):
+        def log_request_metrics(self):
+            pass
+
+        def log_message(self, format, *args):
+            pass
+
+    with open(path, 'rb') as f:
+        body, content_type = encode_multipart({'action': action}, f.read())
+    head = (f'POST /api/convert HTTP/1.1\r\nHost: localhost\r\n'
+            f'Content-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n')
+    sock = _Socket(head.encode() + body)
+    sent = time.perf_counter()
+    QuietHandler(sock, ('127.0.0.1', 0), None)
+    done = time.perf_counter()
+
+    status = int(sock.response.getvalue().split(b' ', 2)[1])
+    print(json.dumps({
+        'status': status,
+        'import_seconds': imported - start,
+        'request_seconds': done - sent,
+        # The request itself used pandas, as opposed to the background import
+        # convert starts once it has responded
+        'pandas_used': not isinstance(convert.pd, convert.LazyModule),
+    }))
+
+
+def run_sample(action, path, eager_pandas):
+    command = [sys.executable, os.path.abspath(__file__), '--child', action, path]
+    if eager_pandas:
+        command.append('--eager-pandas')
+    start = time.perf_counter()
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    sample = json.loads(output.strip().splitlines()[-1])
+    sample['process_seconds'] = time.perf_counter() - start
+    return sample
+
+
+def print_importtime(limit):
+    """Show the modules with the largest cumulative import time for convert"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import convert'],
+                            cwd=API_DIR, capture_output=True, text=True, check=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, module = [part.strip() for part in line.split(':', 1)[1].split('|')]
+        if self_us.isdigit():
+            entries.append((int(cumulative_us), int(self_us), module))
+    entries.sort(reverse=True)
+    print(f'{"cumulative":>12} {"self":>10}  module')
+    for cumulative_us, self_us, module in entries[:limit]:
+        print(f'{cumulative_us / 1000:>10.1f}ms {self_us / 1000:>8.1f}ms  {module}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--actions', default=','.join(DEFAULT_ACTIONS), help='comma-separated actions to time')
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per action')
+    parser.add_argument('--rows', type=int, default=1000, help='scheme rows in the generated workbook')
+    parser.add_argument('--workbook', help='time this workbook instead of a generated one')
+    parser.add_argument('--eager-pandas', action='store_true', help='import pandas before convert in every sample')
+    parser.add_argument('--importtime', action='store_true', help='list the heaviest imports and exit')
+    parser.add_argument('--child', nargs=2, metavar=('ACTION', 'WORKBOOK'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child[0], args.child[1], args.eager_pandas)
+        return
+    if args.importtime:
+        print_importtime(20)
+        return
+
+    path = args.workbook
+    if path is None:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from benchmark import generate_factsheet
+        with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as f:
+            f.write(generate_factsheet(args.rows))
+            path = f.name
+
+    print(f'{"action":14} {"import":>9} {"request":>9} {"process":>9}  pandas  ({args.runs} fresh processes'
+          f'{", pandas imported first" if args.eager_pandas else ""}, medians)')
+    try:
+        for action in args.actions.split(','):
+            samples = [run_sample(action, path, args.eager_pandas) for _ in range(args.runs)]
+            failed = [sample['status'] for sample in samples if sample['status'] != 200]
+            print(f'{action:14} '
+                  f'{statistics.median(s["import_seconds"] for s in samples) * 1000:>7.0f}ms '
+                  f'{statistics.median(s["request_seconds"] for s in samples) * 1000:>7.0f}ms '
+                  f'{statistics.median(s["process_seconds"] for s in samples) * 1000:>7.0f}ms  '
+                  f'{"yes" if any(s["pandas_used"] for s in samples) else "no":6}'
+                  f'{"  status " + str(failed[0]) if failed else ""}')
+    finally:
+        if args.workbook is None:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
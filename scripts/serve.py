@@ -0,0 +1,346 @@
+"""
+Serve the app on a pre-forked pool of worker processes, for self-hosted
+deployments outside Vercel.
+
+The master process opens one listen socket and forks --workers processes
+that all accept from it, so CPU-bound conversions run on several cores at
+once. Each worker imports api/convert.py itself and handles requests on
+--threads threads fed by a bounded admission queue of --queue connections;
+a worker whose threads and queue are all taken answers 503 instead of
+letting requests pile up. Static files (index.html, script.js, style.css)
+are served too.
+
+    python scripts/serve.py --port 8000 --workers 4 --max-requests 500
+
+Signals to the master:
+    SIGHUP           graceful restart: start new workers (which re-import
+                     convert.py), then let the old ones finish and exit
+    SIGTERM, SIGINT  graceful shutdown, killing workers still busy after
+                     --graceful-timeout seconds
+
+A stopping worker also waits for its background jobs (async=1) and marks
+those still unfinished at --graceful-timeout as failed.
+
+Uploaded workbooks are stored under WORKBOOK_STORE_DIR (a temporary
+directory by default) so every worker can serve the review steps, and
+ASYNC_JOBS=1 is set so the UI exports large workbooks as background jobs.
+POSIX only, since workers are forked.
+"""
+import argparse
+import os
+import queue
+import select
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(ROOT, 'api')
+
+STATIC_FILES = {
+    '/': ('index.html', 'text/html; charset=utf-8'),
+    '/index.html': ('index.html', 'text/html; charset=utf-8'),
+    '/script.js': ('script.js', 'application/javascript; charset=utf-8'),
+    '/style.css': ('style.css', 'text/css; charset=utf-8'),
+}
+
+# How long a worker with no free thread waits before taking a connection, so
+# that idle workers get the first chance to accept it
+BUSY_ACCEPT_DELAY_SECONDS = 0.05
+# Part of --graceful-timeout a stopping worker keeps for marking the
+# background jobs it could not finish as failed
+JOB_FAIL_MARGIN_SECONDS = 1
+
+OVERLOADED_RESPONSE = (
+    b'HTTP/1.1 503 Service Unavailable\r\n'
+    b'Content-Type: application/json\r\n'
+    b'Access-Control-Allow-Origin: *\r\n'
+    b'Retry-After: 1\r\n'
+    b'Connection: close\r\n'
+    b'Content-Length: 67\r\n'
+    b'\r\n'
+    b'{"success": false, "error": "Server is busy, please retry shortly"}'
+)
+
+
+def load_app():
+    """
+    Import convert.py and return its handler extended with GET for the
+    static files. Called in each worker after the fork, so a restart picks
+    up new code.
+    """
+    sys.path.insert(0, API_DIR)
+    import convert
+
+    class AppHandler(convert.handler):
+        def do_GET(self):
+            path = self.path.split('?', 1)[0]
+            if path not in STATIC_FILES:
+                self.send_error_response(404, 'Not found')
+                return
+            filename, content_type = STATIC_FILES[path]
+            with open(os.path.join(ROOT, filename), 'rb') as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return AppHandler
+
+
+class Worker:
+    """
+    One forked worker. The main thread accepts connections from the shared
+    socket into the admission queue and `threads` handler threads serve
+    them. After `max_requests` connections (0 for no limit) or on SIGTERM
+    it stops accepting, finishes the queued requests and background jobs
+    (within `graceful_timeout` seconds) and exits.
+    """
+
+    def __init__(self, listen_socket, threads, queue_size, max_requests, timeout, graceful_timeout):
+        self.socket = listen_socket
+        self.threads = threads
+        self.max_requests = max_requests
+        self.timeout = timeout
+        self.graceful_timeout = graceful_timeout
+        self.queue_size = queue_size
+        self.pending = queue.Queue()
+        self.busy = 0
+        self.stopping = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda *_: self.stopping.set())
+        signal.signal(signal.SIGINT, lambda *_: self.stopping.set())
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        self.app = load_app()
+        self.server = SimpleNamespace(server_address=self.socket.getsockname())
+
+        threads = [threading.Thread(target=self.serve, daemon=True) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        self.accept_loop()
+        # The master kills workers --graceful-timeout seconds after SIGTERM;
+        # keep a little of that to mark unfinished jobs failed
+        deadline = time.monotonic() + self.graceful_timeout - JOB_FAIL_MARGIN_SECONDS
+        for _ in threads:
+            self.pending.put(None)
+        for thread in threads:
+            thread.join()
+        self.drain_jobs(max(deadline - time.monotonic(), 0))
+
+    def drain_jobs(self, timeout):
+        """Let convert's background jobs finish before the process exits"""
+        import convert
+        failed = convert.job_runner.shutdown(timeout)
+        if failed:
+            print(f'Worker {os.getpid()} failed {failed} unfinished jobs', file=sys.stderr, flush=True)
+
+    def idle_threads(self):
+        with self._lock:
+            return self.threads - self.busy - self.pending.qsize()
+
+    def accept_loop(self):
+        accepted = 0
+        while not self.stopping.is_set() and (not self.max_requests or accepted < self.max_requests):
+            readable, _, _ = select.select([self.socket], [], [], 1.0)
+            if not readable:
+                continue
+            if self.idle_threads() <= 0:
+                # Every thread is busy: leave the connection to an idle
+                # worker if there is one, otherwise queue or refuse it below
+                time.sleep(BUSY_ACCEPT_DELAY_SECONDS)
+                readable, _, _ = select.select([self.socket], [], [], 0)
+                if not readable:
+                    continue
+            try:
+                conn, address = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                # Another worker took it
+                continue
+            conn.setblocking(True)
+            conn.settimeout(self.timeout)
+            if self.idle_threads() > 0 or self.pending.qsize() < self.queue_size:
+                self.pending.put((conn, address))
+                accepted += 1
+            else:
+                self.reject(conn)
+
+    def reject(self, conn):
+        try:
+            conn.sendall(OVERLOADED_RESPONSE)
+            conn.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def serve(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            conn, address = item
+            with self._lock:
+                self.busy += 1
+            try:
+                self.app(conn, address, self.server)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                try:
+                    conn.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+                conn.close()
+                with self._lock:
+                    self.busy -= 1
+
+
+class Master:
+    """
+    Owns the listen socket and keeps `workers` worker processes running,
+    replacing any that exit. Workers are tagged with a generation; SIGHUP
+    starts a new generation and retires the old one.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.workers = {}
+        self.generation = 0
+        self.reload = False
+        self.stopping = False
+
+    def run(self):
+        args = self.args
+        self.socket = socket.create_server((args.host, args.port), backlog=args.backlog)
+        self.socket.setblocking(False)
+        signal.signal(signal.SIGHUP, self.on_reload)
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+
+        host, port = self.socket.getsockname()[:2]
+        print(f'Listening on http://{host}:{port} with {args.workers} workers '
+              f'({args.threads} threads, queue {args.queue} each)', file=sys.stderr, flush=True)
+        self.spawn_workers()
+        while not self.stopping:
+            self.reap()
+            if self.reload:
+                self.reload = False
+                self.restart()
+            for _ in range(args.workers - self.current_workers()):
+                self.spawn()
+            time.sleep(0.2)
+        self.shutdown()
+
+    def on_reload(self, *_):
+        self.reload = True
+
+    def on_stop(self, *_):
+        self.stopping = True
+
+    def current_workers(self):
+        return sum(1 for generation in self.workers.values() if generation == self.generation)
+
+    def spawn_workers(self):
+        for _ in range(self.args.workers):
+            self.spawn()
+
+    def spawn(self):
+        args = self.args
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                Worker(self.socket, args.threads, args.queue, args.max_requests, args.timeout,
+                       args.graceful_timeout).run()
+            except BaseException:
+                traceback.print_exc()
+                status = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(status)
+        self.workers[pid] = self.generation
+
+    def reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            generation = self.workers.pop(pid, None)
+            if generation == self.generation and os.waitstatus_to_exitcode(status) != 0:
+                print(f'Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}',
+                      file=sys.stderr, flush=True)
+
+    def restart(self):
+        old = [pid for pid, generation in self.workers.items() if generation == self.generation]
+        self.generation += 1
+        print(f'Restarting: {len(old)} old workers', file=sys.stderr, flush=True)
+        self.spawn_workers()
+        for pid in old:
+            self.signal(pid, signal.SIGTERM)
+
+    def shutdown(self):
+        print('Shutting down', file=sys.stderr, flush=True)
+        for pid in self.workers:
+            self.signal(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.args.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in self.workers:
+            self.signal(pid, signal.SIGKILL)
+        self.generation += 1
+        while self.workers:
+            self.reap()
+            time.sleep(0.05)
+        self.socket.close()
+
+    def signal(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--threads', type=int, default=2, help='request threads per worker')
+    parser.add_argument('--queue', type=int, default=4,
+                        help='connections a worker accepts beyond its busy threads before answering 503')
+    parser.add_argument('--max-requests', type=int, default=0,
+                        help='replace a worker after this many requests (0: never)')
+    parser.add_argument('--timeout', type=float, default=60, help='socket timeout per connection, in seconds')
+    parser.add_argument('--graceful-timeout', type=float, default=30,
+                        help='seconds workers get to finish their requests and jobs on shutdown')
+    parser.add_argument('--backlog', type=int, default=128, help='listen socket backlog')
+    args = parser.parse_args()
+    if not hasattr(os, 'fork'):
+        parser.error('serve.py forks its workers and needs a POSIX system')
+    args.workers = max(args.workers, 1)
+    args.threads = max(args.threads, 1)
+    args.queue = max(args.queue, 0)
+
+    # Workers share uploaded workbooks through the filesystem
+    os.environ.setdefault('WORKBOOK_STORE_DIR', os.path.join(tempfile.gettempdir(), 'newfunds-workbooks'))
+    # Workers keep running between requests, so the UI can use background jobs
+    os.environ.setdefault('ASYNC_JOBS', '1')
+    Master(args).run()
+
+
+if __name__ == '__main__':
+    main()